@@ -5,6 +5,9 @@ from app.api.v1 import auth as auth_router
 from app.api.v1 import users as users_router
 from app.api.v1 import lectures as lectures_router
 from app.api.v1 import tests as tests_router
+from app.api.v1 import uploads as uploads_router
+from app.api.v1 import media as media_router
+from app.api.v1 import search as search_router
 
 api_router = APIRouter()
 
@@ -13,3 +16,6 @@ api_router.include_router(users_router.router, tags=["users"])
 api_router.include_router(admin_router.router, tags=["admin"])
 api_router.include_router(lectures_router.router, tags=["lectures"])
 api_router.include_router(tests_router.router, prefix="/tests", tags=["tests"])
+api_router.include_router(uploads_router.router, tags=["uploads"])
+api_router.include_router(media_router.router, tags=["media"])
+api_router.include_router(search_router.router, tags=["search"])
@@ -13,7 +13,7 @@ from sqlalchemy import and_
 
 from app.core.security import require_admin
 from app.core.database import get_db
-from app.models import Course, Group, User, course_groups
+from app.models import Course, EmbeddingModel, Group, User, course_groups
 from app.core.security import pwd_context
 from app.schemas import (
     CreateCourseRequest,
@@ -32,6 +32,10 @@ from app.utils import (
     normalize_name,
     resolve_user_names,
 )
+from app.utils.embedding_backends import get_embedding_backend
+from app.utils.llm_output import get_question_generation_stats
+from app.utils.reembedding import serialize_embedding_model, start_reembedding
+from app.utils.scheduler import get_scheduler_stats
 
 logger = logging.getLogger(__name__)
 
@@ -596,6 +600,48 @@ def delete_course(
     return {"message": "Курс успешно удален"}
 
 
+@router.get("/admin/embeddings")
+def get_embedding_models(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_admin),
+):
+    """Модели эмбеддингов: активная модель, модель из настроек и прогресс перевекторизации"""
+    models = db.query(EmbeddingModel).order_by(EmbeddingModel.model).all()
+    return {
+        "configured": get_embedding_backend().model_key,
+        "active": next((state.model for state in models if state.status == "active"), None),
+        "models": [serialize_embedding_model(state) for state in models],
+    }
+
+
+@router.post("/admin/embeddings/reembed")
+def start_embedding_reembed(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_admin),
+):
+    """Запуск или продолжение перевекторизации материалов моделью из настроек"""
+    state = start_reembedding(db)
+    if state is None:
+        raise HTTPException(status_code=400, detail="Модель эмбеддингов из настроек уже активна")
+    return serialize_embedding_model(state)
+
+
+@router.get("/admin/question-generation/stats")
+def get_question_generation_counters(
+    current_user: User = Depends(require_admin),
+):
+    """Счетчики генерации вопросов в этом процессе: запросы к LLM, валидные вопросы и режимы сбоев разбора"""
+    return get_question_generation_stats()
+
+
+@router.get("/admin/scheduler")
+def get_scheduler_state(
+    current_user: User = Depends(require_admin),
+):
+    """Пулы планировщика обработки в этом процессе: потоки, очереди по преподавателям, среднее ожидание"""
+    return get_scheduler_stats()
+
+
 @router.get("/admin/export_users")
 def export_users(
     role: Optional[str] = Query(None, description="Фильтр по роли: teacher или student"),
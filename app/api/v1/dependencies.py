@@ -80,15 +80,15 @@ def require_lecture_access(
     Raises:
         HTTPException: Если доступ запрещен
     """
-    lecture = db.query(Lecture).filter(Lecture.id == lecture_id).first()
+    # Загружаем лекцию вместе с курсом, его groups и teachers одним запросом (избегаем N+1)
+    lecture = db.query(Lecture).options(
+        joinedload(Lecture.course).joinedload(Course.groups),
+        joinedload(Lecture.course).joinedload(Course.teachers)
+    ).filter(Lecture.id == lecture_id).first()
     if not lecture:
         raise HTTPException(status_code=404, detail="Лекция не найдена")
     
-    # Получаем курс для проверки доступа с предзагрузкой groups и teachers (избегаем N+1)
-    course = db.query(Course).options(
-        joinedload(Course.groups),
-        joinedload(Course.teachers)
-    ).filter(Course.id == lecture.course_id).first()
+    course = lecture.course
     if not course:
         raise HTTPException(status_code=404, detail="Курс не найден")
     
@@ -178,7 +178,8 @@ def require_material_access(
         require_published=require_published
     )
     
-    course = db.query(Course).filter(Course.id == lecture.course_id).first()
+    # Курс уже загружен вместе с лекцией
+    course = lecture.course
     if not course:
         raise HTTPException(status_code=404, detail="Курс не найден")
     
@@ -1,6 +1,6 @@
 """API эндпоинты для работы с лекциями"""
 import os
-import shutil
+import asyncio
 import logging
 import subprocess
 from datetime import datetime
@@ -10,6 +10,7 @@ from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Backgro
 from fastapi.responses import JSONResponse, StreamingResponse
 import json
 import threading
+import time
 from sqlalchemy.orm import Session
 from sqlalchemy import create_engine
 from app.core.database import engine
@@ -18,12 +19,14 @@ logger = logging.getLogger(__name__)
 
 # Импорт модуля транскрибации
 from app.utils.transcription import (
-    transcribe_file, 
+    TRANSCRIPT_SEPARATOR,
+    transcribe_segments,
     find_ffmpeg, 
     ensure_ffmpeg_in_path,
     WHISPER_AVAILABLE
 )
 
+from app.core.config import HLS_ENABLED, LECTURE_EVENTS_HEARTBEAT_SECONDS, MEDIA_URL_TTL_SECONDS
 from app.core.database import get_db
 from app.core.security import get_current_user
 from app.core.limiter import limiter
@@ -33,34 +36,45 @@ from app.api.v1.dependencies import (
     require_lecture_teacher_access,
     require_material_access
 )
-from app.models import Course, Lecture, LectureMaterial, ProcessedMaterial, User, Test, Question
+from app.models import ChunkEmbedding, Course, Lecture, LectureMaterial, MaterialChunk, ProcessedMaterial, User
 from app.schemas import CreateLectureRequest, UpdateLectureRequest, LectureMaterialResponse, LectureResponse, TestResponse, QuestionResponse
+from app.utils.file_serving import (
+    MaterialFile,
+    forget_material_file,
+    get_cached_material_file,
+    guess_media_type,
+    remember_material_file,
+    serve_material_file,
+)
+from app.utils.chunking import chunk_blocks
+from app.utils.documents import BLOCK_SEPARATOR, get_parser, iter_document_blocks
+from app.utils.hls import package_hls, remove_hls
+from app.utils.lecture_events import TERMINAL_STAGES, format_sse, get_latest_events, publish_event, subscribe, unsubscribe
+from app.utils.lecture_updates import is_processed_current, lecture_needs_update, materials_to_process, update_lecture_test
+from app.utils.lecture_processing import (
+    ACTIVE_STATUSES,
+    FAILED,
+    HEARTBEAT_SECONDS,
+    MATERIAL_DONE,
+    MATERIAL_FAILED,
+    MATERIAL_RUNNING,
+    PARTIAL,
+    PUBLISHED,
+    claim_lecture_processing,
+    finish_lecture_processing,
+    serialize_processing_state,
+    set_material_state,
+    start_lecture_processing,
+    touch_lecture_processing,
+)
+from app.utils.scheduler import DOCUMENTS, LLM, TRANSCRIPTION, submit_job
+from app.utils.signed_urls import MEDIA_ROOT, sign_media_path
+from app.utils.test_policy import invalidate_test_policy
+from app.utils.test_snapshots import invalidate_test_snapshot, warm_test_snapshot
+from app.utils.uploads import create_material_record, detect_file_type, safe_file_name, save_upload_file
 
 router = APIRouter()
 
-# Директория для хранения файлов лекций
-UPLOAD_DIR = Path("uploads/lectures")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-
-# Импорты для парсинга файлов
-try:
-    import PyPDF2
-    PDF_PARSER_AVAILABLE = True
-except ImportError:
-    PDF_PARSER_AVAILABLE = False
-
-try:
-    import pdfplumber
-    PDFPLUMBER_AVAILABLE = True
-except ImportError:
-    PDFPLUMBER_AVAILABLE = False
-
-try:
-    from docx import Document
-    DOCX_PARSER_AVAILABLE = True
-except ImportError:
-    DOCX_PARSER_AVAILABLE = False
-
 
 @router.get("/courses/{course_id}/lectures", response_model=List[LectureResponse])
 def get_course_lectures(
@@ -110,6 +124,7 @@ def get_course_lectures(
             test_max_attempts=lecture.test_max_attempts or 1,
             test_show_answers=lecture.test_show_answers or False,
             test_deadline=lecture.test_deadline,
+            processing_status=lecture.processing_status,
             materials=[LectureMaterialResponse(
                 id=m.id,
                 file_path=m.file_path,
@@ -166,6 +181,7 @@ def create_lecture(
         test_max_attempts=lecture.test_max_attempts or 1,
         test_show_answers=lecture.test_show_answers or False,
         test_deadline=lecture.test_deadline,
+        processing_status=lecture.processing_status,
         materials=[]
     )
 
@@ -213,6 +229,7 @@ def get_lecture(
         test_max_attempts=lecture.test_max_attempts or 1,
         test_show_answers=lecture.test_show_answers or False,
         test_deadline=lecture.test_deadline,
+        processing_status=lecture.processing_status,
         materials=[{
             "id": m.id,
             "file_path": m.file_path,
@@ -253,6 +270,9 @@ def update_lecture(
     
     db.commit()
     
+    # Настройки теста могли измениться - сбрасываем скомпилированную политику
+    invalidate_test_policy(lecture_id)
+    
     # Перезагружаем лекцию с предзагрузкой материалов (избегаем N+1)
     from sqlalchemy.orm import selectinload
     lecture = db.query(Lecture).options(
@@ -278,6 +298,7 @@ def update_lecture(
         test_max_attempts=lecture.test_max_attempts or 1,
         test_show_answers=lecture.test_show_answers or False,
         test_deadline=lecture.test_deadline,
+        processing_status=lecture.processing_status,
         materials=[{
             "id": m.id,
             "file_path": m.file_path,
@@ -301,6 +322,7 @@ def delete_lecture(
     
     db.delete(lecture)
     db.commit()
+    invalidate_test_policy(lecture_id)
     
     return {"message": "Лекция удалена"}
 
@@ -310,146 +332,38 @@ def delete_lecture(
 def upload_material(
     request: Request,
     lecture_id: int,
+    background_tasks: BackgroundTasks,
     lecture: Lecture = Depends(require_lecture_teacher_access),
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    """Загрузка материала для лекции"""
+    """Загрузка материала для лекции (для больших файлов используйте возобновляемую загрузку /uploads)"""
     # Проверка доступа выполнена через зависимость require_lecture_teacher_access
     
-    # Определяем тип файла
-    file_extension = Path(file.filename).suffix.lower()
-    file_type_map = {
-        '.mp4': 'video', '.avi': 'video', '.mov': 'video', '.mkv': 'video', '.webm': 'video',
-        '.pdf': 'pdf',
-        '.pptx': 'presentation', '.ppt': 'presentation',
-        '.mp3': 'audio', '.wav': 'audio', '.ogg': 'audio', '.m4a': 'audio',
-        '.zip': 'scorm', '.scorm': 'scorm'
-    }
-    file_type = file_type_map.get(file_extension, 'other')
-    
-    # Определяем максимальный размер файла в зависимости от типа
-    MAX_VIDEO_SIZE = 20 * 1024 * 1024  # 20 МБ для видео
-    MAX_AUDIO_SIZE = 20 * 1024 * 1024  # 20 МБ для аудио
-    MAX_PDF_SIZE = 10 * 1024 * 1024    # 10 МБ для PDF
-    MAX_OTHER_SIZE = 50 * 1024 * 1024  # 50 МБ для других типов (SCORM, презентации)
-    
-    if file_type == 'video':
-        max_size = MAX_VIDEO_SIZE
-        max_size_mb = 20
-    elif file_type == 'audio':
-        max_size = MAX_AUDIO_SIZE
-        max_size_mb = 20
-    elif file_type == 'pdf':
-        max_size = MAX_PDF_SIZE
-        max_size_mb = 10
-    else:
-        max_size = MAX_OTHER_SIZE
-        max_size_mb = 50
-    
-    # Проверяем размер файла перед сохранением
-    # Читаем файл по частям и проверяем размер
-    file_size = 0
-    chunk_size = 1024 * 1024  # 1 МБ за раз
-    temp_file_path = None
+    file_name = safe_file_name(file.filename)
+    file_type = detect_file_type(file_name)
     
+    # Копируем файл сразу в директорию лекции, проверяя размер по ходу записи
     try:
-        # Создаем временный файл для проверки размера
-        import tempfile
-        temp_fd, temp_file_path = tempfile.mkstemp()
-        temp_file = os.fdopen(temp_fd, 'wb')
-        
-        # Сбрасываем позицию файла на начало (на случай если он уже был прочитан)
-        file.file.seek(0)
-        
-        # Читаем файл по частям и проверяем размер
-        while True:
-            chunk = file.file.read(chunk_size)
-            if not chunk:
-                break
-            
-            file_size += len(chunk)
-            
-            # Проверяем размер на каждой итерации
-            if file_size > max_size:
-                temp_file.close()
-                os.unlink(temp_file_path)
-                raise HTTPException(
-                    status_code=413,
-                    detail=f"Файл слишком большой. Максимальный размер для {file_type}: {max_size_mb} МБ. Размер вашего файла: {file_size / (1024 * 1024):.2f} МБ"
-                )
-            
-            temp_file.write(chunk)
-        
-        temp_file.close()
-        
-        # Проверяем финальный размер
-        if file_size > max_size:
-            os.unlink(temp_file_path)
-            raise HTTPException(
-                status_code=413,
-                detail=f"Файл слишком большой. Максимальный размер для {file_type}: {max_size_mb} МБ. Размер вашего файла: {file_size / (1024 * 1024):.2f} МБ"
-            )
-        
-        # Создаем директорию для лекции
-        lecture_dir = UPLOAD_DIR / str(lecture_id)
-        lecture_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Перемещаем временный файл в финальное место
-        file_path = lecture_dir / file.filename
-        shutil.move(temp_file_path, file_path)
-        temp_file_path = None  # Уже перемещен
-        
+        file_size, content_hash = save_upload_file(file.file, lecture_id, file_name, file_type)
     except HTTPException:
         # Перебрасываем HTTPException
         raise
     except Exception as e:
-        # Очищаем временный файл при ошибке
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
         logger.error(f"Ошибка при загрузке файла {file.filename}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при загрузке файла: {str(e)}")
     
-    # Получаем текущий максимальный order_index
-    max_order = db.query(LectureMaterial).filter(LectureMaterial.lecture_id == lecture_id).count()
-    
-    # Сохраняем относительный путь для доступа через статику
-    # Формируем путь как uploads/lectures/{lecture_id}/{filename}
-    relative_path_str = f"uploads/lectures/{lecture_id}/{file.filename}"
-    
-    # Создаем запись о материале
-    # Используем уже вычисленный file_size вместо повторного чтения размера файла
-    material = LectureMaterial(
-        lecture_id=lecture_id,
-        file_path=relative_path_str,
-        file_type=file_type,
-        file_name=file.filename,
-        file_size=file_size,  # Используем размер, вычисленный при проверке
-        order_index=max_order
-    )
-    
-    db.add(material)
-    db.commit()
-    db.refresh(material)
-    
-    return {
-        "id": material.id,
-        "file_path": material.file_path,
-        "file_type": material.file_type,
-        "file_name": material.file_name,
-        "file_size": material.file_size,
-        "order_index": material.order_index
-    }
+    material = create_material_record(db, lecture_id, file_name, file_type, file_size, content_hash)
+    schedule_lecture_update(db, lecture, current_user.id, background_tasks)
+    return material
 
 
 @router.delete("/lectures/{lecture_id}/materials/{material_id}")
 def delete_material(
     lecture_id: int,
     material_id: int,
+    background_tasks: BackgroundTasks,
     lecture: Lecture = Depends(require_lecture_teacher_access),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
@@ -472,8 +386,14 @@ def delete_material(
     if file_path.exists():
         file_path.unlink()
     
+    remove_hls(lecture_id, material_id)
+    
     db.delete(material)
     db.commit()
+    forget_material_file(material_id)
+    
+    # Вопросы по удаленному материалу убираются из общего теста
+    schedule_lecture_update(db, lecture, current_user.id, background_tasks)
     
     return {"message": "Материал удален"}
 
@@ -551,54 +471,6 @@ def get_material_content(
         })
 
 
-def parse_pdf(file_path: Path) -> str:
-    """Парсинг PDF файла и извлечение текста"""
-    text_content = []
-    
-    # Пробуем использовать pdfplumber (более точный)
-    if PDFPLUMBER_AVAILABLE:
-        try:
-            with pdfplumber.open(file_path) as pdf:
-                for i, page in enumerate(pdf.pages, 1):
-                    page_text = page.extract_text()
-                    if page_text:
-                        text_content.append(f"--- Страница {i} ---\n\n{page_text}")
-            return "\n\n".join(text_content) if text_content else "Текст не найден в PDF"
-        except Exception as e:
-            print(f"Ошибка pdfplumber: {e}")
-    
-    # Fallback на PyPDF2
-    if PDF_PARSER_AVAILABLE:
-        try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for i, page in enumerate(pdf_reader.pages, 1):
-                    page_text = page.extract_text()
-                    if page_text:
-                        text_content.append(f"--- Страница {i} ---\n\n{page_text}")
-            return "\n\n".join(text_content) if text_content else "Текст не найден в PDF"
-        except Exception as e:
-            print(f"Ошибка PyPDF2: {e}")
-    
-    raise Exception("Библиотеки для парсинга PDF не установлены")
-
-
-def parse_docx(file_path: Path) -> str:
-    """Парсинг Word документа и извлечение текста"""
-    if not DOCX_PARSER_AVAILABLE:
-        raise Exception("Библиотека python-docx не установлена")
-    
-    try:
-        doc = Document(file_path)
-        paragraphs = []
-        for para in doc.paragraphs:
-            if para.text.strip():
-                paragraphs.append(para.text)
-        return "\n\n".join(paragraphs) if paragraphs else "Текст не найден в документе"
-    except Exception as e:
-        raise Exception(f"Ошибка парсинга Word: {str(e)}")
-
-
 @router.get("/materials/{material_id}/transcribe")
 def transcribe_video(
     material_id: int,
@@ -661,14 +533,14 @@ def transcribe_video(
 
 
 
-@router.get("/materials/{material_id}/file")
-def get_material_file(
-    material_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
-):
-    """Получение файла материала с проверкой прав доступа"""
-    from fastapi.responses import FileResponse
+def resolve_material_file(material_id: int, db: Session, current_user: User) -> MaterialFile:
+    """
+    Файл материала после проверки прав доступа.
+    Недавняя проверка доступа переиспользуется: повторные запросы (перемотка видео, 304) не ходят в БД.
+    """
+    material_file = get_cached_material_file(current_user.id, material_id)
+    if material_file is not None:
+        return material_file
     
     # Проверяем доступ через зависимость
     material, lecture, course = require_material_access(
@@ -678,31 +550,63 @@ def get_material_file(
         require_published=False  # Файлы доступны даже для неопубликованных лекций (для преподавателей)
     )
     
-    # Проверяем существование файла
     file_path = Path(material.file_path)
     if not file_path.is_absolute():
         file_path = Path.cwd() / file_path
     
-    if not file_path.exists():
+    material_file = MaterialFile(
+        path=file_path,
+        file_name=material.file_name,
+        media_type=guess_media_type(material.file_name, material.file_type),
+        content_hash=material.content_hash,
+        hls_path=material.hls_path
+    )
+    remember_material_file(current_user.id, material_id, material_file)
+    return material_file
+
+
+@router.get("/materials/{material_id}/file")
+def get_material_file(
+    material_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Получение файла материала с проверкой прав доступа (поддерживает Range и условные запросы)"""
+    return serve_material_file(request, resolve_material_file(material_id, db, current_user))
+
+
+@router.get("/materials/{material_id}/url")
+def get_material_url(
+    material_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Подписанная ссылка на файл материала с ограниченным сроком действия.
+    Права проверяются один раз при выдаче, дальше файл отдается без JWT и запросов к БД
+    (ссылку можно передать напрямую в <video>/<audio>).
+    """
+    material_file = resolve_material_file(material_id, db, current_user)
+    
+    # Подписываются только файлы из директории uploads
+    try:
+        relative_path = material_file.path.relative_to(Path.cwd() / MEDIA_ROOT)
+    except ValueError:
         raise HTTPException(status_code=404, detail="Файл не найден")
     
-    # Определяем media type
-    media_type_map = {
-        'video': 'video/mp4',
-        'pdf': 'application/pdf',
-        'audio': 'audio/mpeg',
-        'presentation': 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+    response = {
+        "url": sign_media_path(relative_path.as_posix()),
+        "hls_url": None,
+        "expires_in": MEDIA_URL_TTL_SECONDS
     }
-    media_type = media_type_map.get(material.file_type, 'application/octet-stream')
     
-    return FileResponse(
-        path=str(file_path),
-        media_type=media_type,
-        filename=material.file_name,
-        headers={
-            "Content-Disposition": f'inline; filename="{material.file_name}"'
-        }
-    )
+    # Для HLS подписываем директорию целиком: плейлисты качеств и сегменты открываются по той же подписи
+    if material_file.hls_path:
+        hls_parts = Path(material_file.hls_path).relative_to(MEDIA_ROOT).parts
+        response["hls_url"] = sign_media_path("/".join(hls_parts), scope_parts=len(hls_parts) - 1)
+    
+    return response
 
 
 def process_single_material(material: LectureMaterial, lecture_id: int, user_id: int) -> tuple[bool, Optional[str], Optional[list], Optional[str]]:
@@ -711,17 +615,23 @@ def process_single_material(material: LectureMaterial, lecture_id: int, user_id:
     Возвращает: (success, processed_text, embedding, error_message)
     """
     from app.core.database import SessionLocal
-    from app.utils.embeddings import generate_embedding
+    from app.utils.embedding_backends import GigaChatBackend, get_active_backend
+    from app.utils.embeddings import combine_embeddings, embed_chunks
+    from app.utils.reembedding import get_target_backends
     
+    backend = get_active_backend()
     db = SessionLocal()
     try:
+        set_material_state(db, lecture_id, material.id, MATERIAL_RUNNING)
+        db.commit()
+        
         # Проверяем, не обработан ли уже этот материал
         existing = db.query(ProcessedMaterial).filter(
             ProcessedMaterial.material_id == material.id
         ).first()
         
-        if existing:
-            # Материал уже обработан
+        if is_processed_current(material, existing):
+            # Материал уже обработан из того же содержимого
             return (True, existing.processed_text, None, None)
         
         # Получаем путь к файлу
@@ -736,6 +646,8 @@ def process_single_material(material: LectureMaterial, lecture_id: int, user_id:
         file_url = f"/api/materials/{material.id}/file"
         
         processed_text = None
+        segments = None
+        chunk_embeddings = []
         
         # Обработка в зависимости от типа файла
         video_exts = ['.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv', '.webm', '.m4v', '.3gp']
@@ -767,66 +679,127 @@ def process_single_material(material: LectureMaterial, lecture_id: int, user_id:
                 
                 # Транскрибируем синхронно (это уже выполняется в фоновом потоке)
                 from app.core.config import WHISPER_MODEL
-                processed_text = transcribe_file(file_path, WHISPER_MODEL)
-                logger.info(f"Транскрибация завершена: {material.file_name}, длина текста: {len(processed_text) if processed_text else 0} символов")
+                publish_event(lecture_id, "transcribing", material.id, file_name=material.file_name, progress=0.0)
+                last_heartbeat = time.monotonic()
+                
+                def report_progress(progress: float) -> None:
+                    nonlocal last_heartbeat
+                    publish_event(
+                        lecture_id, "transcribing", material.id, file_name=material.file_name, progress=round(progress, 3)
+                    )
+                    # Долгая транскрибация не должна выглядеть как прерванная обработка
+                    if time.monotonic() - last_heartbeat >= HEARTBEAT_SECONDS:
+                        last_heartbeat = time.monotonic()
+                        # Отдельная сессия: коммит не должен затрагивать незавершенные изменения материала
+                        heartbeat_db = SessionLocal()
+                        try:
+                            touch_lecture_processing(heartbeat_db, lecture_id)
+                            heartbeat_db.commit()
+                        except Exception as e:
+                            heartbeat_db.rollback()
+                            logger.warning(f"Не удалось обновить состояние обработки лекции {lecture_id}: {e}")
+                        finally:
+                            heartbeat_db.close()
+                
+                segments = transcribe_segments(file_path, WHISPER_MODEL, on_progress=report_progress)
+                processed_text = TRANSCRIPT_SEPARATOR.join(segment.text for segment in segments)
+                logger.info(f"Транскрибация завершена: {material.file_name}, длина текста: {len(processed_text)} символов")
                 
             except Exception as e:
                 logger.error(f"Ошибка транскрибации {material.file_name}: {e}", exc_info=True)
                 return (False, None, None, f"Ошибка транскрибации {material.file_name}: {str(e)}")
         
-        elif material.file_type == 'pdf':
-            # Парсинг PDF синхронно
+        else:
+            # Документы (PDF, DOCX, DOC, PPTX, текст) разбираются парсером из реестра
+            media_type = guess_media_type(material.file_name, material.file_type)
+            parser = get_parser(material.file_name, media_type)
+            if parser is not None:
+                block_texts = []
+
+                def collect_blocks(blocks):
+                    for block in blocks:
+                        block_texts.append(block.text)
+                        yield block
+
+                try:
+                    # Чанки собираются и векторизуются по мере разбора документа
+                    publish_event(lecture_id, "extracting", material.id, file_name=material.file_name)
+                    chunk_embeddings = list(embed_chunks(chunk_blocks(collect_blocks(
+                        iter_document_blocks(file_path, material.file_name, media_type)
+                    )), backend))
+                    processed_text = BLOCK_SEPARATOR.join(block_texts)
+                    logger.info(f"Извлечен текст ({parser.name}): {material.file_name}, {len(processed_text)} символов, {len(chunk_embeddings)} чанков")
+                except Exception as e:
+                    logger.error(f"Ошибка извлечения текста из {material.file_name}: {e}")
+                    return (False, None, None, f"Ошибка извлечения текста из {material.file_name}: {str(e)}")
+        
+        if segments:
+            publish_event(lecture_id, "embedding", material.id, file_name=material.file_name)
             try:
-                import pdfplumber
-                text_parts = []
-                with pdfplumber.open(str(file_path)) as pdf:
-                    for page in pdf.pages:
-                        text = page.extract_text()
-                        if text:
-                            text_parts.append(text)
-                processed_text = "\n\n".join(text_parts)
-                logger.info(f"Распарсен PDF: {material.file_name}")
-                
+                chunk_embeddings = list(embed_chunks(chunk_blocks(segments), backend))
             except Exception as e:
-                logger.error(f"Ошибка парсинга PDF {material.file_name}: {e}")
-                return (False, None, None, f"Ошибка парсинга PDF {material.file_name}: {str(e)}")
+                logger.error(f"Ошибка генерации эмбеддингов для {material.file_name}: {e}", exc_info=True)
         
-        elif material.file_name.endswith('.docx') or material.file_name.endswith('.doc'):
-            # Парсинг DOCX синхронно
+        # Во время перевекторизации чанки сразу векторизуются и новой моделью
+        target_embeddings = []
+        for target in get_target_backends(db):
+            if target.model_key == backend.model_key:
+                continue
             try:
-                from docx import Document
-                doc = Document(str(file_path))
-                text_parts = []
-                for paragraph in doc.paragraphs:
-                    if paragraph.text.strip():
-                        text_parts.append(paragraph.text)
-                processed_text = "\n\n".join(text_parts)
-                logger.info(f"Распарсен DOCX: {material.file_name}")
-                
+                chunks = [chunk for chunk, _ in chunk_embeddings]
+                target_embeddings.append((target, [vector for _, vector in embed_chunks(chunks, target)]))
             except Exception as e:
-                logger.error(f"Ошибка парсинга DOCX {material.file_name}: {e}")
-                return (False, None, None, f"Ошибка парсинга DOCX {material.file_name}: {str(e)}")
+                # Пропущенные чанки пересчитает задание перевекторизации
+                logger.warning(f"Не удалось получить эмбеддинги {target.model_key} для {material.file_name}: {e}")
         
-        # Генерируем эмбеддинг для текста, если он есть
+        # Эмбеддинг материала целиком - нормализованная сумма эмбеддингов его чанков.
+        # Колонка processed_materials.embedding хранит векторы GigaChat размерности 1024, векторы других моделей есть только у чанков
         embedding = None
+        if backend.kind == GigaChatBackend.kind and backend.dimension == 1024:
+            embedding = combine_embeddings([chunk_embedding for _, chunk_embedding in chunk_embeddings if chunk_embedding])
         if processed_text and processed_text.strip():
-            try:
-                text_for_embedding = processed_text.strip()
-                
-                # Генерируем эмбеддинг синхронно
-                embedding = generate_embedding(
-                    text_for_embedding,
-                    use_chunks=True,
-                    chunk_size=2000,
-                    overlap=200
-                )
-                
-                if embedding:
-                    logger.info(f"Сгенерирован эмбеддинг для материала: {material.file_name}")
-                else:
-                    logger.warning(f"Эмбеддинг не был сгенерирован для {material.file_name}")
-            except Exception as e:
-                logger.error(f"Ошибка генерации эмбеддинга для {material.file_name}: {e}", exc_info=True)
+            if embedding:
+                logger.info(f"Сгенерирован эмбеддинг для материала: {material.file_name}")
+            else:
+                logger.warning(f"Эмбеддинг не был сгенерирован для {material.file_name}")
+        
+        # Чанки с эмбеддингами и положением в тексте материала (для поиска и RAG)
+        db.query(MaterialChunk).filter(MaterialChunk.material_id == material.id).delete(synchronize_session=False)
+        for position, (chunk, chunk_embedding) in enumerate(chunk_embeddings):
+            material_chunk = MaterialChunk(
+                lecture_id=lecture_id,
+                material_id=material.id,
+                chunk_index=chunk.chunk_index,
+                text=chunk.text,
+                token_count=chunk.token_count,
+                block_kind=chunk.block_kind,
+                first_block=chunk.first_block,
+                last_block=chunk.last_block,
+                start_offset=chunk.start_offset,
+                end_offset=chunk.end_offset,
+                start_time=chunk.start_time,
+                end_time=chunk.end_time
+            )
+            if chunk_embedding:
+                material_chunk.embeddings.append(ChunkEmbedding(
+                    model=backend.model_key,
+                    dimension=backend.dimension,
+                    embedding=chunk_embedding
+                ))
+            for target, target_vectors in target_embeddings:
+                if target_vectors[position]:
+                    material_chunk.embeddings.append(ChunkEmbedding(
+                        model=target.model_key,
+                        dimension=target.dimension,
+                        embedding=target_vectors[position]
+                    ))
+            db.add(material_chunk)
+        
+        # Файл заменен: старый текст удаляется в той же транзакции, в которой сохраняется новый,
+        # чтобы при ошибке обработки прежний результат остался на месте
+        if existing:
+            db.delete(existing)
+            db.flush()
         
         # Сохраняем обработанный материал
         processed_material = ProcessedMaterial(
@@ -837,7 +810,8 @@ def process_single_material(material: LectureMaterial, lecture_id: int, user_id:
             file_type=material.file_type,
             processed_text=processed_text,
             embedding=embedding,
-            processed_at=datetime.now().isoformat()
+            processed_at=datetime.now().isoformat(),
+            content_hash=material.content_hash
         )
         db.add(processed_material)
         db.commit()
@@ -853,56 +827,158 @@ def process_single_material(material: LectureMaterial, lecture_id: int, user_id:
         db.close()
 
 
+def package_lecture_videos_hls(lecture_id: int):
+    """Упаковывает в HLS видео материалы лекции, у которых еще нет HLS версии"""
+    from app.core.database import SessionLocal
+    
+    db = SessionLocal()
+    try:
+        videos = db.query(LectureMaterial).filter(
+            LectureMaterial.lecture_id == lecture_id,
+            LectureMaterial.file_type == 'video',
+            LectureMaterial.hls_path.is_(None)
+        ).all()
+        for material in videos:
+            file_path = Path(material.file_path)
+            if not file_path.is_absolute():
+                file_path = Path.cwd() / file_path
+            if not file_path.exists():
+                continue
+            
+            hls_path = package_hls(file_path, lecture_id, material.id)
+            if hls_path:
+                material.hls_path = hls_path
+                db.commit()
+                forget_material_file(material.id)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Ошибка упаковки HLS для лекции {lecture_id}: {e}", exc_info=True)
+    finally:
+        db.close()
+
+
+# Расширения видео и аудио: такие материалы обрабатываются в пуле транскрибации
+MEDIA_EXTENSIONS = {
+    '.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv', '.webm', '.m4v', '.3gp',
+    '.mp3', '.wav', '.flac', '.aac', '.m4a', '.ogg', '.wma', '.opus'
+}
+
+# Сколько проходов обработки подряд выполняет один фоновый запуск, если материалы меняются во время обработки
+LECTURE_UPDATE_MAX_PASSES = 3
+
+
+def submit_material_processing(material: LectureMaterial, lecture_id: int, user_id: int):
+    """
+    Ставит обработку материала в общий планировщик: видео и аудио - в пул транскрибации, остальное - в пул документов.
+    Очередь справедлива между преподавателями, стоимость задачи - размер файла в МБ.
+    """
+    resource = TRANSCRIPTION if Path(material.file_name).suffix.lower() in MEDIA_EXTENSIONS else DOCUMENTS
+    cost = (material.file_size or 0) / (1024 * 1024)
+    return submit_job(resource, f"teacher:{user_id}", cost, process_single_material, material, lecture_id, user_id)
+
+
 def process_lecture_materials_background(lecture_id: int, user_id: int):
     """
     Фоновая обработка материалов лекции.
     Выполняется в отдельном потоке, чтобы не блокировать основной event loop.
+    Обрабатываются только новые и измененные материалы; у опубликованной лекции обновляются
+    их чанки и вопросы по ним в общем тесте.
+    Материалы, измененные во время обработки, обрабатываются следующими проходами (не больше LECTURE_UPDATE_MAX_PASSES).
     """
     from app.core.database import SessionLocal
-    from concurrent.futures import ThreadPoolExecutor, as_completed
     
+    for pass_number in range(1, LECTURE_UPDATE_MAX_PASSES + 1):
+        if not _process_lecture_materials_pass(lecture_id, user_id):
+            return
+        if pass_number == LECTURE_UPDATE_MAX_PASSES:
+            logger.warning(
+                f"Материалы лекции {lecture_id} менялись во время {pass_number} проходов обработки подряд, "
+                f"оставшиеся изменения обработает следующая публикация"
+            )
+            return
+        db = SessionLocal()
+        try:
+            if queue_lecture_processing(db, lecture_id) is None:
+                return
+        except Exception as e:
+            logger.warning(f"Не удалось поставить в очередь повторную обработку лекции {lecture_id}: {e}")
+            return
+        finally:
+            db.close()
+
+
+def _process_lecture_materials_pass(lecture_id: int, user_id: int) -> bool:
+    """Один проход обработки материалов лекции; True, если после него лекцию нужно обработать снова"""
+    from app.core.database import SessionLocal
+    from concurrent.futures import as_completed
+    
+    rerun = False
     db = SessionLocal()
     try:
         lecture = db.query(Lecture).filter(Lecture.id == lecture_id).first()
         if not lecture:
             logger.error(f"Лекция {lecture_id} не найдена для фоновой обработки")
-            return
+            publish_event(lecture_id, "failed", error="Лекция не найдена")
+            return False
         
-        # Получаем все материалы лекции
-        materials = db.query(LectureMaterial).filter(LectureMaterial.lecture_id == lecture_id).all()
+        # Повторная публикация во время обработки не запускает вторую обработку
+        started = start_lecture_processing(db, lecture_id)
+        db.commit()
+        if not started:
+            logger.info(f"Обработка лекции {lecture_id} уже выполняется другим процессом, запуск пропущен")
+            return False
         
-        if not materials:
+        if not db.query(LectureMaterial.id).filter(LectureMaterial.lecture_id == lecture_id).first():
             logger.warning(f"Лекция {lecture_id} не содержит материалов")
-            return
+            finish_lecture_processing(db, lecture_id, FAILED, "Лекция не содержит материалов")
+            db.commit()
+            publish_event(lecture_id, "failed", error="Лекция не содержит материалов")
+            return False
         
-        logger.info(f"Начало фоновой обработки {len(materials)} материалов для лекции {lecture_id}")
+        # Только новые и измененные материалы: у остальных обработанный текст и чанки актуальны
+        materials = materials_to_process(db, lecture_id)
+        logger.info(f"Начало фоновой обработки {len(materials)} новых или измененных материалов для лекции {lecture_id}")
         
-        # Обрабатываем материалы параллельно используя ThreadPoolExecutor
         processed_count = 0
         errors = []
         
-        # Используем ThreadPoolExecutor для параллельной обработки
-        with ThreadPoolExecutor(max_workers=min(len(materials), 4)) as executor:
-            # Запускаем обработку всех материалов
-            future_to_material = {
-                executor.submit(process_single_material, material, lecture_id, user_id): material
-                for material in materials
-            }
-            
-            # Собираем результаты
-            for future in as_completed(future_to_material):
-                material = future_to_material[future]
-                try:
-                    result = future.result()
-                    if isinstance(result, tuple):
-                        success, _, _, error = result
-                        if success:
-                            processed_count += 1
-                        elif error:
-                            errors.append(error)
-                except Exception as e:
-                    errors.append(f"Ошибка обработки {material.file_name}: {str(e)}")
-                    logger.error(f"Исключение при обработке материала {material.file_name}: {e}", exc_info=True)
+        # Материалы обрабатываются параллельно в общих пулах планировщика (число потоков ограничено на процесс)
+        future_to_material = {
+            submit_material_processing(material, lecture_id, user_id): material
+            for material in materials
+        }
+        
+        # Собираем результаты
+        for materials_done, future in enumerate(as_completed(future_to_material), start=1):
+            material = future_to_material[future]
+            success, error = False, None
+            try:
+                result = future.result()
+                if isinstance(result, tuple):
+                    success, _, _, error = result
+                    if success:
+                        processed_count += 1
+                    elif error:
+                        errors.append(error)
+            except Exception as e:
+                error = f"Ошибка обработки {material.file_name}: {str(e)}"
+                errors.append(error)
+                logger.error(f"Исключение при обработке материала {material.file_name}: {e}", exc_info=True)
+            try:
+                set_material_state(db, lecture_id, material.id, MATERIAL_DONE if success else MATERIAL_FAILED, error)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"Не удалось сохранить состояние материала {material.id}: {e}")
+            publish_event(
+                lecture_id,
+                "material_done" if success else "material_failed",
+                material.id,
+                file_name=material.file_name,
+                materials_done=materials_done,
+                materials_total=len(materials),
+                error=error
+            )
         
         # Публикуем лекцию ТОЛЬКО если ВСЕ материалы успешно обработаны
         db_refresh = SessionLocal()
@@ -910,7 +986,7 @@ def process_lecture_materials_background(lecture_id: int, user_id: int):
             lecture_refresh = db_refresh.query(Lecture).filter(Lecture.id == lecture_id).first()
             if not lecture_refresh:
                 logger.error(f"Лекция {lecture_id} не найдена при публикации")
-                return
+                return False
             
             if processed_count == len(materials) and len(errors) == 0:
                 # Используем транзакцию для атомарности: публикация лекции + генерация теста
@@ -919,80 +995,112 @@ def process_lecture_materials_background(lecture_id: int, user_id: int):
                     lecture_refresh.published = True
                     logger.info(f"Публикация лекции {lecture_id}. Обработано: {processed_count}/{len(materials)}")
                     
-                    # Генерируем тест, если нужно (в той же транзакции)
+                    # Обновление общего теста, если нужно (в той же транзакции): заново генерируются
+                    # только вопросы по обработанным сейчас материалам
+                    test = None
                     if lecture_refresh.generate_test and lecture_refresh.test_generation_mode == "once":
-                        from app.utils.rag import generate_questions_from_text
-                        
+                        publish_event(lecture_id, "generating_test")
                         logger.info(f"Начинаем генерацию теста для лекции {lecture_id}")
                         
-                        processed_materials = db_refresh.query(ProcessedMaterial).filter(
-                            ProcessedMaterial.lecture_id == lecture_id,
-                            ProcessedMaterial.processed_text.isnot(None)
-                        ).all()
-                        
-                        all_questions = []
-                        order_index = 0
-                        
-                        for pm in processed_materials:
-                            if not pm.processed_text or not pm.processed_text.strip():
-                                continue
-                            
-                            text = pm.processed_text.strip()
-                            text_length = len(text)
-                            
-                            if text_length < 500:
-                                num_questions = 2
-                            elif text_length < 1500:
-                                num_questions = 2 if text_length < 1000 else 3
-                            else:
-                                num_questions = 3
-                            
-                            questions_data = generate_questions_from_text(text, num_questions=num_questions)
-                            
-                            if questions_data and len(questions_data) > 0:
-                                for q_data in questions_data:
-                                    q_data["order_index"] = order_index
-                                    order_index += 1
-                                all_questions.extend(questions_data)
-                        
-                        if all_questions and len(all_questions) > 0:
-                            test = Test(
-                                lecture_id=lecture_id,
-                                created_at=datetime.now().isoformat()
-                            )
-                            db_refresh.add(test)
-                            db_refresh.flush()
-                            
-                            for q_data in all_questions:
-                                question = Question(
-                                    test_id=test.id,
-                                    question_text=q_data["question_text"],
-                                    correct_answer=q_data["correct_answer"],
-                                    options=q_data.get("options"),
-                                    question_type=q_data["question_type"],
-                                    order_index=q_data["order_index"]
-                                )
-                                db_refresh.add(question)
+                        # Запросы к LLM выполняются в пуле планировщика; сессия используется только этой задачей,
+                        # текущий поток ждет её завершения
+                        test = submit_job(
+                            LLM,
+                            f"teacher:{user_id}",
+                            len(materials),
+                            update_lecture_test,
+                            db_refresh,
+                            lecture_id,
+                            [material.id for material in materials],
+                            seed=lecture_id
+                        ).result()
                         
-                        logger.info(f"✅ Подготовлен тест из {len(all_questions)} вопросов для лекции {lecture_id}")
+                        if test is not None:
+                            logger.info(f"✅ Обновлены вопросы теста {test.id} для лекции {lecture_id}")
                     
                     # Коммитим все изменения атомарно
+                    finish_lecture_processing(db_refresh, lecture_id, PUBLISHED)
                     db_refresh.commit()
                     logger.info(f"Лекция {lecture_id} успешно опубликована. Обработано: {processed_count}/{len(materials)}")
+                    publish_event(lecture_id, "published", materials_done=processed_count, materials_total=len(materials))
+                    
+                    # Готовим снимок теста заранее, чтобы первые студенты получили его из памяти
+                    if test is not None:
+                        invalidate_test_snapshot(test.id)
+                        warm_test_snapshot(db_refresh, test.id)
+                    
+                    # Материалы, измененные во время обработки, обрабатываются следующим проходом
+                    rerun = lecture_needs_update(db_refresh, lecture_refresh)
                 except Exception as e:
                     # Откатываем транзакцию при любой ошибке
                     db_refresh.rollback()
                     logger.error(f"❌ Ошибка при публикации лекции {lecture_id}: {e}. Транзакция откачена.", exc_info=True)
+                    finish_lecture_processing(db_refresh, lecture_id, FAILED, f"Ошибка при публикации лекции: {str(e)}")
+                    db_refresh.commit()
+                    publish_event(lecture_id, "failed", error=f"Ошибка при публикации лекции: {str(e)}")
                     raise
             else:
                 logger.warning(f"Не удалось обработать все материалы для лекции {lecture_id}. Обработано: {processed_count}/{len(materials)}, ошибки: {errors}")
+                # Обработанные материалы сохранены: повторная публикация обработает только оставшиеся
+                finish_lecture_processing(
+                    db_refresh,
+                    lecture_id,
+                    PARTIAL if processed_count else FAILED,
+                    "\n".join(errors) or "Не все материалы удалось обработать"
+                )
+                db_refresh.commit()
+                publish_event(
+                    lecture_id,
+                    "failed",
+                    materials_done=processed_count,
+                    materials_total=len(materials),
+                    error="Не все материалы удалось обработать",
+                    errors=errors
+                )
         finally:
             db_refresh.close()
         
+        # Необязательный этап: HLS для видео (после публикации, чтобы не задерживать её перекодированием)
+        if HLS_ENABLED:
+            package_lecture_videos_hls(lecture_id)
+        
     except Exception as e:
         logger.error(f"Критическая ошибка при фоновой обработке лекции {lecture_id}: {e}", exc_info=True)
+        try:
+            db.rollback()
+            finish_lecture_processing(db, lecture_id, FAILED, str(e))
+            db.commit()
+        except Exception as state_error:
+            logger.warning(f"Не удалось сохранить состояние обработки лекции {lecture_id}: {state_error}")
     finally:
         db.close()
+    return rerun
+
+
+def queue_lecture_processing(db: Session, lecture_id: int) -> Optional[int]:
+    """
+    Ставит в очередь обработку новых и измененных материалов лекции (переход в queued).
+    Возвращает количество материалов для обработки или None, если обработка уже выполняется.
+    """
+    materials = materials_to_process(db, lecture_id)
+    claimed = claim_lecture_processing(db, lecture_id, materials)
+    db.commit()
+    if not claimed:
+        return None
+    publish_event(lecture_id, "queued", materials_done=0, materials_total=len(materials))
+    return len(materials)
+
+
+def schedule_lecture_update(db: Session, lecture: Lecture, user_id: int, background_tasks: BackgroundTasks) -> None:
+    """
+    После добавления или удаления материала опубликованной лекции обрабатывает только изменившееся.
+    Если обработка уже идет, изменения подхватит её следующий проход.
+    """
+    if not lecture.published or not lecture_needs_update(db, lecture):
+        return
+    if queue_lecture_processing(db, lecture.id) is not None:
+        background_tasks.add_task(process_lecture_materials_background, lecture.id, user_id)
+        logger.info(f"Запущено обновление материалов опубликованной лекции {lecture.id}")
 
 
 @router.post("/lectures/{lecture_id}/publish")
@@ -1005,34 +1113,123 @@ def publish_lecture(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    """Публикация лекции: запускает фоновую обработку материалов (транскрибация, парсинг, эмбеддинги)"""
+    """
+    Публикация лекции: запускает фоновую обработку материалов (транскрибация, парсинг, эмбеддинги).
+    Для опубликованной лекции обрабатываются только новые и измененные материалы.
+    """
     logger.info(f"Запрос на публикацию лекции {lecture_id} от пользователя {current_user.id}")
     
     # Проверка доступа выполнена через зависимость require_lecture_teacher_access
     
     # Получаем все материалы лекции
-    materials = db.query(LectureMaterial).filter(LectureMaterial.lecture_id == lecture_id).all()
+    materials_count = db.query(LectureMaterial).filter(LectureMaterial.lecture_id == lecture_id).count()
     
-    if not materials:
+    if not materials_count:
         raise HTTPException(status_code=400, detail="Лекция не содержит материалов")
     
-    # Проверяем, не запущена ли уже обработка
-    if lecture.published:
+    # Опубликованную лекцию обрабатываем, только если её материалы изменились
+    published = lecture.published or False
+    if published and not lecture_needs_update(db, lecture):
         return JSONResponse({
             "message": "Лекция уже опубликована",
             "published": True,
             "processing": False
         })
     
+    # Повторный запрос во время обработки присоединяется к уже запущенной обработке
+    pending_count = queue_lecture_processing(db, lecture_id)
+    if pending_count is None:
+        db.refresh(lecture)
+        logger.info(f"Обработка лекции {lecture_id} уже выполняется, повторный запуск не требуется")
+        return JSONResponse({
+            "message": "Обработка материалов уже выполняется. Лекция будет опубликована после её завершения.",
+            "lecture_id": lecture_id,
+            "materials_count": materials_count,
+            "processing": lecture.processing_status in ACTIVE_STATUSES,
+            "published": lecture.published or False,
+            "processing_state": serialize_processing_state(lecture)
+        })
+    
     # Запускаем фоновую обработку материалов
     background_tasks.add_task(process_lecture_materials_background, lecture_id, current_user.id)
     
-    logger.info(f"Запущена фоновая обработка материалов для лекции {lecture_id}")
+    logger.info(f"Запущена фоновая обработка {pending_count} материалов для лекции {lecture_id}")
     
     return JSONResponse({
         "message": "Обработка материалов начата. Лекция будет опубликована после завершения обработки всех материалов.",
         "lecture_id": lecture_id,
-        "materials_count": len(materials),
+        "materials_count": pending_count,
         "processing": True,
-        "published": False
+        "published": published
     })
+
+
+@router.get("/lectures/{lecture_id}/processing")
+def get_lecture_processing(
+    lecture: Lecture = Depends(require_lecture_teacher_access),
+):
+    """Состояние обработки материалов лекции: общее, по каждому материалу, ошибки и время (чтение одной строки)"""
+    return JSONResponse(serialize_processing_state(lecture))
+
+
+@router.get("/lectures/{lecture_id}/events")
+async def lecture_processing_events(
+    request: Request,
+    lecture_id: int,
+    lecture: Lecture = Depends(require_lecture_teacher_access),
+    db: Session = Depends(get_db),
+):
+    """
+    Прогресс обработки материалов лекции (Server-Sent Events).
+    Сначала отправляется текущее состояние, затем события по мере обработки; поток закрывается после публикации или ошибки.
+    """
+    state = serialize_processing_state(lecture)
+    # Соединение с БД не удерживается на всё время подключения клиента
+    db.close()
+
+    subscription = subscribe(lecture_id)
+    initial_events = get_latest_events(lecture_id)
+    if not initial_events:
+        # Событий в памяти нет (обработка шла в другом процессе или до перезапуска): состояние из строки лекции
+        if state["status"] in ACTIVE_STATUSES:
+            initial_events = [{
+                "lecture_id": lecture_id,
+                "stage": state["status"],
+                "materials_done": state["materials_done"],
+                "materials_total": state["materials_total"]
+            }]
+        elif state["published"]:
+            initial_events = [{"lecture_id": lecture_id, "stage": "published"}]
+        elif state["status"] in (FAILED, PARTIAL):
+            initial_events = [{
+                "lecture_id": lecture_id,
+                "stage": "failed",
+                "error": state["error"],
+                "materials_done": state["materials_done"],
+                "materials_total": state["materials_total"]
+            }]
+
+    async def event_stream():
+        try:
+            for event in initial_events:
+                yield format_sse(event)
+            if any(event["stage"] in TERMINAL_STAGES for event in initial_events[-1:]):
+                return
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=LECTURE_EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Комментарий SSE: не дает прокси закрыть соединение по простою
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_sse(event)
+                if event["stage"] in TERMINAL_STAGES:
+                    return
+        finally:
+            unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,51 @@
+"""Отдача файлов материалов по подписанным ссылкам (без JWT и запросов к БД)"""
+import logging
+from urllib.parse import quote
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+
+from app.core.config import MEDIA_ACCEL_REDIRECT_PREFIX
+from app.utils.file_serving import IMMUTABLE_CACHE_CONTROL, MaterialFile, guess_media_type, serve_material_file
+from app.utils.signed_urls import MEDIA_ROOT, seconds_left, verify_media_token
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.get("/media/{token}/{file_path:path}")
+def get_media_file(token: str, file_path: str, request: Request):
+    """
+    Файл по подписанной ссылке.
+    Права доступа проверены при выдаче ссылки, здесь проверяется только подпись и срок действия.
+    """
+    path = verify_media_token(token, file_path)
+    if path is None:
+        raise HTTPException(status_code=403, detail="Ссылка недействительна или истекла")
+    
+    if path.suffix.lower() == ".ts":
+        # Сегменты HLS неизменны - кэшируем надолго
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    else:
+        cache_control = f"private, max-age={seconds_left(token)}"
+    
+    # В продакшене файл отдает nginx (sendfile), приложение только проверяет подпись
+    if MEDIA_ACCEL_REDIRECT_PREFIX:
+        relative_path = path.relative_to(MEDIA_ROOT).as_posix()
+        return Response(headers={
+            "X-Accel-Redirect": MEDIA_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(relative_path),
+            "Content-Type": guess_media_type(path.name, ""),
+            "Cache-Control": cache_control,
+        })
+    
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Файл не найден")
+    
+    material_file = MaterialFile(
+        path=path,
+        file_name=path.name,
+        media_type=guess_media_type(path.name, ""),
+        content_hash=None
+    )
+    return serve_material_file(request, material_file, cache_control)
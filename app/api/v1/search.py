@@ -0,0 +1,48 @@
+"""API эндпоинты поиска по материалам курса"""
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.orm import Session
+
+from app.core.config import SEARCH_MIN_QUERY_LENGTH
+from app.core.database import get_db
+from app.core.limiter import limiter
+from app.core.security import get_current_user
+from app.api.v1.dependencies import require_course_access
+from app.models import Course, Lecture, User
+from app.utils.search import normalize_query, search_chunks
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.get("/courses/{course_id}/search")
+@limiter.limit("120/minute")
+def search_course_materials(
+    request: Request,
+    course_id: int,
+    q: str = Query(..., max_length=500),
+    limit: int = Query(10, ge=1, le=50),
+    course: Course = Depends(require_course_access),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Семантический поиск по материалам всех доступных пользователю лекций курса"""
+    # Проверка доступа выполнена через зависимость require_course_access
+
+    query = normalize_query(q)
+    if len(query) < SEARCH_MIN_QUERY_LENGTH:
+        return {"query": query, "results": []}
+
+    # Студент ищет только по опубликованным лекциям
+    lectures_query = db.query(Lecture.id, Lecture.name).filter(Lecture.course_id == course_id)
+    if current_user.role == "student":
+        lectures_query = lectures_query.filter(Lecture.published == True)
+    lecture_names = {lecture_id: name for lecture_id, name in lectures_query.all()}
+
+    results = search_chunks(db, query, lecture_names, limit)
+    if results is None:
+        raise HTTPException(status_code=503, detail="Поиск временно недоступен: не удалось обработать запрос")
+
+    return {"query": query, "results": results}
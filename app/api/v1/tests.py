@@ -1,16 +1,41 @@
 """API эндпоинты для работы с тестами"""
 import json
 import logging
+import random
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import JSONResponse
+from typing import Optional
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import func, or_, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
+from app.core.config import QUESTION_VARIANTS
 from app.core.database import get_db
+from app.core.limiter import limiter
 from app.core.security import get_current_user
 from app.api.v1.dependencies import require_lecture_access, require_lecture_teacher_access
-from app.models import Test, Question, Lecture, User, Course, ProcessedMaterial, TestAttempt, Group
-from app.schemas import TestResponse, QuestionResponse
+from app.models import Test, Question, Lecture, User, Course, TestAttempt, Group, GradebookEntry
+from app.utils.grading import (
+    AnswerKey,
+    attempt_columns,
+    get_answer_key,
+    load_attempt_answers,
+    pack_correct_mask,
+    parse_choice,
+    unpack_correct_mask,
+)
+from app.utils.item_analysis import get_item_analysis
+from app.utils.lecture_updates import add_generated_test, get_shared_test, replace_test_questions
+from app.utils.test_policy import get_test_policy
+from app.utils.test_snapshots import (
+    get_attempts_count,
+    get_test_snapshot,
+    invalidate_test_snapshot,
+    record_attempts_count,
+    warm_test_snapshot,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -18,65 +43,18 @@ logger = logging.getLogger(__name__)
 def generate_test_for_student(db: Session, lecture_id: int, student_id: int) -> Test:
     """Генерирует тест для конкретного студента"""
     try:
-        from app.utils.rag import generate_questions_from_text
+        from app.utils.rag import generate_lecture_questions
         
         logger.info(f"Генерируем тест для студента {student_id} по лекции {lecture_id}")
         
-        # Получаем обработанные материалы
-        processed_materials = db.query(ProcessedMaterial).filter(
-            ProcessedMaterial.lecture_id == lecture_id,
-            ProcessedMaterial.processed_text.isnot(None)
-        ).all()
-        
-        all_questions = []
-        order_index = 0
-        
-        # Генерируем вопросы для каждого файла отдельно
-        for pm in processed_materials:
-            if not pm.processed_text or not pm.processed_text.strip():
-                continue
-            
-            text = pm.processed_text.strip()
-            text_length = len(text)
-            
-            # Определяем количество вопросов
-            if text_length < 500:
-                num_questions = 2
-            elif text_length < 1500:
-                num_questions = 2 if text_length < 1000 else 3
-            else:
-                num_questions = 3
-            
-            # Генерируем вопросы
-            questions_data = generate_questions_from_text(text, num_questions=num_questions)
-            
-            if questions_data and len(questions_data) > 0:
-                for q_data in questions_data:
-                    q_data["order_index"] = order_index
-                    order_index += 1
-                all_questions.extend(questions_data)
+        # Вопросы по каждому файлу отдельно; фрагменты выбираются по варианту студента,
+        # студенты с одним вариантом получают вопросы из кэша ответов LLM
+        seed = student_id % QUESTION_VARIANTS if QUESTION_VARIANTS > 0 else student_id
+        all_questions = generate_lecture_questions(db, lecture_id, seed=seed)
         
         if all_questions and len(all_questions) > 0:
-            # Создаем тест
-            test = Test(
-                lecture_id=lecture_id,
-                created_at=datetime.now().isoformat(),
-                user_id=student_id  # Связываем тест со студентом для режима "per_student"
-            )
-            db.add(test)
-            db.flush()
-            
-            # Создаем вопросы
-            for q_data in all_questions:
-                question = Question(
-                    test_id=test.id,
-                    question_text=q_data["question_text"],
-                    correct_answer=q_data["correct_answer"],
-                    options=q_data.get("options"),
-                    question_type=q_data["question_type"],
-                    order_index=q_data["order_index"]
-                )
-                db.add(question)
+            # Связываем тест со студентом для режима "per_student"
+            test = add_generated_test(db, lecture_id, all_questions, user_id=student_id)
             
             # Используем транзакцию для атомарности создания теста и вопросов
             try:
@@ -95,85 +73,138 @@ def generate_test_for_student(db: Session, lecture_id: int, student_id: int) ->
         logger.error(f"Ошибка генерации теста для студента {student_id}: {e}", exc_info=True)
         return None
 
+
+def build_attempt_results(
+    key: AnswerKey,
+    chosen: np.ndarray,
+    is_correct: np.ndarray,
+    answer_texts: list,
+    show_answers: bool,
+) -> list[dict]:
+    """Формирует результаты попытки по вопросам теста для истории попыток"""
+    results = []
+    for pos, question_id in enumerate(key.question_ids):
+        # Для вопросов с вариантами показываем текст выбранного варианта
+        if key.multiple_choice[pos]:
+            student_answer = key.option_text(pos, int(chosen[pos])) or ""
+        else:
+            student_answer = answer_texts[pos] or ""
+        
+        results.append({
+            "question_id": question_id,
+            "question_text": key.question_texts[pos],
+            "student_answer": student_answer,
+            # Правильный ответ передаем только если show_answers = True
+            "correct_answer": key.correct_answers[pos] if show_answers else "",
+            "is_correct": bool(is_correct[pos]),
+            "options": key.options_json[pos]
+        })
+    return results
+
+
+# Количество повторов сохранения попытки при конфликте номера попытки
+SUBMIT_ATTEMPT_RETRIES = 3
+
+# Вставка попытки со следующим номером; строка не вставляется, если лимит попыток исчерпан.
+# В том же запросе сохраняются проверенные ответы (attempt_answers)
+# и обновляется строка ведомости студента (gradebook_entries).
+SUBMIT_ATTEMPT_SQL = text("""
+    WITH new_attempt AS (
+        INSERT INTO test_attempts (test_id, user_id, answers, score, total_questions, completed_at, attempt_number)
+        SELECT :test_id, :user_id, :answers, :score, :total_questions, :completed_at,
+               COALESCE(MAX(attempt_number), 0) + 1
+        FROM test_attempts
+        WHERE test_id = :test_id AND user_id = :user_id
+        HAVING CAST(:max_attempts AS INTEGER) IS NULL
+            OR COALESCE(MAX(attempt_number), 0) < CAST(:max_attempts AS INTEGER)
+        RETURNING id, test_id, user_id, score, total_questions, completed_at, attempt_number
+    ), answer_rows AS (
+        INSERT INTO attempt_answers (attempt_id, question_id, chosen_index, is_correct, answer_text)
+        SELECT new_attempt.id, a.question_id, a.chosen_index, a.is_correct, a.answer_text
+        FROM new_attempt
+        CROSS JOIN unnest(
+            CAST(:question_ids AS INTEGER[]),
+            CAST(:chosen_indexes AS INTEGER[]),
+            CAST(:correct_flags AS BOOLEAN[]),
+            CAST(:answer_texts AS TEXT[])
+        ) AS a(question_id, chosen_index, is_correct, answer_text)
+    ), gradebook AS (
+        INSERT INTO gradebook_entries AS gb (
+            lecture_id, test_id, user_id, attempts_count, best_score, best_total, last_score,
+            total_questions, score_sum, questions_sum, last_attempt_id, last_completed_at, last_correct_mask
+        )
+        SELECT :lecture_id, test_id, user_id, attempt_number, score, total_questions, score,
+               total_questions, score, total_questions, id, completed_at, :correct_mask
+        FROM new_attempt
+        ON CONFLICT (test_id, user_id) DO UPDATE SET
+            -- Лучший результат - по доле правильных ответов (количество вопросов могло измениться)
+            best_score = CASE WHEN EXCLUDED.best_score * gb.best_total > gb.best_score * EXCLUDED.best_total
+                OR gb.best_total = 0 THEN EXCLUDED.best_score ELSE gb.best_score END,
+            best_total = CASE WHEN EXCLUDED.best_score * gb.best_total > gb.best_score * EXCLUDED.best_total
+                OR gb.best_total = 0 THEN EXCLUDED.best_total ELSE gb.best_total END,
+            score_sum = gb.score_sum + EXCLUDED.score_sum,
+            questions_sum = gb.questions_sum + EXCLUDED.questions_sum,
+            attempts_count = GREATEST(gb.attempts_count, EXCLUDED.attempts_count),
+            last_score = CASE WHEN EXCLUDED.attempts_count > gb.attempts_count
+                THEN EXCLUDED.last_score ELSE gb.last_score END,
+            total_questions = CASE WHEN EXCLUDED.attempts_count > gb.attempts_count
+                THEN EXCLUDED.total_questions ELSE gb.total_questions END,
+            last_attempt_id = CASE WHEN EXCLUDED.attempts_count > gb.attempts_count
+                THEN EXCLUDED.last_attempt_id ELSE gb.last_attempt_id END,
+            last_completed_at = CASE WHEN EXCLUDED.attempts_count > gb.attempts_count
+                THEN EXCLUDED.last_completed_at ELSE gb.last_completed_at END,
+            last_correct_mask = CASE WHEN EXCLUDED.attempts_count > gb.attempts_count
+                THEN EXCLUDED.last_correct_mask ELSE gb.last_correct_mask END
+    )
+    SELECT id, attempt_number FROM new_attempt
+""")
+
 router = APIRouter()
 
 
 @router.get("/lectures/{lecture_id}/test")
 def get_lecture_test(
     lecture_id: int,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
     """Получение теста для лекции"""
+    is_student = current_user.role == "student"
+    
     # Проверяем доступ через зависимость
     lecture = require_lecture_access(
         lecture_id,
         db,
         current_user,
-        require_published=(current_user.role == "student")
+        require_published=is_student
     )
     
     # Проверяем, включена ли генерация теста
-    if not lecture.generate_test:
+    policy = get_test_policy(lecture)
+    if not policy.generate_test:
         raise HTTPException(status_code=404, detail="Генерация теста для этой лекции отключена")
     
+    now = datetime.now()
+    
     # Для студентов проверяем дедлайн
-    if current_user.role == "student":
-        if lecture.test_deadline:
-            try:
-                from datetime import datetime
-                deadline = datetime.fromisoformat(lecture.test_deadline)
-                # Если deadline имеет таймзону, убираем её для сравнения с naive datetime
-                if deadline.tzinfo is not None:
-                    deadline = deadline.replace(tzinfo=None)
-                now = datetime.now()
-                if now > deadline:
-                    # Форматируем дедлайн в локальном времени (Europe/Moscow)
-                    import pytz
-                    moscow_tz = pytz.timezone('Europe/Moscow')
-                    # Если deadline naive, считаем его московским временем
-                    if deadline.tzinfo is None:
-                        deadline_local = moscow_tz.localize(deadline)
-                    else:
-                        deadline_local = deadline.astimezone(moscow_tz)
-                    raise HTTPException(status_code=403, detail=f"Дедлайн выполнения теста истек: {deadline_local.strftime('%d.%m.%Y %H:%M')}")
-            except (ValueError, TypeError) as e:
-                logger.warning(f"Ошибка парсинга дедлайна: {e}")
-        
-        # Проверяем количество попыток
-        if lecture.test_max_attempts:
-            # Подсчитываем попытки студента для этого теста
-            # Для режима "per_student" нужно найти тест студента
-            if lecture.test_generation_mode == "per_student":
-                test = db.query(Test).filter(
-                    Test.lecture_id == lecture_id,
-                    Test.user_id == current_user.id
-                ).order_by(Test.created_at.desc()).first()
-            else:
-                test = db.query(Test).filter(Test.lecture_id == lecture_id).order_by(Test.created_at.desc()).first()
-            
-            if test:
-                attempts_count = db.query(TestAttempt).filter(
-                    TestAttempt.test_id == test.id,
-                    TestAttempt.user_id == current_user.id
-                ).count()
-                
-                if attempts_count >= lecture.test_max_attempts:
-                    raise HTTPException(
-                        status_code=403, 
-                        detail=f"Превышено максимальное количество попыток ({lecture.test_max_attempts}). Вы использовали все попытки."
-                    )
+    if is_student and not policy.is_open(now):
+        raise HTTPException(status_code=403, detail=policy.closed_detail)
     
     # Если режим "per_student" и пользователь - студент, используем существующий тест или создаем новый
-    if lecture.test_generation_mode == "per_student" and current_user.role == "student":
+    if policy.per_student and is_student:
         # Сначала проверяем, есть ли уже тест для этого студента
         test = db.query(Test).filter(
             Test.lecture_id == lecture_id,
             Test.user_id == current_user.id
         ).order_by(Test.created_at.desc()).first()
         
-        # Если теста нет, создаем новый
-        if not test:
+        if test:
+            # Проверяем количество попыток
+            if policy.max_attempts and policy.attempts_left(get_attempts_count(db, test.id, current_user.id)) == 0:
+                raise HTTPException(status_code=403, detail=policy.attempts_exhausted_detail)
+        else:
+            # Если теста нет, создаем новый
             test = generate_test_for_student(db, lecture_id, current_user.id)
             if not test:
                 raise HTTPException(status_code=500, detail="Не удалось сгенерировать тест")
@@ -183,67 +214,62 @@ def get_lecture_test(
         
         if not test:
             raise HTTPException(status_code=404, detail="Тест для этой лекции еще не создан")
+        
+        # Проверяем количество попыток студента по легкому счетчику
+        if is_student and policy.max_attempts and policy.attempts_left(get_attempts_count(db, test.id, current_user.id)) == 0:
+            raise HTTPException(status_code=403, detail=policy.attempts_exhausted_detail)
     
-    # Получаем вопросы
-    questions = db.query(Question).filter(Question.test_id == test.id).order_by(Question.order_index).all()
+    # Для преподавателей и админов показываем все.
+    # Студентам показываем ответы только если:
+    # 1. Разрешено в настройках (test_show_answers = true)
+    # 2. Дедлайн истек
+    show_answers = policy.may_show_answers(now) if is_student else True
+    
+    # Отдаем заранее сериализованный снимок теста (формат TestResponse)
+    body, etag = get_test_snapshot(db, test).render(show_answers)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.post("/lectures/{lecture_id}/test/regenerate")
+@limiter.limit("10/hour")
+def regenerate_lecture_test(
+    request: Request,
+    lecture_id: int,
+    lecture: Lecture = Depends(require_lecture_teacher_access),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Вопросы общего теста лекции генерируются заново, без кэша ответов LLM.
+    Вопросы заменяются в том же тесте, поэтому использованные попытки и ведомость сохраняются.
+    """
+    # Проверка доступа выполнена через зависимость require_lecture_teacher_access
+    from app.utils.rag import generate_lecture_questions
     
-    # Для студентов скрываем правильные ответы (если не разрешено показывать)
-    if current_user.role == "student":
-        # Проверяем, можно ли показывать ответы (только после дедлайна)
-        show_answers = False
-        deadline_passed = False
-        
-        if lecture.test_deadline:
-            try:
-                from datetime import datetime
-                deadline = datetime.fromisoformat(lecture.test_deadline)
-                # Если deadline имеет таймзону, убираем её для сравнения с naive datetime
-                if deadline.tzinfo is not None:
-                    deadline = deadline.replace(tzinfo=None)
-                now = datetime.now()
-                deadline_passed = now > deadline
-            except (ValueError, TypeError) as e:
-                logger.warning(f"Ошибка парсинга дедлайна: {e}")
-        
-        # Показываем ответы только если:
-        # 1. Разрешено в настройках (test_show_answers = true)
-        # 2. Дедлайн истек (deadline_passed = true)
-        if lecture.test_show_answers and deadline_passed:
-            show_answers = True
-        
-        questions_data = [
-            QuestionResponse(
-                id=q.id,
-                test_id=q.test_id,
-                question_text=q.question_text,
-                correct_answer=q.correct_answer if show_answers else "",  # Показываем ответы только после дедлайна
-                options=q.options,
-                question_type=q.question_type,
-                order_index=q.order_index
-            )
-            for q in questions
-        ]
+    policy = get_test_policy(lecture)
+    if not policy.generate_test:
+        raise HTTPException(status_code=404, detail="Генерация теста для этой лекции отключена")
+    if policy.per_student:
+        raise HTTPException(status_code=400, detail="В режиме per_student тест генерируется для каждого студента")
+    
+    # Случайный seed - другие фрагменты материалов, чем в предыдущих вопросах теста
+    questions = generate_lecture_questions(db, lecture_id, seed=random.randrange(1 << 30), use_cache=False)
+    if not questions:
+        raise HTTPException(status_code=502, detail="Не удалось сгенерировать вопросы")
+    
+    test = get_shared_test(db, lecture_id)
+    if test is None:
+        test = add_generated_test(db, lecture_id, questions)
     else:
-        # Для преподавателей и админов показываем все
-        questions_data = [
-            QuestionResponse(
-                id=q.id,
-                test_id=q.test_id,
-                question_text=q.question_text,
-                correct_answer=q.correct_answer,
-                options=q.options,
-                question_type=q.question_type,
-                order_index=q.order_index
-            )
-            for q in questions
-        ]
-    
-    return TestResponse(
-        id=test.id,
-        lecture_id=test.lecture_id,
-        created_at=test.created_at,
-        questions=questions_data
-    )
+        test = replace_test_questions(db, test, questions)
+    db.commit()
+    invalidate_test_snapshot(test.id)
+    warm_test_snapshot(db, test.id)
+    logger.info(f"Тест лекции {lecture_id} сгенерирован заново: тест {test.id}, {len(questions)} вопросов")
+    return {"test_id": test.id, "questions_count": len(questions)}
 
 
 @router.post("/lectures/{lecture_id}/test/check")
@@ -264,33 +290,16 @@ def check_test_answers(
     if not lecture.published:
         raise HTTPException(status_code=403, detail="Лекция не опубликована")
     
-    if not lecture.generate_test:
+    policy = get_test_policy(lecture)
+    if not policy.generate_test:
         raise HTTPException(status_code=404, detail="Генерация теста для этой лекции отключена")
     
     # Проверяем дедлайн
-    if lecture.test_deadline:
-        try:
-            from datetime import datetime
-            deadline = datetime.fromisoformat(lecture.test_deadline)
-            # Если deadline имеет таймзону, убираем её для сравнения с naive datetime
-            if deadline.tzinfo is not None:
-                deadline = deadline.replace(tzinfo=None)
-            now = datetime.now()
-            if now > deadline:
-                # Форматируем дедлайн в локальном времени (Europe/Moscow)
-                import pytz
-                moscow_tz = pytz.timezone('Europe/Moscow')
-                # Если deadline naive, считаем его московским временем
-                if deadline.tzinfo is None:
-                    deadline_local = moscow_tz.localize(deadline)
-                else:
-                    deadline_local = deadline.astimezone(moscow_tz)
-                raise HTTPException(status_code=403, detail=f"Дедлайн выполнения теста истек: {deadline_local.strftime('%d.%m.%Y %H:%M')}")
-        except (ValueError, TypeError) as e:
-            logger.warning(f"Ошибка парсинга дедлайна: {e}")
+    if not policy.is_open():
+        raise HTTPException(status_code=403, detail=policy.closed_detail)
     
     # Получаем тест (для режима per_student берем тест студента)
-    if lecture.test_generation_mode == "per_student":
+    if policy.per_student:
         test = db.query(Test).filter(
             Test.lecture_id == lecture_id,
             Test.user_id == current_user.id
@@ -301,126 +310,89 @@ def check_test_answers(
     if not test:
         raise HTTPException(status_code=404, detail="Тест не найден")
     
-    # Проверяем количество попыток
-    if lecture.test_max_attempts:
-        attempts_count = db.query(TestAttempt).filter(
-            TestAttempt.test_id == test.id,
-            TestAttempt.user_id == current_user.id
-        ).count()
-        
-        if attempts_count >= lecture.test_max_attempts:
-            raise HTTPException(
-                status_code=403, 
-                detail=f"Превышено максимальное количество попыток ({lecture.test_max_attempts}). Вы использовали все попытки."
-            )
+    # Проверяем ответы по закэшированному ключу ответов теста
+    key = get_answer_key(db, test.id, test.updated_at)
+    
+    # Ответы на вопросы, которых нет в тесте: вопросы заменили, пока студент проходил тест.
+    # Такую отправку не проверяем, иначе она засчиталась бы как попытка без правильных ответов
+    question_keys = {str(question_id) for question_id in key.question_ids}
+    if any(str(answer_key) not in question_keys for answer_key in answers):
+        raise HTTPException(
+            status_code=409,
+            detail="Вопросы теста были обновлены. Загрузите тест заново, попытка не засчитана"
+        )
     
-    # Получаем вопросы с правильными ответами
-    questions = db.query(Question).filter(Question.test_id == test.id).all()
+    chosen, is_correct, answer_texts = key.answer_columns(answers)
+    correct_count = int(is_correct.sum())
     
     results = []
-    correct_count = 0
-    
-    for question in questions:
-        student_answer = answers.get(str(question.id), "")
-        
-        # Для вопросов с вариантами ответов сравниваем индексы
-        if question.question_type == "multiple_choice":
-            try:
-                student_index = int(student_answer) if student_answer else -1
-                # Получаем правильный индекс из вариантов
-                options = json.loads(question.options) if question.options else []
-                correct_answer_text = question.correct_answer
-                # Находим индекс правильного ответа
-                correct_index = -1
-                for idx, opt in enumerate(options):
-                    if opt == correct_answer_text:
-                        correct_index = idx
-                        break
-                
-                is_correct = student_index == correct_index and student_index >= 0
-            except (ValueError, json.JSONDecodeError):
-                is_correct = False
-                student_index = -1
-        else:
-            # Для открытых вопросов (если останутся)
-            student_answer_text = student_answer.strip().lower()
-            correct_answer_text = question.correct_answer.strip().lower()
-            is_correct = student_answer_text == correct_answer_text or correct_answer_text in student_answer_text or student_answer_text in correct_answer_text
-        
-        if is_correct:
-            correct_count += 1
+    for pos, question_id in enumerate(key.question_ids):
+        student_answer = answers.get(str(question_id), "")
         
         # Формируем ответ для студента
-        student_answer_display = ""
-        if question.question_type == "multiple_choice":
-            try:
-                options = json.loads(question.options) if question.options else []
-                student_index = int(student_answer) if student_answer else -1
-                if 0 <= student_index < len(options):
-                    student_answer_display = options[student_index]
-            except (ValueError, json.JSONDecodeError):
+        if key.multiple_choice[pos]:
+            student_index = parse_choice(student_answer)
+            if student_index is None:
                 student_answer_display = "Не выбран"
+            else:
+                student_answer_display = key.option_text(pos, student_index) or ""
         else:
-            student_answer_display = answers.get(str(question.id), "")
+            student_answer_display = student_answer
         
         results.append({
-            "question_id": question.id,
-            "question_text": question.question_text,
+            "question_id": question_id,
+            "question_text": key.question_texts[pos],
             "student_answer": student_answer_display,
-            "correct_answer": question.correct_answer,
-            "is_correct": is_correct
+            "correct_answer": key.correct_answers[pos],
+            "is_correct": bool(is_correct[pos])
         })
     
-    total_questions = len(questions)
+    total_questions = len(key)
     score = (correct_count / total_questions * 100) if total_questions > 0 else 0
     
-    # Сохраняем попытку студента в транзакции
-    try:
-        attempt = TestAttempt(
-            test_id=test.id,
-            user_id=current_user.id,
-            answers=json.dumps(answers),
-            score=correct_count,
-            total_questions=total_questions,
-            completed_at=datetime.now().isoformat()
-        )
-        db.add(attempt)
-        db.flush()  # Сохраняем в БД, но не коммитим еще
-        
-        # Определяем, показывать ли правильные ответы
-        # Правильные ответы показываются только после дедлайна (чтобы студенты не списывали)
-        show_answers = False
-        # Подсчитываем попытки ПОСЛЕ сохранения (включая текущую)
-        attempts_count = db.query(TestAttempt).filter(
-            TestAttempt.test_id == test.id,
-            TestAttempt.user_id == current_user.id
-        ).count()
-        
-        # Коммитим транзакцию
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Ошибка при сохранении попытки теста {test.id} для пользователя {current_user.id}: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Ошибка при сохранении результатов теста")
-    
-    # Проверяем дедлайн для показа ответов
-    deadline_passed = False
-    if lecture.test_deadline:
+    # Сохраняем попытку одним запросом: лимит попыток проверяется в БД,
+    # а уникальный номер попытки не дает параллельным отправкам превысить лимит
+    params = {
+        "test_id": test.id,
+        "user_id": current_user.id,
+        "answers": json.dumps(answers),
+        "score": correct_count,
+        "total_questions": total_questions,
+        "completed_at": datetime.now().isoformat(),
+        "max_attempts": policy.max_attempts or None,
+        "lecture_id": lecture_id,
+        "correct_mask": pack_correct_mask(is_correct),
+        "question_ids": key.question_ids,
+        "chosen_indexes": chosen.tolist(),
+        "correct_flags": is_correct.tolist(),
+        "answer_texts": answer_texts,
+    }
+    for _ in range(SUBMIT_ATTEMPT_RETRIES):
         try:
-            deadline = datetime.fromisoformat(lecture.test_deadline)
-            # Если deadline имеет таймзону, убираем её для сравнения с naive datetime
-            if deadline.tzinfo is not None:
-                deadline = deadline.replace(tzinfo=None)
-            now = datetime.now()
-            deadline_passed = now > deadline
-        except (ValueError, TypeError) as e:
-            logger.warning(f"Ошибка парсинга дедлайна для показа ответов: {e}")
-    
-    # Показываем ответы только если:
-    # 1. Разрешено в настройках (test_show_answers = true)
-    # 2. Дедлайн истек (deadline_passed = true)
-    if lecture.test_show_answers and deadline_passed:
-        show_answers = True
+            attempt_row = db.execute(SUBMIT_ATTEMPT_SQL, params).first()
+            db.commit()
+            break
+        except IntegrityError:
+            # Параллельная отправка заняла тот же номер попытки - повторяем со следующим номером
+            db.rollback()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Ошибка при сохранении попытки теста {test.id} для пользователя {current_user.id}: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail="Ошибка при сохранении результатов теста")
+    else:
+        raise HTTPException(status_code=409, detail="Не удалось сохранить попытку, отправьте ответы еще раз")
+    
+    # Запрос не вставил строку - попытки исчерпаны
+    if attempt_row is None:
+        raise HTTPException(status_code=403, detail=policy.attempts_exhausted_detail)
+    
+    # Номер новой попытки равен количеству использованных попыток (включая текущую)
+    attempts_count = attempt_row.attempt_number
+    record_attempts_count(test.id, current_user.id, attempts_count)
+    
+    # Определяем, показывать ли правильные ответы
+    # Правильные ответы показываются только после дедлайна (чтобы студенты не списывали)
+    show_answers = policy.may_show_answers()
     
     # Если не разрешено показывать ответы, скрываем их в results
     if not show_answers:
@@ -434,7 +406,7 @@ def check_test_answers(
         "score": round(score, 2),
         "results": results,
         "attempts_used": attempts_count,
-        "max_attempts": lecture.test_max_attempts or 1,
+        "max_attempts": policy.max_attempts_display,
         "show_answers": show_answers
     })
 
@@ -456,11 +428,12 @@ def get_test_attempts(
     if not lecture.published:
         raise HTTPException(status_code=403, detail="Лекция не опубликована")
     
-    if not lecture.generate_test:
+    policy = get_test_policy(lecture)
+    if not policy.generate_test:
         raise HTTPException(status_code=404, detail="Генерация теста для этой лекции отключена")
     
     # Получаем тест
-    if lecture.test_generation_mode == "per_student":
+    if policy.per_student:
         test = db.query(Test).filter(
             Test.lecture_id == lecture_id,
             Test.user_id == current_user.id
@@ -478,75 +451,18 @@ def get_test_attempts(
     ).order_by(TestAttempt.completed_at.desc()).all()
     
     # Проверяем дедлайн для показа ответов
-    deadline_passed = False
-    if lecture.test_deadline:
-        try:
-            from datetime import timezone
-            deadline = datetime.fromisoformat(lecture.test_deadline)
-            # Если deadline имеет таймзону, убираем её для сравнения с naive datetime
-            if deadline.tzinfo is not None:
-                deadline = deadline.replace(tzinfo=None)
-            now = datetime.now()
-            deadline_passed = now > deadline
-            logger.info(f"Дедлайн: {deadline}, Сейчас: {now}, Истек: {deadline_passed}")
-        except (ValueError, TypeError) as e:
-            logger.warning(f"Ошибка парсинга дедлайна: {e}")
-    
-    show_answers = lecture.test_show_answers and deadline_passed
-    logger.info(f"test_show_answers: {lecture.test_show_answers}, deadline_passed: {deadline_passed}, show_answers: {show_answers}")
-    
-    # Получаем вопросы теста
-    questions = db.query(Question).filter(Question.test_id == test.id).order_by(Question.order_index).all()
-    questions_dict = {q.id: q for q in questions}
+    show_answers = policy.may_show_answers()
+    
+    # Ключ ответов теста (вопросы и правильные индексы)
+    key = get_answer_key(db, test.id, test.updated_at)
+    
+    # Проверенные ответы всех попыток одним запросом
+    answers_by_attempt = load_attempt_answers(db, [attempt.id for attempt in attempts])
     
     attempts_data = []
     for attempt in attempts:
-        try:
-            answers = json.loads(attempt.answers)
-        except (json.JSONDecodeError, TypeError):
-            answers = {}
-        
-        results = []
-        for question in questions:
-            student_answer = answers.get(str(question.id), "")
-            
-            # Формируем результат для каждого вопроса
-            # Всегда передаем correct_answer, если show_answers = True
-            correct_answer_value = ""
-            if show_answers:
-                correct_answer_value = question.correct_answer or ""
-            
-            result = {
-                "question_id": question.id,
-                "question_text": question.question_text,
-                "student_answer": student_answer,
-                "correct_answer": correct_answer_value,
-                "is_correct": False,
-                "options": question.options
-            }
-            
-            # Определяем правильность ответа
-            if question.question_type == "multiple_choice":
-                try:
-                    student_index = int(student_answer) if student_answer else -1
-                    options = json.loads(question.options) if question.options else []
-                    correct_answer_text = question.correct_answer
-                    correct_index = -1
-                    for idx, opt in enumerate(options):
-                        if opt == correct_answer_text:
-                            correct_index = idx
-                            break
-                    result["is_correct"] = student_index == correct_index and student_index >= 0
-                    if 0 <= student_index < len(options):
-                        result["student_answer"] = options[student_index]
-                except (ValueError, json.JSONDecodeError):
-                    result["is_correct"] = False
-            else:
-                student_answer_text = student_answer.strip().lower()
-                correct_answer_text = question.correct_answer.strip().lower()
-                result["is_correct"] = student_answer_text == correct_answer_text or correct_answer_text in student_answer_text or student_answer_text in correct_answer_text
-            
-            results.append(result)
+        columns = attempt_columns(key, attempt, answers_by_attempt.get(attempt.id))
+        results = build_attempt_results(key, *columns, show_answers)
         
         attempts_data.append({
             "id": attempt.id,
@@ -568,7 +484,7 @@ def get_test_attempts(
     return JSONResponse({
         "test_id": test.id,
         "attempts": attempts_data,
-        "max_attempts": lecture.test_max_attempts or 1,
+        "max_attempts": policy.max_attempts_display,
         "show_answers": show_answers,
         "max_score": round(max_score, 2)
     })
@@ -587,7 +503,8 @@ def get_all_test_attempts(
     
     # Проверка доступа выполнена через зависимость require_lecture_teacher_access
     
-    if not lecture.generate_test:
+    policy = get_test_policy(lecture)
+    if not policy.generate_test:
         raise HTTPException(status_code=404, detail="Генерация теста для этой лекции отключена")
     
     # Получаем все тесты для этой лекции (в режиме "per_student" их может быть несколько)
@@ -597,6 +514,7 @@ def get_all_test_attempts(
     
     # Получаем все попытки по всем тестам
     test_ids = [test.id for test in tests]
+    test_versions = {test.id: test.updated_at for test in tests}
     all_attempts = db.query(TestAttempt).filter(
         TestAttempt.test_id.in_(test_ids)
     ).order_by(TestAttempt.completed_at.desc()).all()
@@ -611,23 +529,13 @@ def get_all_test_attempts(
     groups = db.query(Group).filter(Group.id.in_(group_ids)).all() if group_ids else []
     groups_dict = {g.id: g for g in groups}
     
-    # Получаем вопросы теста (берем из первого теста, так как вопросы одинаковые)
-    questions = db.query(Question).filter(Question.test_id == tests[0].id).order_by(Question.order_index).all()
-    questions_dict = {q.id: q for q in questions}
-    
     # Проверяем дедлайн для показа ответов
-    deadline_passed = False
-    if lecture.test_deadline:
-        try:
-            deadline = datetime.fromisoformat(lecture.test_deadline)
-            if deadline.tzinfo is not None:
-                deadline = deadline.replace(tzinfo=None)
-            now = datetime.now()
-            deadline_passed = now > deadline
-        except (ValueError, TypeError) as e:
-            logger.warning(f"Ошибка парсинга дедлайна: {e}")
+    now = datetime.now()
+    deadline_passed = policy.deadline_passed(now)
+    show_answers = policy.may_show_answers(now)
     
-    show_answers = lecture.test_show_answers and deadline_passed
+    # Проверенные ответы всех попыток одним запросом
+    answers_by_attempt = load_attempt_answers(db, [attempt.id for attempt in all_attempts])
     
     attempts_data = []
     for attempt in all_attempts:
@@ -635,48 +543,10 @@ def get_all_test_attempts(
         if not student:
             continue
         
-        try:
-            answers = json.loads(attempt.answers)
-        except (json.JSONDecodeError, TypeError):
-            answers = {}
-        
-        results = []
-        for question in questions:
-            student_answer = answers.get(str(question.id), "")
-            
-            correct_answer_value = ""
-            if show_answers:
-                correct_answer_value = question.correct_answer or ""
-            
-            result = {
-                "question_id": question.id,
-                "question_text": question.question_text,
-                "student_answer": student_answer,
-                "correct_answer": correct_answer_value,
-                "is_correct": False,
-                "options": question.options
-            }
-            
-            # Определяем правильность ответа
-            if question.question_type == "multiple_choice":
-                try:
-                    student_index = int(student_answer) if student_answer else -1
-                    options = json.loads(question.options) if question.options else []
-                    correct_answer_text = question.correct_answer
-                    correct_index = -1
-                    for idx, opt in enumerate(options):
-                        if opt == correct_answer_text:
-                            correct_index = idx
-                            break
-                    result["is_correct"] = student_index == correct_index and student_index >= 0
-                    if 0 <= student_index < len(options):
-                        result["student_answer"] = options[student_index]
-                except (ValueError, json.JSONDecodeError):
-                    result["is_correct"] = False
-            else:
-                result["is_correct"] = student_answer.lower().strip() == question.correct_answer.lower().strip() if question.correct_answer else False
-            
-            results.append(result)
+        # Вопросы берем из теста попытки (в режиме "per_student" у каждого студента свой тест)
+        key = get_answer_key(db, attempt.test_id, test_versions.get(attempt.test_id))
+        columns = attempt_columns(key, attempt, answers_by_attempt.get(attempt.id))
+        results = build_attempt_results(key, *columns, show_answers)
         
         attempts_data.append({
             "id": attempt.id,
@@ -701,32 +571,33 @@ def get_all_test_attempts(
     else:
         average_score = 0
     
-    # Получаем курс из лекции с предзагрузкой groups (избегаем N+1)
-    from sqlalchemy.orm import joinedload
-    course = db.query(Course).options(
-        joinedload(Course.groups)
-    ).filter(Course.id == lecture.course_id).first()
+    # Курс загружен вместе с лекцией в require_lecture_teacher_access (groups уже загружены)
+    course = lecture.course
     if not course:
         raise HTTPException(status_code=404, detail="Курс не найден")
     
-    # Получаем список групп и студентов для фильтров (groups уже загружены)
+    # Получаем список групп и студентов для фильтров одним запросом
     course_groups = course.groups
+    course_groups_dict = {g.id: g for g in course_groups}
     all_course_students = []
-    for group in course_groups:
-        group_students = db.query(User).filter(User.group_id == group.id, User.role == "student").all()
+    if course_groups_dict:
+        group_students = db.query(User).filter(
+            User.group_id.in_(list(course_groups_dict.keys())),
+            User.role == "student"
+        ).order_by(User.group_id, User.id).all()
         for student in group_students:
             all_course_students.append({
                 "id": student.id,
                 "name": student.full_name,
                 "login": student.login,
-                "group_id": group.id,
-                "group_name": group.name
+                "group_id": student.group_id,
+                "group_name": course_groups_dict[student.group_id].name
             })
     
     return JSONResponse({
         "lecture_id": lecture_id,
         "lecture_name": lecture.name,
-        "test_max_attempts": lecture.test_max_attempts or 1,
+        "test_max_attempts": policy.max_attempts_display,
         "test_deadline": lecture.test_deadline,
         "test_show_answers": lecture.test_show_answers,
         "deadline_passed": deadline_passed,
@@ -738,3 +609,132 @@ def get_all_test_attempts(
         "students": all_course_students
     })
 
+
+@router.get("/lectures/{lecture_id}/test/gradebook")
+def get_test_gradebook(
+    lecture_id: int,
+    skip: int = Query(0, ge=0, description="Количество записей для пропуска"),
+    limit: int = Query(50, ge=1, le=500, description="Максимальное количество записей"),
+    group_id: Optional[int] = Query(None, description="Фильтр по группе"),
+    user_id: Optional[int] = Query(None, description="Фильтр по студенту"),
+    search: Optional[str] = Query(None, max_length=100, description="Поиск по ФИО или логину"),
+    sort: str = Query("name", pattern="^(name|best_score|last_completed)$", description="Сортировка"),
+    lecture: Lecture = Depends(require_lecture_teacher_access),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Ведомость по тесту лекции: итоги каждого студента с пагинацией и фильтрами (для преподавателя)"""
+    # Проверка доступа выполнена через зависимость require_lecture_teacher_access
+    
+    policy = get_test_policy(lecture)
+    if not policy.generate_test:
+        raise HTTPException(status_code=404, detail="Генерация теста для этой лекции отключена")
+    
+    best_percent = GradebookEntry.best_score * 100.0 / func.nullif(GradebookEntry.best_total, 0)
+    
+    query = db.query(
+        GradebookEntry,
+        User.full_name,
+        User.login,
+        User.group_id,
+        Group.name,
+    ).join(
+        User, User.id == GradebookEntry.user_id
+    ).outerjoin(
+        Group, Group.id == User.group_id
+    ).filter(
+        GradebookEntry.lecture_id == lecture_id
+    )
+    
+    if group_id is not None:
+        query = query.filter(User.group_id == group_id)
+    if user_id is not None:
+        query = query.filter(GradebookEntry.user_id == user_id)
+    if search:
+        pattern = f"%{search.strip()}%"
+        query = query.filter(or_(User.full_name.ilike(pattern), User.login.ilike(pattern)))
+    
+    # Итоги по всей выборке считаем отдельным агрегатом: они не зависят от страницы
+    total_students, total_attempts, score_sum, questions_sum = query.with_entities(
+        func.count(GradebookEntry.id),
+        func.sum(GradebookEntry.attempts_count),
+        func.sum(GradebookEntry.score_sum),
+        func.sum(GradebookEntry.questions_sum),
+    ).one()
+    average_score = (score_sum / questions_sum * 100) if questions_sum else 0
+    
+    if sort == "best_score":
+        query = query.order_by(best_percent.desc().nullslast(), GradebookEntry.id)
+    elif sort == "last_completed":
+        query = query.order_by(GradebookEntry.last_completed_at.desc().nullslast(), GradebookEntry.id)
+    else:
+        query = query.order_by(User.full_name, GradebookEntry.id)
+    
+    rows = query.offset(skip).limit(limit).all()
+    
+    entries = []
+    for entry, full_name, login, student_group_id, group_name in rows:
+        entries.append({
+            "user_id": entry.user_id,
+            "user_name": full_name,
+            "user_login": login,
+            "group_id": student_group_id,
+            "group_name": group_name,
+            "test_id": entry.test_id,
+            "attempts_count": entry.attempts_count,
+            "best_score": entry.best_score,
+            "best_total": entry.best_total,
+            "last_score": entry.last_score,
+            "total_questions": entry.total_questions,
+            "best_percent": round(entry.best_score / entry.best_total * 100, 2) if entry.best_total else 0,
+            "last_percent": round(entry.last_score / entry.total_questions * 100, 2) if entry.total_questions else 0,
+            "last_completed_at": entry.last_completed_at,
+            "last_results": unpack_correct_mask(entry.last_correct_mask, entry.total_questions)
+        })
+    
+    return JSONResponse({
+        "lecture_id": lecture_id,
+        "test_max_attempts": policy.max_attempts_display,
+        "total_students": total_students,
+        "total_attempts": int(total_attempts or 0),
+        "average_score": round(average_score, 1),
+        "skip": skip,
+        "limit": limit,
+        "entries": entries,
+        # Группы курса для фильтра (загружены вместе с лекцией в require_lecture_teacher_access)
+        "groups": [{"id": g.id, "name": g.name} for g in (lecture.course.groups if lecture.course else [])]
+    })
+
+
+@router.get("/lectures/{lecture_id}/test/item-analysis")
+def get_test_item_analysis(
+    lecture_id: int,
+    test_id: Optional[int] = Query(None, description="ID теста (по умолчанию - последний тест лекции)"),
+    first_attempts_only: bool = Query(True, description="Учитывать только первые попытки студентов"),
+    lecture: Lecture = Depends(require_lecture_teacher_access),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Анализ заданий теста: трудность, дискриминативность и частоты выбора вариантов (для преподавателя)"""
+    # Проверка доступа выполнена через зависимость require_lecture_teacher_access
+    
+    policy = get_test_policy(lecture)
+    if not policy.generate_test:
+        raise HTTPException(status_code=404, detail="Генерация теста для этой лекции отключена")
+    
+    # В режиме "per_student" у каждого студента свой набор вопросов, поэтому анализ строится по одному тесту
+    test_query = db.query(Test).filter(Test.lecture_id == lecture_id)
+    if test_id is not None:
+        test_query = test_query.filter(Test.id == test_id)
+    test = test_query.order_by(Test.created_at.desc()).first()
+    if not test:
+        raise HTTPException(status_code=404, detail="Тест не найден")
+    
+    analysis = get_item_analysis(db, test.id, first_attempts_only, test.updated_at)
+    
+    return JSONResponse({
+        "lecture_id": lecture_id,
+        "test_id": test.id,
+        "first_attempts_only": first_attempts_only,
+        **analysis
+    })
@@ -0,0 +1,260 @@
+"""API эндпоинты для возобновляемой загрузки материалов лекций"""
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+from starlette.requests import ClientDisconnect
+
+from app.core.config import UPLOAD_CHUNK_MAX_MB, UPLOAD_SESSION_TTL_HOURS
+from app.core.database import get_db
+from app.core.limiter import limiter
+from app.core.security import get_current_user
+from app.api.v1.dependencies import require_lecture_teacher_access
+from app.api.v1.lectures import schedule_lecture_update
+from app.models import Lecture, UploadSession, User
+from app.schemas import CreateUploadSessionRequest
+from app.utils.uploads import (
+    check_upload_size,
+    create_material_record,
+    detect_file_type,
+    finalize_upload,
+    hash_file,
+    lecture_upload_dir,
+    partial_upload_path,
+    remove_partial_upload,
+    safe_file_name,
+    write_at,
+)
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Максимальный размер одной части (тела одного PUT запроса)
+UPLOAD_CHUNK_MAX_SIZE = UPLOAD_CHUNK_MAX_MB * 1024 * 1024
+
+
+def session_response(session: UploadSession) -> dict:
+    """Состояние сессии загрузки для клиента"""
+    return {
+        "upload_id": session.id,
+        "lecture_id": session.lecture_id,
+        "file_name": session.file_name,
+        "file_type": session.file_type,
+        "total_size": session.total_size,
+        "offset": session.received_size,
+        "chunk_size": UPLOAD_CHUNK_MAX_SIZE,
+    }
+
+
+def get_own_session(db: Session, upload_id: str, current_user: User) -> UploadSession:
+    """Сессия загрузки текущего пользователя (404, если её нет или она чужая)"""
+    session = db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+    if not session or session.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Сессия загрузки не найдена")
+    return session
+
+
+def cleanup_expired_sessions(db: Session) -> None:
+    """Удаляет просроченные незавершенные загрузки вместе с их файлами"""
+    expires_before = (datetime.now() - timedelta(hours=UPLOAD_SESSION_TTL_HOURS)).isoformat()
+    expired = db.query(UploadSession).filter(UploadSession.updated_at < expires_before).all()
+    for session in expired:
+        remove_partial_upload(session.lecture_id, session.id)
+        db.delete(session)
+    if expired:
+        db.commit()
+        logger.info(f"Удалено просроченных сессий загрузки: {len(expired)}")
+
+
+@router.post("/lectures/{lecture_id}/uploads")
+@limiter.limit("30/minute")
+def create_upload_session(
+    request: Request,
+    lecture_id: int,
+    upload: CreateUploadSessionRequest,
+    lecture: Lecture = Depends(require_lecture_teacher_access),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Начало возобновляемой загрузки материала лекции"""
+    # Проверка доступа выполнена через зависимость require_lecture_teacher_access
+    
+    file_name = safe_file_name(upload.file_name)
+    file_type = detect_file_type(file_name)
+    # Лимит проверяем по заявленному размеру до передачи данных
+    check_upload_size(file_type, upload.file_size)
+    
+    cleanup_expired_sessions(db)
+    
+    now = datetime.now().isoformat()
+    session = UploadSession(
+        id=uuid.uuid4().hex,
+        lecture_id=lecture_id,
+        user_id=current_user.id,
+        file_name=file_name,
+        file_type=file_type,
+        total_size=upload.file_size,
+        received_size=0,
+        created_at=now,
+        updated_at=now,
+    )
+    # Создаем пустой файл, в который будут дописываться части
+    partial_upload_path(lecture_id, session.id).touch()
+    
+    db.add(session)
+    db.commit()
+    db.refresh(session)
+    
+    return session_response(session)
+
+
+@router.get("/uploads/{upload_id}")
+def get_upload_session(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Состояние загрузки: с какого смещения продолжать после обрыва соединения"""
+    return session_response(get_own_session(db, upload_id, current_user))
+
+
+def record_upload_progress(db: Session, session: UploadSession, offset: int, new_offset: int) -> bool:
+    """
+    Сдвигает смещение загрузки, если оно еще равно offset (часть не записана параллельным запросом).
+    При конфликте перечитывает сессию и возвращает False.
+    """
+    updated = db.query(UploadSession).filter(
+        UploadSession.id == session.id,
+        UploadSession.received_size == offset
+    ).update(
+        {UploadSession.received_size: new_offset, UploadSession.updated_at: datetime.now().isoformat()},
+        synchronize_session=False
+    )
+    db.commit()
+    if not updated:
+        db.refresh(session)
+    return bool(updated)
+
+
+@router.put("/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0, description="Смещение части в файле"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Прием части файла: тело запроса пишется прямо в файл загрузки по смещению.
+    Часть должна начинаться ровно там, где закончилась предыдущая.
+    Обработчик асинхронный ради чтения тела потоком; запросы к БД и запись файла выполняются в пуле потоков,
+    чтобы не блокировать event loop.
+    """
+    session = await run_in_threadpool(get_own_session, db, upload_id, current_user)
+    # Атрибуты сессии после commit перечитываются из БД, поэтому нужные значения запоминаются заранее
+    total_size = session.total_size
+    
+    if offset != session.received_size:
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "Неверное смещение части", "offset": session.received_size}
+        )
+    
+    part_path = partial_upload_path(session.lecture_id, session.id)
+    written = 0
+    fd = os.open(part_path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        async for data in request.stream():
+            if not data:
+                continue
+            if written + len(data) > UPLOAD_CHUNK_MAX_SIZE:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Часть слишком большая. Максимальный размер части: {UPLOAD_CHUNK_MAX_MB} МБ"
+                )
+            if offset + written + len(data) > total_size:
+                raise HTTPException(status_code=413, detail="Передано больше данных, чем заявлено при начале загрузки")
+            await run_in_threadpool(write_at, fd, data, offset + written)
+            written += len(data)
+    except ClientDisconnect:
+        # Соединение оборвалось - сохраняем то, что успели записать, клиент продолжит с нового смещения
+        logger.info(f"Загрузка {upload_id} прервана клиентом на смещении {offset + written}")
+    finally:
+        os.close(fd)
+    
+    # Фиксируем прогресс, только если параллельный запрос не записал эту же часть
+    new_offset = offset + written
+    updated = await run_in_threadpool(record_upload_progress, db, session, offset, new_offset)
+    if not updated:
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "Часть уже была записана другим запросом", "offset": session.received_size}
+        )
+    
+    return {
+        "upload_id": upload_id,
+        "offset": new_offset,
+        "total_size": total_size,
+    }
+
+
+@router.post("/uploads/{upload_id}/complete")
+def complete_upload(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Завершение загрузки: файл сбрасывается на диск, переименовывается и добавляется в материалы лекции"""
+    session = get_own_session(db, upload_id, current_user)
+    
+    if session.received_size != session.total_size:
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "Файл загружен не полностью", "offset": session.received_size}
+        )
+    
+    part_path = partial_upload_path(session.lecture_id, session.id)
+    final_path = lecture_upload_dir(session.lecture_id) / session.file_name
+    try:
+        finalize_upload(part_path, final_path)
+        content_hash = hash_file(final_path)
+    except FileNotFoundError:
+        db.delete(session)
+        db.commit()
+        raise HTTPException(status_code=410, detail="Файл загрузки не найден, начните загрузку заново")
+    except Exception as e:
+        logger.error(f"Ошибка при завершении загрузки {upload_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Ошибка при загрузке файла: {str(e)}")
+    
+    lecture_id = session.lecture_id
+    file_name = session.file_name
+    file_type = session.file_type
+    file_size = session.total_size
+    db.delete(session)
+    
+    material = create_material_record(db, lecture_id, file_name, file_type, file_size, content_hash)
+    lecture = db.query(Lecture).filter(Lecture.id == lecture_id).first()
+    if lecture is not None:
+        schedule_lecture_update(db, lecture, current_user.id, background_tasks)
+    return material
+
+
+@router.delete("/uploads/{upload_id}")
+def cancel_upload(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Отмена загрузки"""
+    session = get_own_session(db, upload_id, current_user)
+    remove_partial_upload(session.lecture_id, session.id)
+    db.delete(session)
+    db.commit()
+    return {"message": "Загрузка отменена"}
@@ -30,6 +30,99 @@ GIGACHAT_MODEL = os.getenv("GIGACHAT_MODEL", "GigaChat")
 GIGACHAT_SCOPE = os.getenv("GIGACHAT_SCOPE", "GIGACHAT_API_CORP")
 GIGACHAT_TEMPERATURE = float(os.getenv("GIGACHAT_TEMPERATURE", "0.7"))
 GIGACHAT_EMBEDDINGS_MODEL = os.getenv("GIGACHAT_EMBEDDINGS_MODEL", "Embeddings")
+# Размерность векторов модели GIGACHAT_EMBEDDINGS_MODEL (при смене модели указывается вместе с ней)
+GIGACHAT_EMBEDDING_DIMENSION = int(os.getenv("GIGACHAT_EMBEDDING_DIMENSION", "1024"))
+
+# ============================================
+# ЭМБЕДДИНГИ
+# ============================================
+# Бэкенд эмбеддингов: gigachat - GigaChat Embeddings API, local - локальная модель на CPU
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "gigachat")
+# Локальная модель (sentence-transformers) и размерность её векторов
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "intfloat/multilingual-e5-small")
+LOCAL_EMBEDDING_DIMENSION = int(os.getenv("LOCAL_EMBEDDING_DIMENSION", "384"))
+# Среда выполнения локальной модели: torch или onnx
+LOCAL_EMBEDDING_RUNTIME = os.getenv("LOCAL_EMBEDDING_RUNTIME", "torch")
+# Количество процессов и размер батча для локальной модели
+LOCAL_EMBEDDING_WORKERS = int(os.getenv("LOCAL_EMBEDDING_WORKERS", str(min(4, os.cpu_count() or 1))))
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+# Префиксы запросов и документов (модели семейства e5 обучены с ними)
+LOCAL_EMBEDDING_QUERY_PREFIX = os.getenv("LOCAL_EMBEDDING_QUERY_PREFIX", "query: ")
+LOCAL_EMBEDDING_DOCUMENT_PREFIX = os.getenv("LOCAL_EMBEDDING_DOCUMENT_PREFIX", "passage: ")
+
+# ============================================
+# ЧАНКИ ДЛЯ ЭМБЕДДИНГОВ
+# ============================================
+# Размер чанка в токенах (с запасом до лимита модели Embeddings в 512 токенов - токены оцениваются приближенно)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "400"))
+# Перекрытие соседних чанков в токенах
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "60"))
+# Сколько чанков отправляется в API эмбеддингов одним запросом
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))
+
+# ============================================
+# ПЕРЕВЕКТОРИЗАЦИЯ МАТЕРИАЛОВ
+# ============================================
+# Запускать перевекторизацию при старте, если модель в настройках отличается от активной
+REEMBED_AUTO_START = os.getenv("REEMBED_AUTO_START", "true").lower() in ("1", "true", "yes")
+# Сколько материалов читается из БД за один запрос (пагинация по id)
+REEMBED_PAGE_SIZE = int(os.getenv("REEMBED_PAGE_SIZE", "50"))
+# Ограничение запросов к модели эмбеддингов в минуту, чтобы не мешать обработке новых материалов (0 - без ограничения)
+REEMBED_REQUESTS_PER_MINUTE = int(os.getenv("REEMBED_REQUESTS_PER_MINUTE", "60"))
+# Сколько раз повторять батч, для которого модель не вернула векторы, прежде чем остановить задание
+REEMBED_MAX_RETRIES = int(os.getenv("REEMBED_MAX_RETRIES", "5"))
+
+# ============================================
+# ГЕНЕРАЦИЯ ВОПРОСОВ
+# ============================================
+# Сколько чанков материала попадает в промпт на один вопрос (объем промпта не зависит от длины материала)
+QUESTION_FRAGMENTS_PER_QUESTION = int(os.getenv("QUESTION_FRAGMENTS_PER_QUESTION", "1"))
+# Сколько раз переспрашивать модель о невалидных или недостающих вопросах
+QUESTION_REPAIR_ATTEMPTS = int(os.getenv("QUESTION_REPAIR_ATTEMPTS", "2"))
+# Количество вариантов тестов в режиме per_student. По умолчанию (0) у каждого студента свой вариант;
+# при значении N > 0 студенты с одним вариантом получают одинаковые вопросы из кэша ответов LLM
+QUESTION_VARIANTS = int(os.getenv("QUESTION_VARIANTS", "0"))
+# Кэш ответов LLM: включен ли, срок хранения и максимальное количество записей
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_TTL_DAYS = int(os.getenv("LLM_CACHE_TTL_DAYS", "30"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+
+# ============================================
+# СОБЫТИЯ ОБРАБОТКИ ЛЕКЦИЙ
+# ============================================
+# Интервал комментариев-пульса в потоке Server-Sent Events (секунды), чтобы прокси не закрывали соединение
+LECTURE_EVENTS_HEARTBEAT_SECONDS = float(os.getenv("LECTURE_EVENTS_HEARTBEAT_SECONDS", "15"))
+# Через сколько минут без обновления состояния обработка лекции считается прерванной (процесс был остановлен)
+# и повторная публикация запускает её заново
+LECTURE_PROCESSING_STALE_MINUTES = int(os.getenv("LECTURE_PROCESSING_STALE_MINUTES", "120"))
+
+# ============================================
+# ПЛАНИРОВЩИК ОБРАБОТКИ
+# ============================================
+# Потоки пулов на процесс: транскрибация (Whisper), разбор документов с эмбеддингами, генерация вопросов LLM.
+# Каждому пулу дополнительно выделен один поток для коротких задач
+SCHEDULER_TRANSCRIPTION_WORKERS = int(os.getenv("SCHEDULER_TRANSCRIPTION_WORKERS", "2"))
+SCHEDULER_DOCUMENT_WORKERS = int(os.getenv("SCHEDULER_DOCUMENT_WORKERS", "4"))
+SCHEDULER_LLM_WORKERS = int(os.getenv("SCHEDULER_LLM_WORKERS", "2"))
+# Короткие задачи: файлы до SCHEDULER_SHORT_JOB_MB МБ, генерация вопросов не более чем по N материалам
+SCHEDULER_SHORT_JOB_MB = float(os.getenv("SCHEDULER_SHORT_JOB_MB", "5"))
+SCHEDULER_SHORT_LLM_JOB_MATERIALS = int(os.getenv("SCHEDULER_SHORT_LLM_JOB_MATERIALS", "2"))
+
+# ============================================
+# ПОИСК ПО МАТЕРИАЛАМ КУРСА
+# ============================================
+# Минимальная длина запроса (более короткие запросы при наборе не отправляются в модель эмбеддингов)
+SEARCH_MIN_QUERY_LENGTH = int(os.getenv("SEARCH_MIN_QUERY_LENGTH", "3"))
+# Количество эмбеддингов запросов в кэше процесса
+SEARCH_QUERY_CACHE_SIZE = int(os.getenv("SEARCH_QUERY_CACHE_SIZE", "4096"))
+# Ширина списка кандидатов HNSW при поиске (больше - точнее, но медленнее)
+SEARCH_HNSW_EF_SEARCH = int(os.getenv("SEARCH_HNSW_EF_SEARCH", "100"))
+# Длина фрагмента текста в результатах поиска (символы)
+SEARCH_SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "240"))
+# Сколько кандидатов берется из векторного и полнотекстового поиска перед объединением
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "50"))
+# Константа k в reciprocal rank fusion: score = сумма 1 / (k + ранг)
+SEARCH_RRF_K = int(os.getenv("SEARCH_RRF_K", "60"))
 
 # ============================================
 # WHISPER (ТРАНСКРИБАЦИЯ)
@@ -38,6 +131,53 @@ WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
 WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "cpu")
 WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
 
+# ============================================
+# ЗАГРУЗКА МАТЕРИАЛОВ
+# ============================================
+# Максимальный размер файла по типам материалов (МБ)
+MAX_VIDEO_UPLOAD_MB = int(os.getenv("MAX_VIDEO_UPLOAD_MB", "2048"))
+MAX_AUDIO_UPLOAD_MB = int(os.getenv("MAX_AUDIO_UPLOAD_MB", "512"))
+MAX_PDF_UPLOAD_MB = int(os.getenv("MAX_PDF_UPLOAD_MB", "100"))
+MAX_OTHER_UPLOAD_MB = int(os.getenv("MAX_OTHER_UPLOAD_MB", "500"))
+# Максимальный размер одной части при возобновляемой загрузке (МБ)
+UPLOAD_CHUNK_MAX_MB = int(os.getenv("UPLOAD_CHUNK_MAX_MB", "16"))
+# Время жизни незавершенной сессии загрузки (часы)
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+
+# ============================================
+# HLS (АДАПТИВНЫЙ БИТРЕЙТ ДЛЯ ВИДЕО)
+# ============================================
+# Упаковывать ли видео материалы в HLS после публикации лекции
+HLS_ENABLED = os.getenv("HLS_ENABLED", "false").lower() in ("1", "true", "yes")
+# Высоты кадра качеств через запятую (допустимы 240, 360, 480, 720, 1080)
+HLS_RENDITIONS = [int(h) for h in os.getenv("HLS_RENDITIONS", "360,720").split(",") if h.strip().isdigit()]
+# Длительность сегмента (секунды)
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", "6"))
+
+# ============================================
+# ПОДПИСАННЫЕ ССЫЛКИ НА ФАЙЛЫ МАТЕРИАЛОВ
+# ============================================
+# Ключ подписи ссылок (по умолчанию производный от SECRET_KEY)
+MEDIA_URL_SECRET = os.getenv("MEDIA_URL_SECRET", "")
+# Время жизни подписанной ссылки (секунды)
+MEDIA_URL_TTL_SECONDS = int(os.getenv("MEDIA_URL_TTL_SECONDS", "3600"))
+# Если задан, файлы отдает nginx через X-Accel-Redirect (sendfile), например "/protected-uploads/"
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv("MEDIA_ACCEL_REDIRECT_PREFIX", "")
+
+# ============================================
+# ИЗВЛЕЧЕНИЕ ТЕКСТА ИЗ ДОКУМЕНТОВ
+# ============================================
+# auto - PyPDF2 для PDF с текстовым слоем, иначе pdfplumber; accurate - всегда pdfplumber; fast - всегда PyPDF2
+PDF_EXTRACTION_MODE = os.getenv("PDF_EXTRACTION_MODE", "auto")
+# Количество процессов для параллельного извлечения
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Начиная с какого количества страниц PDF обрабатывается в пуле процессов
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+# Максимальный объем текста, извлекаемого из одного документа (символы); остальное отбрасывается
+DOCUMENT_TEXT_MAX_CHARS = int(os.getenv("DOCUMENT_TEXT_MAX_CHARS", "2000000"))
+# Ограничение времени работы antiword для старых .doc (секунды)
+DOC_CONVERT_TIMEOUT_SECONDS = int(os.getenv("DOC_CONVERT_TIMEOUT_SECONDS", "120"))
+
 # ============================================
 # ПРИЛОЖЕНИЕ
 # ============================================
@@ -1,5 +1,7 @@
 """Настройки базы данных"""
 import logging
+from datetime import datetime
+
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import declarative_base, sessionmaker
 
@@ -80,6 +82,22 @@ def ensure_courses_schema():
     # Таблицы создаются через SQLAlchemy, здесь только добавляем колонки если нужно
     pass
 
+def _create_try_jsonb(conn) -> None:
+    """
+    Временная (на время соединения) функция pg_temp.try_jsonb: разбирает текст как JSON,
+    для некорректного JSON возвращает NULL вместо ошибки, прерывающей транзакцию миграции.
+    """
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION pg_temp.try_jsonb(value TEXT) RETURNS JSONB AS $$
+        BEGIN
+            RETURN value::jsonb;
+        EXCEPTION WHEN others THEN
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql IMMUTABLE
+    """))
+
+
 def ensure_lectures_schema():
     """Обеспечивает наличие дополнительных колонок и расширений для лекций"""
     with engine.connect() as conn:
@@ -92,7 +110,7 @@ def ensure_lectures_schema():
             conn.rollback()
         
         # Проверяем существование таблиц перед добавлением колонок
-        tables_to_check = ['lectures', 'lecture_materials', 'processed_materials', 'tests', 'questions']
+        tables_to_check = ['lectures', 'lecture_materials', 'processed_materials', 'tests', 'questions', 'test_attempts', 'attempt_answers', 'gradebook_entries', 'material_chunks', 'embedding_models']
         for table_name in tables_to_check:
             result = conn.execute(text(f"""
                 SELECT EXISTS (
@@ -154,6 +172,23 @@ def ensure_lectures_schema():
                     """))
                 except Exception as e:
                     logger.debug(f"Column test_deadline may already exist: {e}")
+                
+                # Состояние обработки материалов лекции
+                for column_name, column_type in (
+                    ('processing_status', 'VARCHAR'),
+                    ('processing_materials', 'JSONB'),
+                    ('processing_error', 'TEXT'),
+                    ('processing_started_at', 'VARCHAR'),
+                    ('processing_finished_at', 'VARCHAR'),
+                    ('processing_updated_at', 'VARCHAR'),
+                ):
+                    try:
+                        conn.execute(text(f"""
+                            ALTER TABLE lectures 
+                            ADD COLUMN IF NOT EXISTS {column_name} {column_type}
+                        """))
+                    except Exception as e:
+                        logger.debug(f"Column {column_name} may already exist: {e}")
             
             # Добавляем колонки для lecture_materials
             if table_name == 'lecture_materials':
@@ -164,6 +199,39 @@ def ensure_lectures_schema():
                     """))
                 except Exception as e:
                     logger.debug(f"Column order_index may already exist: {e}")
+                
+                try:
+                    # Видео больше 2 ГБ не помещаются в INTEGER
+                    result = conn.execute(text("""
+                        SELECT data_type
+                        FROM information_schema.columns
+                        WHERE table_name = 'lecture_materials' 
+                        AND column_name = 'file_size'
+                    """))
+                    if result.scalar() == 'integer':
+                        conn.execute(text("""
+                            ALTER TABLE lecture_materials 
+                            ALTER COLUMN file_size TYPE BIGINT
+                        """))
+                        logger.info("Колонка lecture_materials.file_size преобразована в BIGINT")
+                except Exception as e:
+                    logger.warning(f"Не удалось преобразовать lecture_materials.file_size в BIGINT: {e}")
+                
+                try:
+                    conn.execute(text("""
+                        ALTER TABLE lecture_materials 
+                        ADD COLUMN IF NOT EXISTS content_hash VARCHAR
+                    """))
+                except Exception as e:
+                    logger.debug(f"Column content_hash may already exist: {e}")
+                
+                try:
+                    conn.execute(text("""
+                        ALTER TABLE lecture_materials 
+                        ADD COLUMN IF NOT EXISTS hls_path VARCHAR
+                    """))
+                except Exception as e:
+                    logger.debug(f"Column hls_path may already exist: {e}")
             
             # Добавляем колонки для processed_materials
             if table_name == 'processed_materials':
@@ -176,57 +244,25 @@ def ensure_lectures_schema():
                     logger.debug(f"Column user_id may already exist: {e}")
                 
                 try:
-                    # Изменяем размерность вектора с 384 на 1024 для GigaChat Embeddings
-                    # Сначала проверяем текущую размерность
-                    result = conn.execute(text("""
-                        SELECT column_name, data_type, udt_name
-                        FROM information_schema.columns
-                        WHERE table_name = 'processed_materials' 
-                        AND column_name = 'embedding'
+                    conn.execute(text("""
+                        ALTER TABLE processed_materials 
+                        ADD COLUMN IF NOT EXISTS content_hash VARCHAR
                     """))
-                    col_info = result.fetchone()
-                    
-                    if col_info:
-                        # Колонка существует, проверяем размерность
-                        result = conn.execute(text("""
-                            SELECT typname, typlen
-                            FROM pg_type
-                            WHERE oid = (
-                                SELECT atttypid
-                                FROM pg_attribute
-                                WHERE attrelid = 'processed_materials'::regclass
-                                AND attname = 'embedding'
-                            )
-                        """))
-                        type_info = result.fetchone()
-                        
-                        # Если размерность не 1024, нужно изменить
-                        # Для этого сначала удаляем старую колонку и создаем новую
-                        # (ALTER TYPE vector не поддерживает изменение размерности напрямую)
-                        conn.execute(text("""
-                            ALTER TABLE processed_materials 
-                            DROP COLUMN IF EXISTS embedding
-                        """))
-                        conn.execute(text("""
-                            ALTER TABLE processed_materials 
-                            ADD COLUMN embedding vector(1024)
-                        """))
-                    else:
-                        # Колонка не существует, создаем с размерностью 1024
-                        conn.execute(text("""
-                            ALTER TABLE processed_materials 
-                            ADD COLUMN embedding vector(1024)
-                        """))
                 except Exception as e:
-                    logger.debug(f"Column embedding may already exist or error: {e}")
+                    logger.debug(f"Column content_hash may already exist: {e}")
                 
-                # Создаем индекс для векторного поиска (размерность 1024 для GigaChat)
+                # Эмбеддинг материала целиком (векторы GigaChat размерности 1024).
+                # Колонка не пересоздается: векторы других моделей и размерностей хранятся в chunk_embeddings,
+                # смена модели пересчитывает их в фоне (app.utils.reembedding) без потери текущих векторов
                 try:
-                    # Удаляем старый индекс, если он существует (на случай изменения размерности)
                     conn.execute(text("""
-                        DROP INDEX IF EXISTS processed_materials_embedding_idx
+                        ALTER TABLE processed_materials 
+                        ADD COLUMN IF NOT EXISTS embedding vector(1024)
                     """))
-                    # Создаем новый индекс для векторов размерности 1024
+                except Exception as e:
+                    logger.debug(f"Column embedding may already exist or error: {e}")
+                
+                try:
                     conn.execute(text("""
                         CREATE INDEX IF NOT EXISTS processed_materials_embedding_idx 
                         ON processed_materials 
@@ -241,6 +277,266 @@ def ensure_lectures_schema():
                 # Таблицы создаются автоматически через SQLAlchemy
                 pass
             
+            # Варианты ответов храним как JSONB и заранее вычисляем индекс правильного ответа
+            if table_name == 'questions':
+                try:
+                    conn.execute(text("""
+                        ALTER TABLE questions 
+                        ADD COLUMN IF NOT EXISTS correct_index INTEGER
+                    """))
+                except Exception as e:
+                    logger.debug(f"Column correct_index may already exist: {e}")
+                
+                # Материал, по которому составлен вопрос (без внешнего ключа: после удаления материала
+                # ссылка показывает, какие вопросы нужно убрать из теста)
+                try:
+                    conn.execute(text("""
+                        ALTER TABLE questions 
+                        ADD COLUMN IF NOT EXISTS source_material_id INTEGER
+                    """))
+                except Exception as e:
+                    logger.debug(f"Column source_material_id may already exist: {e}")
+                
+                try:
+                    result = conn.execute(text("""
+                        SELECT data_type
+                        FROM information_schema.columns
+                        WHERE table_name = 'questions' 
+                        AND column_name = 'options'
+                    """))
+                    if result.scalar() == 'text':
+                        # Строки с некорректным JSON сохраняются как JSON-строка, а не прерывают преобразование
+                        with conn.begin_nested():
+                            _create_try_jsonb(conn)
+                            conn.execute(text("""
+                                ALTER TABLE questions 
+                                ALTER COLUMN options TYPE JSONB
+                                USING COALESCE(pg_temp.try_jsonb(options), to_jsonb(NULLIF(options, '')))
+                            """))
+                        logger.info("Колонка questions.options преобразована в JSONB")
+                except Exception as e:
+                    logger.warning(f"Не удалось преобразовать questions.options в JSONB: {e}")
+                
+                try:
+                    # Заполняем correct_index для старых вопросов (-1, если вариант не найден)
+                    conn.execute(text("""
+                        UPDATE questions q
+                        SET correct_index = COALESCE((
+                            SELECT t.ord - 1
+                            FROM jsonb_array_elements_text(q.options) WITH ORDINALITY AS t(opt, ord)
+                            WHERE t.opt = q.correct_answer
+                            ORDER BY t.ord
+                            LIMIT 1
+                        ), -1)
+                        WHERE q.correct_index IS NULL
+                        AND q.question_type = 'multiple_choice'
+                        AND jsonb_typeof(q.options) = 'array'
+                    """))
+                except Exception as e:
+                    logger.warning(f"Не удалось заполнить questions.correct_index: {e}")
+            
+            # Номер попытки: нумеруем старые попытки и создаем уникальный индекс
+            if table_name == 'test_attempts':
+                try:
+                    conn.execute(text("""
+                        ALTER TABLE test_attempts 
+                        ADD COLUMN IF NOT EXISTS attempt_number INTEGER
+                    """))
+                    conn.execute(text("""
+                        UPDATE test_attempts ta
+                        SET attempt_number = numbered.rn
+                        FROM (
+                            SELECT id, ROW_NUMBER() OVER (PARTITION BY test_id, user_id ORDER BY id) AS rn
+                            FROM test_attempts
+                        ) numbered
+                        WHERE ta.id = numbered.id
+                        AND ta.attempt_number IS NULL
+                    """))
+                    conn.execute(text("""
+                        CREATE UNIQUE INDEX IF NOT EXISTS uq_test_attempts_number
+                        ON test_attempts (test_id, user_id, attempt_number)
+                    """))
+                except Exception as e:
+                    logger.warning(f"Не удалось обновить нумерацию попыток test_attempts: {e}")
+            
+            # Раскладываем ответы старых попыток из JSON в attempt_answers - один раз, пока таблица пуста
+            # (как и ведомость). Попытки с некорректным JSON и попытки, сделанные до замены вопросов теста
+            # (их ответы ссылаются на удаленные вопросы), пропускаются; шаг выполняется в точке сохранения
+            if table_name == 'attempt_answers':
+                try:
+                    with conn.begin_nested():
+                        _create_try_jsonb(conn)
+                        conn.execute(text("""
+                            INSERT INTO attempt_answers (attempt_id, question_id, chosen_index, is_correct, answer_text)
+                            SELECT
+                                ta.id,
+                                q.id,
+                                parsed.chosen_index,
+                                CASE
+                                    WHEN q.question_type = 'multiple_choice'
+                                        THEN COALESCE(parsed.chosen_index >= 0 AND parsed.chosen_index = q.correct_index, FALSE)
+                                    ELSE COALESCE(
+                                        lower(trim(q.correct_answer)) <> ''
+                                        AND (
+                                            position(lower(trim(q.correct_answer)) IN lower(trim(parsed.raw))) > 0
+                                            OR position(lower(trim(parsed.raw)) IN lower(trim(q.correct_answer))) > 0
+                                        ),
+                                        FALSE
+                                    )
+                                END,
+                                CASE WHEN q.question_type = 'multiple_choice' THEN NULL ELSE COALESCE(parsed.raw, '') END
+                            FROM test_attempts ta
+                            JOIN tests t ON t.id = ta.test_id
+                            JOIN questions q ON q.test_id = ta.test_id
+                            CROSS JOIN LATERAL (
+                                SELECT
+                                    raw,
+                                    CASE
+                                        WHEN q.question_type = 'multiple_choice' AND raw ~ '^ *-?[0-9]{1,9} *$'
+                                            THEN trim(raw)::integer
+                                        ELSE -1
+                                    END AS chosen_index
+                                FROM (SELECT pg_temp.try_jsonb(ta.answers) ->> q.id::text AS raw) answer
+                            ) parsed
+                            WHERE NOT EXISTS (SELECT 1 FROM attempt_answers)
+                            AND (t.updated_at IS NULL OR ta.completed_at >= t.updated_at)
+                            AND jsonb_typeof(pg_temp.try_jsonb(ta.answers)) = 'object'
+                            ON CONFLICT (attempt_id, question_id) DO NOTHING
+                        """))
+                except Exception as e:
+                    logger.warning(f"Не удалось перенести ответы попыток в attempt_answers: {e}")
+            
+            # Заполняем ведомость по попыткам, сделанным до её появления (маска ответов не восстанавливается)
+            if table_name == 'gradebook_entries':
+                # Лучший результат сравнивается долей правильных ответов: после замены вопросов
+                # попытки одного теста могут иметь разное количество вопросов
+                try:
+                    with conn.begin_nested():
+                        conn.execute(text("""
+                            ALTER TABLE gradebook_entries 
+                            ADD COLUMN IF NOT EXISTS best_total INTEGER NOT NULL DEFAULT 0
+                        """))
+                        conn.execute(text("""
+                            UPDATE gradebook_entries gb
+                            SET best_score = best.score, best_total = best.total_questions
+                            FROM (
+                                SELECT DISTINCT ON (test_id, user_id) test_id, user_id, score, total_questions
+                                FROM test_attempts
+                                ORDER BY test_id, user_id,
+                                    score::float / NULLIF(total_questions, 0) DESC NULLS LAST, id DESC
+                            ) best
+                            WHERE gb.best_total = 0
+                            AND gb.attempts_count > 0
+                            AND best.test_id = gb.test_id
+                            AND best.user_id = gb.user_id
+                        """))
+                except Exception as e:
+                    logger.warning(f"Не удалось добавить gradebook_entries.best_total: {e}")
+                
+                try:
+                    conn.execute(text("""
+                        INSERT INTO gradebook_entries (
+                            lecture_id, test_id, user_id, attempts_count, best_score, best_total, last_score,
+                            total_questions, score_sum, questions_sum, last_attempt_id, last_completed_at
+                        )
+                        SELECT
+                            t.lecture_id,
+                            ta.test_id,
+                            ta.user_id,
+                            COUNT(*),
+                            (ARRAY_AGG(ta.score ORDER BY ta.score::float / NULLIF(ta.total_questions, 0) DESC NULLS LAST, ta.id DESC))[1],
+                            (ARRAY_AGG(ta.total_questions ORDER BY ta.score::float / NULLIF(ta.total_questions, 0) DESC NULLS LAST, ta.id DESC))[1],
+                            (ARRAY_AGG(ta.score ORDER BY ta.id DESC))[1],
+                            (ARRAY_AGG(ta.total_questions ORDER BY ta.id DESC))[1],
+                            SUM(ta.score),
+                            SUM(ta.total_questions),
+                            MAX(ta.id),
+                            (ARRAY_AGG(ta.completed_at ORDER BY ta.id DESC))[1]
+                        FROM test_attempts ta
+                        JOIN tests t ON t.id = ta.test_id
+                        WHERE NOT EXISTS (SELECT 1 FROM gradebook_entries)
+                        GROUP BY t.lecture_id, ta.test_id, ta.user_id
+                        ON CONFLICT (test_id, user_id) DO NOTHING
+                    """))
+                except Exception as e:
+                    logger.warning(f"Не удалось заполнить gradebook_entries: {e}")
+            
+            if table_name == 'material_chunks':
+                # Векторы чанков хранятся по моделям в chunk_embeddings; переносим векторы, записанные в сам чанк
+                try:
+                    has_embedding_column = conn.execute(text("""
+                        SELECT EXISTS (
+                            SELECT FROM information_schema.columns
+                            WHERE table_name = 'material_chunks' AND column_name = 'embedding'
+                        )
+                    """)).scalar()
+                    if has_embedding_column:
+                        from app.utils.embedding_backends import GigaChatBackend, get_embedding_backend
+                        gigachat = get_embedding_backend(GigaChatBackend.kind)
+                        conn.execute(text("""
+                            INSERT INTO chunk_embeddings (chunk_id, model, dimension, embedding)
+                            SELECT id, :model, :dimension, embedding
+                            FROM material_chunks
+                            WHERE embedding IS NOT NULL
+                            ON CONFLICT (chunk_id, model) DO NOTHING
+                        """), {
+                            "model": gigachat.model_key,
+                            "dimension": gigachat.dimension,
+                        })
+                        conn.execute(text("DROP INDEX IF EXISTS material_chunks_embedding_idx"))
+                        conn.execute(text("ALTER TABLE material_chunks DROP COLUMN embedding"))
+                except Exception as e:
+                    logger.warning(f"Не удалось перенести векторы чанков в chunk_embeddings: {e}")
+
+                # Полнотекстовый поиск: генерируемая колонка tsvector (обновляется вместе с текстом) и GIN индекс
+                try:
+                    conn.execute(text("""
+                        ALTER TABLE material_chunks
+                        ADD COLUMN IF NOT EXISTS search_vector tsvector
+                        GENERATED ALWAYS AS (to_tsvector('russian', text)) STORED
+                    """))
+                    conn.execute(text("""
+                        CREATE INDEX IF NOT EXISTS material_chunks_search_idx
+                        ON material_chunks
+                        USING gin (search_vector)
+                    """))
+                except Exception as e:
+                    logger.warning(f"Не удалось добавить полнотекстовый индекс для material_chunks: {e}")
+            
+            # Активная модель эмбеддингов: при первом запуске - модель из настроек (её векторы уже записаны)
+            if table_name == 'embedding_models':
+                try:
+                    from app.utils.embedding_backends import get_embedding_backend
+                    backend = get_embedding_backend()
+                    conn.execute(text("""
+                        INSERT INTO embedding_models (
+                            model, backend, model_name, dimension, status,
+                            last_material_id, materials_done, chunks_done, activated_at
+                        )
+                        SELECT :model, :backend, :model_name, :dimension, 'active', 0, 0, 0, :now
+                        WHERE NOT EXISTS (SELECT 1 FROM embedding_models WHERE status = 'active')
+                        ON CONFLICT (model) DO NOTHING
+                    """), {
+                        "model": backend.model_key,
+                        "backend": backend.kind,
+                        "model_name": backend.model_name,
+                        "dimension": backend.dimension,
+                        "now": datetime.now().isoformat(),
+                    })
+                except Exception as e:
+                    logger.warning(f"Не удалось записать активную модель эмбеддингов: {e}")
+                
+                # Частичный индекс HNSW для векторов активной модели
+                try:
+                    from app.utils.embedding_backends import HNSW_MAX_DIMENSION, vector_index_sql
+                    active = conn.execute(text("""
+                        SELECT model, dimension FROM embedding_models WHERE status = 'active'
+                    """)).fetchone()
+                    if active and active.dimension <= HNSW_MAX_DIMENSION:
+                        conn.execute(text(vector_index_sql(active.model, active.dimension)))
+                except Exception as e:
+                    logger.warning(f"Не удалось создать индекс HNSW для chunk_embeddings: {e}")
+            
             # Добавляем колонку user_id в таблицу tests, если её нет
             if table_name == 'tests':
                 try:
@@ -250,6 +546,15 @@ def ensure_lectures_schema():
                     """))
                 except Exception as e:
                     logger.debug(f"Column user_id in tests may already exist: {e}")
+                
+                # Вопросы теста заменяются на месте (попытки и ведомость остаются привязаны к тесту)
+                try:
+                    conn.execute(text("""
+                        ALTER TABLE tests 
+                        ADD COLUMN IF NOT EXISTS updated_at VARCHAR
+                    """))
+                except Exception as e:
+                    logger.debug(f"Column updated_at in tests may already exist: {e}")
         
         conn.commit()
 
@@ -1,5 +1,6 @@
 """SQLAlchemy модели"""
-from sqlalchemy import Boolean, Column, Enum, ForeignKey, Integer, String, Table, Text
+from sqlalchemy import BigInteger, Boolean, Column, Computed, Enum, Float, ForeignKey, Index, Integer, LargeBinary, String, Table, Text, UniqueConstraint, text
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.orm import relationship
 from pgvector.sqlalchemy import Vector
 
@@ -84,6 +85,13 @@ class Lecture(Base):
     test_max_attempts = Column(Integer, default=1)  # Максимальное количество попыток для студента
     test_show_answers = Column(Boolean, default=False)  # Показывать ли правильные ответы после всех попыток
     test_deadline = Column(String, nullable=True)  # Дедлайн выполнения теста (ISO формат: YYYY-MM-DDTHH:MM:SS)
+    # Состояние обработки материалов: queued, running, failed, partial, published (см. app/utils/lecture_processing.py)
+    processing_status = Column(String, nullable=True)
+    processing_materials = Column(JSONB, nullable=True)  # {id материала: {file_name, status, error, started_at, finished_at}}
+    processing_error = Column(Text, nullable=True)
+    processing_started_at = Column(String, nullable=True)
+    processing_finished_at = Column(String, nullable=True)
+    processing_updated_at = Column(String, nullable=True)
     
     # Связь с курсом
     course = relationship("Course", back_populates="lectures")
@@ -107,13 +115,30 @@ class LectureMaterial(Base):
     file_path = Column(String, nullable=False)
     file_type = Column(String, nullable=False)  # video, pdf, presentation, audio, scorm
     file_name = Column(String, nullable=False)
-    file_size = Column(Integer, nullable=True)  # Размер файла в байтах
+    file_size = Column(BigInteger, nullable=True)  # Размер файла в байтах
+    content_hash = Column(String, nullable=True)  # SHA-256 содержимого файла (для ETag)
+    hls_path = Column(String, nullable=True)  # Путь к мастер-плейлисту HLS (для видео)
     order_index = Column(Integer, default=0)  # Порядок отображения материалов
     
     # Связь с лекцией
     lecture = relationship("Lecture", back_populates="materials")
 
 
+class UploadSession(Base):
+    """Сессия возобновляемой загрузки материала лекции"""
+    __tablename__ = "upload_sessions"
+    
+    id = Column(String, primary_key=True)  # Идентификатор сессии (uuid)
+    lecture_id = Column(Integer, ForeignKey("lectures.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    file_name = Column(String, nullable=False)
+    file_type = Column(String, nullable=False)
+    total_size = Column(BigInteger, nullable=False)  # Заявленный размер файла в байтах
+    received_size = Column(BigInteger, nullable=False, default=0)  # Сколько байт уже записано
+    created_at = Column(String, nullable=False)  # ISO формат
+    updated_at = Column(String, nullable=False)  # ISO формат
+
+
 class ProcessedMaterial(Base):
     """Модель обработанного материала (транскрипты, парсинг, эмбеддинги для RAG)"""
     __tablename__ = "processed_materials"
@@ -127,6 +152,7 @@ class ProcessedMaterial(Base):
     processed_text = Column(Text, nullable=True)  # Транскрипт или распарсенный текст
     embedding = Column(Vector(1024), nullable=True)  # Векторное представление текста (1024 размерность для GigaChat Embeddings)
     processed_at = Column(String)  # Дата обработки
+    content_hash = Column(String, nullable=True)  # SHA-256 файла, из которого получен текст (для поиска измененных материалов)
     
     # Связи
     lecture = relationship("Lecture", back_populates="processed_materials")
@@ -134,6 +160,84 @@ class ProcessedMaterial(Base):
     user = relationship("User")
 
 
+class MaterialChunk(Base):
+    """Фрагмент текста материала для поиска и RAG: текст и положение в исходном материале (векторы - в chunk_embeddings)"""
+    __tablename__ = "material_chunks"
+    __table_args__ = (
+        UniqueConstraint("material_id", "chunk_index", name="uq_material_chunks_index"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    lecture_id = Column(Integer, ForeignKey("lectures.id", ondelete="CASCADE"), nullable=False, index=True)
+    material_id = Column(Integer, ForeignKey("lecture_materials.id", ondelete="CASCADE"), nullable=False)
+    chunk_index = Column(Integer, nullable=False)  # Порядковый номер чанка в материале
+    text = Column(Text, nullable=False)
+    token_count = Column(Integer, nullable=False)
+    block_kind = Column(String, nullable=False)  # page, slide, paragraph, segment
+    first_block = Column(Integer, nullable=False)  # Номер первой страницы/слайда/абзаца/сегмента
+    last_block = Column(Integer, nullable=False)
+    start_offset = Column(Integer, nullable=False)  # Смещения в processed_text материала
+    end_offset = Column(Integer, nullable=False)
+    start_time = Column(Float, nullable=True)  # Время в записи (секунды) для транскриптов
+    end_time = Column(Float, nullable=True)
+    # Лексемы для полнотекстового поиска (пересчитываются PostgreSQL при записи чанка)
+    search_vector = Column(TSVECTOR, Computed("to_tsvector('russian', text)", persisted=True))
+    
+    # Связи
+    material = relationship("LectureMaterial")
+    embeddings = relationship("ChunkEmbedding", cascade="all, delete-orphan", passive_deletes=True)
+
+
+class ChunkEmbedding(Base):
+    """
+    Вектор чанка, полученный конкретной моделью эмбеддингов.
+    Размерность не фиксирована: векторы разных моделей хранятся рядом, для каждой модели - свой частичный индекс.
+    """
+    __tablename__ = "chunk_embeddings"
+    
+    chunk_id = Column(Integer, ForeignKey("material_chunks.id", ondelete="CASCADE"), primary_key=True)
+    model = Column(String, primary_key=True)  # Ключ модели: "бэкенд:модель"
+    dimension = Column(Integer, nullable=False)
+    embedding = Column(Vector(), nullable=False)
+
+
+class EmbeddingModel(Base):
+    """
+    Модель эмбеддингов, векторы которой есть в chunk_embeddings, и состояние её перевекторизации.
+    Поиск использует единственную активную модель; новая модель пересчитывается в фоне и затем становится активной.
+    """
+    __tablename__ = "embedding_models"
+    __table_args__ = (
+        Index("uq_embedding_models_active", "status", unique=True, postgresql_where=text("status = 'active'")),
+    )
+    
+    model = Column(String, primary_key=True)  # Ключ модели: "бэкенд:модель"
+    backend = Column(String, nullable=False)
+    model_name = Column(String, nullable=False)
+    dimension = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, default="building")  # building, active, retired, failed
+    last_material_id = Column(Integer, nullable=False, default=0)  # Контрольная точка: последний обработанный материал
+    materials_done = Column(Integer, nullable=False, default=0)
+    materials_total = Column(Integer, nullable=True)
+    chunks_done = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    started_at = Column(String, nullable=True)  # ISO формат
+    updated_at = Column(String, nullable=True)
+    activated_at = Column(String, nullable=True)
+
+
+class LLMResponseCache(Base):
+    """Кэш ответов LLM (проверенные вопросы) по хэшу параметров генерации и текста"""
+    __tablename__ = "llm_response_cache"
+    
+    key = Column(String, primary_key=True)  # sha256 параметров генерации
+    model = Column(String, nullable=False)
+    response = Column(JSONB, nullable=False)
+    created_at = Column(String, nullable=False)  # ISO формат, от него отсчитывается срок хранения
+    last_used_at = Column(String, nullable=False, index=True)  # Для вытеснения давно не использованных
+    hits = Column(Integer, nullable=False, default=0)
+
+
 class Test(Base):
     """Модель теста для лекции"""
     __tablename__ = "tests"
@@ -141,6 +245,7 @@ class Test(Base):
     id = Column(Integer, primary_key=True, index=True)
     lecture_id = Column(Integer, ForeignKey("lectures.id", ondelete="CASCADE"), nullable=False)
     created_at = Column(String)  # Дата создания
+    updated_at = Column(String, nullable=True)  # Дата последней замены вопросов (ISO формат); версия для кэшей теста
     user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)  # Для режима "per_student"
     
     # Связи
@@ -157,9 +262,12 @@ class Question(Base):
     test_id = Column(Integer, ForeignKey("tests.id", ondelete="CASCADE"), nullable=False)
     question_text = Column(Text, nullable=False)  # Текст вопроса
     correct_answer = Column(Text, nullable=False)  # Правильный ответ
-    options = Column(Text, nullable=True)  # JSON строка с вариантами ответов (если есть)
+    options = Column(JSONB, nullable=True)  # Массив вариантов ответов (если есть)
+    correct_index = Column(Integer, nullable=True)  # Индекс правильного варианта (-1, если не определен)
     question_type = Column(String, default="open")  # open, multiple_choice
     order_index = Column(Integer, default=0)  # Порядок вопроса в тесте
+    # Материал, по которому составлен вопрос (без внешнего ключа: ссылка на удаленный материал сохраняется)
+    source_material_id = Column(Integer, nullable=True)
     
     # Связи
     test = relationship("Test", back_populates="questions")
@@ -176,8 +284,52 @@ class TestAttempt(Base):
     score = Column(Integer, nullable=False)  # Количество правильных ответов
     total_questions = Column(Integer, nullable=False)  # Общее количество вопросов
     completed_at = Column(String, nullable=False)  # Дата и время завершения попытки (ISO формат)
+    attempt_number = Column(Integer, nullable=True)  # Порядковый номер попытки студента в тесте
+    
+    # Номер попытки уникален, поэтому параллельные отправки не могут превысить лимит попыток
+    __table_args__ = (
+        UniqueConstraint("test_id", "user_id", "attempt_number", name="uq_test_attempts_number"),
+    )
     
     # Связи
     test = relationship("Test", back_populates="attempts")
     user = relationship("User")
+    answer_rows = relationship("AttemptAnswer", cascade="all, delete-orphan", passive_deletes=True)
+
+
+class AttemptAnswer(Base):
+    """Проверенный ответ студента на вопрос в рамках попытки"""
+    __tablename__ = "attempt_answers"
+    
+    attempt_id = Column(Integer, ForeignKey("test_attempts.id", ondelete="CASCADE"), primary_key=True)
+    question_id = Column(Integer, ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True, index=True)
+    chosen_index = Column(Integer, nullable=False, default=-1)  # Индекс выбранного варианта (-1 - ответа нет)
+    is_correct = Column(Boolean, nullable=False, default=False)  # Правильный ли ответ
+    answer_text = Column(Text, nullable=True)  # Текст ответа на открытый вопрос
+
 
+class GradebookEntry(Base):
+    """Итоги студента по тесту (обновляются при каждой попытке, используются в ведомости преподавателя)"""
+    __tablename__ = "gradebook_entries"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    lecture_id = Column(Integer, ForeignKey("lectures.id", ondelete="CASCADE"), nullable=False, index=True)
+    test_id = Column(Integer, ForeignKey("tests.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    attempts_count = Column(Integer, nullable=False, default=0)  # Количество попыток
+    best_score = Column(Integer, nullable=False, default=0)  # Лучший результат (правильных ответов)
+    best_total = Column(Integer, nullable=False, default=0)  # Количество вопросов в попытке с лучшим результатом
+    last_score = Column(Integer, nullable=False, default=0)  # Результат последней попытки
+    total_questions = Column(Integer, nullable=False, default=0)  # Количество вопросов в тесте
+    score_sum = Column(Integer, nullable=False, default=0)  # Сумма правильных ответов по всем попыткам
+    questions_sum = Column(Integer, nullable=False, default=0)  # Сумма вопросов по всем попыткам
+    last_attempt_id = Column(Integer, nullable=True)  # ID последней попытки
+    last_completed_at = Column(String, nullable=True)  # Дата последней попытки (ISO формат)
+    last_correct_mask = Column(LargeBinary, nullable=True)  # Битовая маска правильных ответов последней попытки
+    
+    __table_args__ = (
+        UniqueConstraint("test_id", "user_id", name="uq_gradebook_entries_test_user"),
+    )
+    
+    # Связи
+    user = relationship("User")
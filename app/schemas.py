@@ -148,6 +148,12 @@ class LectureMaterialResponse(BaseModel):
         from_attributes = True
 
 
+class CreateUploadSessionRequest(BaseModel):
+    """Схема для начала возобновляемой загрузки материала"""
+    file_name: str = Field(..., min_length=1, max_length=255)
+    file_size: int = Field(..., ge=1)  # Размер файла в байтах
+
+
 class CreateLectureRequest(BaseModel):
     """Схема для создания лекции"""
     course_id: int
@@ -184,6 +190,7 @@ class LectureResponse(BaseModel):
     test_max_attempts: int = 1  # Максимальное количество попыток
     test_show_answers: bool = False  # Показывать ли правильные ответы после всех попыток
     test_deadline: Optional[str] = None  # Дедлайн выполнения теста
+    processing_status: Optional[str] = None  # Состояние обработки материалов (queued, running, failed, partial, published)
     materials: list[LectureMaterialResponse] = Field(default_factory=list)
 
     class Config:
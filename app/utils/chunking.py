@@ -0,0 +1,178 @@
+"""
+Разбиение текста материалов на чанки для эмбеддингов.
+Чанки собираются из предложений с учетом лимита токенов модели, не разрывают предложения
+и не пересекают границы страниц и слайдов; у каждого чанка сохраняется источник в документе.
+"""
+import re
+from collections import deque
+from typing import Iterable, Iterator, List
+
+from app.core.config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from app.utils.documents import TextBlock
+
+# Виды блоков, границы которых являются границами чанков (чанк не продолжается на следующую страницу или слайд)
+STRUCTURAL_BLOCK_KINDS = {"page", "slide"}
+
+# На структурной границе чанк закрывается, если заполнен хотя бы на эту долю (короткие слайды объединяются)
+STRUCTURAL_MIN_FILL = 0.5
+
+# Слова токенизатор модели режет на части; в среднем одна часть - около 6 символов кириллицы
+CHARS_PER_WORD_PIECE = 6
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# Граница предложения: пробелы после знака конца предложения или перевод строки
+_SENTENCE_BOUNDARY_RE = re.compile(r"(?<=[.!?…])\s+|\s*\n\s*")
+_WORD_RE = re.compile(r"\S+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка количества токенов: слова (длинные - как несколько частей) и знаки препинания"""
+    count = 0
+    for match in _TOKEN_RE.finditer(text):
+        count += 1 + (match.end() - match.start() - 1) // CHARS_PER_WORD_PIECE
+    return count
+
+
+class Chunk:
+    """Чанк текста и его источник: блоки документа, смещения в тексте материала, время в записи"""
+    __slots__ = (
+        "text", "chunk_index", "token_count", "block_kind", "first_block", "last_block",
+        "start_offset", "end_offset", "start_time", "end_time",
+    )
+
+    def __init__(self, text: str, chunk_index: int, token_count: int, units: List["_Unit"]):
+        first, last = units[0], units[-1]
+        self.text = text
+        self.chunk_index = chunk_index
+        self.token_count = token_count
+        self.block_kind = first.block.kind
+        self.first_block = first.block.index
+        self.last_block = last.block.index
+        self.start_offset = first.start
+        self.end_offset = last.end
+        self.start_time = first.block.start
+        self.end_time = last.block.end
+
+
+class _Unit:
+    """Неделимая часть чанка: предложение (или часть слишком длинного предложения)"""
+    __slots__ = ("text", "tokens", "block", "start", "end")
+
+    def __init__(self, text: str, tokens: int, block: TextBlock, start: int, end: int):
+        self.text = text
+        self.tokens = tokens
+        self.block = block
+        self.start = start
+        self.end = end
+
+
+def _iter_sentence_spans(text: str) -> Iterator[tuple[int, int]]:
+    position = 0
+    for match in _SENTENCE_BOUNDARY_RE.finditer(text):
+        if match.start() > position:
+            yield position, match.start()
+        position = match.end()
+    if position < len(text):
+        yield position, len(text)
+
+
+def _iter_units(block: TextBlock, max_tokens: int) -> Iterator[_Unit]:
+    text = block.text
+    for start, end in _iter_sentence_spans(text):
+        sentence = text[start:end]
+        tokens = estimate_tokens(sentence)
+        if tokens <= max_tokens:
+            if tokens:
+                yield _Unit(sentence, tokens, block, block.offset + start, block.offset + end)
+            continue
+        # Предложение длиннее лимита (таблица, транскрипт без знаков препинания) - делим по словам
+        piece_start = piece_end = None
+        piece_tokens = 0
+        for word in _WORD_RE.finditer(sentence):
+            word_tokens = estimate_tokens(word.group())
+            if piece_start is not None and piece_tokens + word_tokens > max_tokens:
+                yield _Unit(sentence[piece_start:piece_end], piece_tokens, block,
+                            block.offset + start + piece_start, block.offset + start + piece_end)
+                piece_start, piece_tokens = None, 0
+            if piece_start is None:
+                piece_start = word.start()
+            piece_end = word.end()
+            piece_tokens += word_tokens
+        if piece_start is not None and piece_tokens:
+            yield _Unit(sentence[piece_start:piece_end], piece_tokens, block,
+                        block.offset + start + piece_start, block.offset + start + piece_end)
+
+
+def _join_units(units: Iterable[_Unit]) -> str:
+    parts = []
+    previous_block = None
+    for unit in units:
+        if previous_block is not None:
+            parts.append(" " if unit.block is previous_block else "\n\n")
+        parts.append(unit.text)
+        previous_block = unit.block
+    return "".join(parts)
+
+
+def chunk_blocks(
+    blocks: Iterable[TextBlock],
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> Iterator[Chunk]:
+    """
+    Собирает чанки из блоков документа за один проход (блоки могут поступать по мере разбора).
+    Соседние чанки перекрываются последними предложениями (не больше overlap_tokens),
+    кроме чанков по разные стороны границы страницы или слайда.
+    """
+    current: "deque[_Unit]" = deque()
+    current_tokens = 0
+    fresh = 0  # Предложений в текущем чанке, не вошедших в предыдущий
+    chunk_index = 0
+
+    def make_chunk() -> Chunk:
+        return Chunk(_join_units(current), chunk_index, current_tokens, list(current))
+
+    for block in blocks:
+        for unit in _iter_units(block, max_tokens):
+            if fresh and current_tokens + unit.tokens > max_tokens:
+                yield make_chunk()
+                chunk_index += 1
+                # Перекрытие: оставляем хвост чанка не длиннее overlap_tokens
+                overlap = 0
+                keep = 0
+                for kept in reversed(current):
+                    if overlap + kept.tokens > overlap_tokens:
+                        break
+                    overlap += kept.tokens
+                    keep += 1
+                while len(current) > keep:
+                    current_tokens -= current.popleft().tokens
+                fresh = 0
+            # Хвост перекрытия не должен вытеснять новое предложение за лимит
+            while current and current_tokens + unit.tokens > max_tokens:
+                current_tokens -= current.popleft().tokens
+            current.append(unit)
+            current_tokens += unit.tokens
+            fresh += 1
+
+        if block.kind in STRUCTURAL_BLOCK_KINDS and fresh and current_tokens >= max_tokens * STRUCTURAL_MIN_FILL:
+            yield make_chunk()
+            chunk_index += 1
+            current.clear()
+            current_tokens = 0
+            fresh = 0
+
+    if fresh:
+        yield make_chunk()
+
+
+def chunk_text(
+    text: str,
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> List[Chunk]:
+    """Чанки произвольного текста без структуры документа"""
+    if not text or not text.strip():
+        return []
+    return list(chunk_blocks([TextBlock(text, "paragraph", 1, 0)], max_tokens, overlap_tokens))
+
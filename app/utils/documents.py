@@ -0,0 +1,266 @@
+"""
+Извлечение текста из документов.
+Парсеры регистрируются по расширению и MIME-типу и отдают текст блоками (страница, слайд, абзац)
+по мере разбора, поэтому дальнейшая обработка может начинаться до окончания разбора всего документа.
+"""
+import logging
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from app.core.config import DOC_CONVERT_TIMEOUT_SECONDS, DOCUMENT_TEXT_MAX_CHARS
+from app.utils.pdf_extraction import iter_pdf_pages
+
+logger = logging.getLogger(__name__)
+
+# Импорты библиотек для парсинга документов
+try:
+    import docx
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+    DOCX_PARSER_AVAILABLE = True
+except ImportError:
+    DOCX_PARSER_AVAILABLE = False
+
+try:
+    from pptx import Presentation
+    PPTX_PARSER_AVAILABLE = True
+except ImportError:
+    PPTX_PARSER_AVAILABLE = False
+
+# Разделитель блоков в итоговом тексте документа
+BLOCK_SEPARATOR = "\n\n"
+
+# Парсер получает путь к файлу и отдает пары (номер блока с 1, текст блока)
+ParseFunction = Callable[[Path], Iterable[Tuple[int, str]]]
+
+
+class TextBlock:
+    """
+    Блок текста документа и его положение: вид и номер блока, смещение в итоговом тексте.
+    Для сегментов транскрипта start и end - время в записи (секунды).
+    """
+    __slots__ = ("text", "kind", "index", "offset", "start", "end")
+
+    def __init__(
+        self,
+        text: str,
+        kind: str,
+        index: int,
+        offset: int,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+    ):
+        self.text = text
+        self.kind = kind
+        self.index = index
+        self.offset = offset
+        self.start = start
+        self.end = end
+
+
+class DocumentParser:
+    """Зарегистрированный парсер: название, вид блоков (page, slide, paragraph) и функция разбора"""
+    __slots__ = ("name", "block_kind", "parse")
+
+    def __init__(self, name: str, block_kind: str, parse: ParseFunction):
+        self.name = name
+        self.block_kind = block_kind
+        self.parse = parse
+
+
+_parsers_by_extension: Dict[str, DocumentParser] = {}
+_parsers_by_media_type: Dict[str, DocumentParser] = {}
+
+
+def register_parser(name: str, block_kind: str, extensions: Iterable[str], media_types: Iterable[str] = ()):
+    """Декоратор: регистрирует функцию разбора для расширений файлов и MIME-типов"""
+    def decorator(parse: ParseFunction) -> ParseFunction:
+        parser = DocumentParser(name, block_kind, parse)
+        for extension in extensions:
+            _parsers_by_extension[extension.lower()] = parser
+        for media_type in media_types:
+            _parsers_by_media_type[media_type.lower()] = parser
+        return parse
+    return decorator
+
+
+def get_parser(file_name: str, media_type: Optional[str] = None) -> Optional[DocumentParser]:
+    """Парсер по расширению файла, иначе по MIME-типу; None - если документ такого типа не разбирается"""
+    parser = _parsers_by_extension.get(Path(file_name).suffix.lower())
+    if parser is None and media_type:
+        parser = _parsers_by_media_type.get(media_type.split(";")[0].strip().lower())
+    return parser
+
+
+@register_parser("pdf", "page", [".pdf"], ["application/pdf"])
+def parse_pdf(file_path: Path) -> Iterator[Tuple[int, str]]:
+    # Большие PDF разбираются параллельно по диапазонам страниц, страницы отдаются по порядку
+    yield from iter_pdf_pages(file_path)
+
+
+def _docx_table_text(table: "Table") -> str:
+    rows = []
+    for row in table.rows:
+        cells = [cell.text.strip() for cell in row.cells]
+        # Объединенные ячейки python-docx возвращает несколько раз подряд
+        cells = [cell for i, cell in enumerate(cells) if cell and (i == 0 or cell != cells[i - 1])]
+        if cells:
+            rows.append(" | ".join(cells))
+    return "\n".join(rows)
+
+
+@register_parser(
+    "docx", "paragraph", [".docx"],
+    ["application/vnd.openxmlformats-officedocument.wordprocessingml.document"]
+)
+def parse_docx(file_path: Path) -> Iterator[Tuple[int, str]]:
+    if not DOCX_PARSER_AVAILABLE:
+        raise Exception("Библиотека python-docx не установлена")
+    document = docx.Document(str(file_path))
+    index = 0
+    # Абзацы и таблицы в порядке следования в документе
+    for element in document.element.body.iterchildren():
+        tag = element.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            text = Paragraph(element, document).text.strip()
+        elif tag == "tbl":
+            text = _docx_table_text(Table(element, document))
+        else:
+            continue
+        if text:
+            index += 1
+            yield index, text
+
+
+def _pptx_shape_texts(shapes) -> Iterator[str]:
+    for shape in shapes:
+        if shape.shape_type == 6:  # MSO_SHAPE_TYPE.GROUP
+            yield from _pptx_shape_texts(shape.shapes)
+        elif getattr(shape, "has_table", False) and shape.has_table:
+            for row in shape.table.rows:
+                cells = [cell.text.strip() for cell in row.cells if cell.text.strip()]
+                if cells:
+                    yield " | ".join(cells)
+        elif getattr(shape, "has_text_frame", False) and shape.has_text_frame:
+            text = shape.text_frame.text.strip()
+            if text:
+                yield text
+
+
+@register_parser(
+    "pptx", "slide", [".pptx"],
+    ["application/vnd.openxmlformats-officedocument.presentationml.presentation"]
+)
+def parse_pptx(file_path: Path) -> Iterator[Tuple[int, str]]:
+    if not PPTX_PARSER_AVAILABLE:
+        raise Exception("Библиотека python-pptx не установлена")
+    presentation = Presentation(str(file_path))
+    for number, slide in enumerate(presentation.slides, start=1):
+        parts = list(_pptx_shape_texts(slide.shapes))
+        # Заметки докладчика часто содержат основной текст лекции
+        if slide.has_notes_slide:
+            notes = slide.notes_slide.notes_text_frame.text.strip() if slide.notes_slide.notes_text_frame else ""
+            if notes:
+                parts.append(notes)
+        if parts:
+            yield number, "\n".join(parts)
+
+
+@register_parser("doc", "paragraph", [".doc"], ["application/msword"])
+def parse_doc(file_path: Path) -> Iterator[Tuple[int, str]]:
+    # Старый двоичный формат Word: текст читается из вывода antiword по мере конвертации
+    antiword = shutil.which("antiword")
+    if not antiword:
+        raise Exception("antiword не установлен, документы .doc не поддерживаются")
+    process = subprocess.Popen(
+        # -w 0: абзац выводится одной строкой
+        [antiword, "-m", "UTF-8.txt", "-w", "0", str(file_path)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        errors="replace"
+    )
+    timer = threading.Timer(DOC_CONVERT_TIMEOUT_SECONDS, process.kill)
+    timer.start()
+    try:
+        index = 0
+        for line in process.stdout:
+            text = line.strip()
+            if text:
+                index += 1
+                yield index, text
+        process.wait()
+        if process.returncode != 0:
+            raise Exception(f"antiword завершился с кодом {process.returncode}: {process.stderr.read()[-500:]}")
+    finally:
+        timer.cancel()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+@register_parser("text", "paragraph", [".txt", ".md"], ["text/plain", "text/markdown"])
+def parse_text(file_path: Path) -> Iterator[Tuple[int, str]]:
+    with open(file_path, encoding="utf-8", errors="replace") as f:
+        index = 0
+        lines = []
+        for line in f:
+            if line.strip():
+                lines.append(line.rstrip())
+                continue
+            if lines:
+                index += 1
+                yield index, "\n".join(lines)
+                lines = []
+        if lines:
+            yield index + 1, "\n".join(lines)
+
+
+def iter_document_blocks(
+    file_path: Path,
+    file_name: Optional[str] = None,
+    media_type: Optional[str] = None,
+    max_chars: int = DOCUMENT_TEXT_MAX_CHARS,
+) -> Iterator[TextBlock]:
+    """
+    Отдает непустые блоки текста документа по мере разбора.
+    Смещения блоков соответствуют тексту, склеенному через BLOCK_SEPARATOR.
+    Разбор останавливается, когда объем текста достигает max_chars.
+    """
+    file_name = file_name or file_path.name
+    parser = get_parser(file_name, media_type)
+    if parser is None:
+        raise ValueError(f"Формат документа не поддерживается: {file_name}")
+
+    offset = 0
+    blocks = parser.parse(file_path)
+    try:
+        for index, text in blocks:
+            if not text:
+                continue
+            if offset:
+                offset += len(BLOCK_SEPARATOR)
+            if offset + len(text) > max_chars:
+                text = text[:max(max_chars - offset, 0)]
+                if text:
+                    yield TextBlock(text, parser.block_kind, index, offset)
+                logger.warning(f"Текст документа {file_name} обрезан до {max_chars} символов ({parser.block_kind} {index})")
+                return
+            yield TextBlock(text, parser.block_kind, index, offset)
+            offset += len(text)
+    finally:
+        # Закрываем генератор парсера: он освобождает файл, процесс конвертации или пул
+        close = getattr(blocks, "close", None)
+        if close is not None:
+            close()
+
+
+def extract_document_text(file_path: Path, file_name: Optional[str] = None, media_type: Optional[str] = None) -> str:
+    """Текст документа целиком (блоки через BLOCK_SEPARATOR)"""
+    return BLOCK_SEPARATOR.join(block.text for block in iter_document_blocks(file_path, file_name, media_type))
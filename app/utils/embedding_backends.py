@@ -0,0 +1,328 @@
+"""
+Бэкенды эмбеддингов: GigaChat Embeddings API и локальная модель на CPU.
+Векторы разных моделей хранятся раздельно (ключ модели - "бэкенд:модель"), поэтому бэкенды
+могут сосуществовать, а смена модели не портит уже сохраненные векторы.
+"""
+import importlib.util
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from app.core.config import (
+    EMBEDDING_BACKEND,
+    EMBEDDING_BATCH_SIZE,
+    GIGA_API_KEY,
+    GIGACHAT_EMBEDDING_DIMENSION,
+    GIGACHAT_EMBEDDINGS_MODEL,
+    GIGACHAT_SCOPE,
+    LOCAL_EMBEDDING_BATCH_SIZE,
+    LOCAL_EMBEDDING_DIMENSION,
+    LOCAL_EMBEDDING_DOCUMENT_PREFIX,
+    LOCAL_EMBEDDING_MODEL,
+    LOCAL_EMBEDDING_QUERY_PREFIX,
+    LOCAL_EMBEDDING_RUNTIME,
+    LOCAL_EMBEDDING_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Попытка импортировать GigaChatEmbeddings
+try:
+    from langchain_community.embeddings import GigaChatEmbeddings
+    GIGACHAT_AVAILABLE = True
+except ImportError:
+    GIGACHAT_AVAILABLE = False
+    logger.warning("langchain_community не установлен. Эмбеддинги через GigaChat будут недоступны.")
+
+# sentence-transformers импортируется только в рабочих процессах (torch не загружается в процесс приложения)
+LOCAL_EMBEDDINGS_AVAILABLE = importlib.util.find_spec("sentence_transformers") is not None
+
+# Ограничиваем одновременные запросы к GigaChat Embeddings API (максимум 10 на все модели)
+_gigachat_semaphore = threading.Semaphore(10)
+
+# Максимальная размерность векторов для индекса HNSW pgvector (векторы большей размерности ищутся полным перебором)
+HNSW_MAX_DIMENSION = 2000
+
+# Сколько секунд процесс не перечитывает активную модель из БД
+ACTIVE_MODEL_CACHE_SECONDS = 10
+
+
+class EmbeddingBackend(ABC):
+    """Интерфейс бэкенда эмбеддингов"""
+    kind = ""
+
+    def __init__(self, model_name: str, dimension: int):
+        self.model_name = model_name
+        self.dimension = dimension
+
+    @property
+    def model_key(self) -> str:
+        """Ключ модели, под которым хранятся её векторы"""
+        return f"{self.kind}:{self.model_name}"
+
+    @property
+    def batch_size(self) -> int:
+        """Сколько текстов выгодно передавать в embed_documents за один вызов"""
+        return EMBEDDING_BATCH_SIZE
+
+    @abstractmethod
+    def embed_documents(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Эмбеддинги фрагментов документов (None для пустых текстов и при ошибке)"""
+
+    def embed_query(self, text: str) -> Optional[List[float]]:
+        """Эмбеддинг поискового запроса"""
+        return self.embed_documents([text])[0]
+
+    def _checked(self, embedding: Optional[List[float]]) -> Optional[List[float]]:
+        if embedding is None:
+            return None
+        if len(embedding) != self.dimension:
+            logger.warning(f"Неожиданная размерность эмбеддинга {self.model_key}: {len(embedding)}, ожидалось {self.dimension}")
+            return None
+        return list(embedding)
+
+
+class GigaChatBackend(EmbeddingBackend):
+    """Эмбеддинги через GigaChat Embeddings API"""
+    kind = "gigachat"
+
+    def __init__(self, model_name: str = GIGACHAT_EMBEDDINGS_MODEL, dimension: int = GIGACHAT_EMBEDDING_DIMENSION):
+        super().__init__(model_name, dimension)
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def client(self) -> Optional["GigaChatEmbeddings"]:
+        """Клиент GigaChat Embeddings (создается при первом обращении)"""
+        if not GIGACHAT_AVAILABLE:
+            logger.warning("GigaChat Embeddings недоступен. Установите langchain-community.")
+            return None
+        with self._client_lock:
+            if self._client is None:
+                if not GIGA_API_KEY:
+                    logger.error("GIGA_API_KEY не установлен в переменных окружения")
+                    return None
+                try:
+                    self._client = GigaChatEmbeddings(
+                        credentials=GIGA_API_KEY,
+                        model=self.model_name,
+                        scope=GIGACHAT_SCOPE,
+                        verify_ssl_certs=False,
+                    )
+                    logger.info(f"Модель GigaChat Embeddings инициализирована ({self.model_name})")
+                except Exception as e:
+                    logger.error(f"Ошибка инициализации GigaChat Embeddings: {e}")
+                    return None
+            return self._client
+
+    def embed_documents(self, texts: List[str]) -> List[Optional[List[float]]]:
+        client = self.client()
+        non_empty = [t for t in texts if t and t.strip()]
+        if client is None or not non_empty:
+            return [None] * len(texts)
+        try:
+            with _gigachat_semaphore:
+                embeddings = iter(client.embed_documents(non_empty))
+        except Exception as e:
+            logger.error(f"Ошибка генерации эмбеддингов батчем через GigaChat: {e}")
+            return [None] * len(texts)
+        return [self._checked(next(embeddings)) if t and t.strip() else None for t in texts]
+
+    def embed_query(self, text: str) -> Optional[List[float]]:
+        client = self.client()
+        if client is None or not text or not text.strip():
+            return None
+        try:
+            with _gigachat_semaphore:
+                return self._checked(client.embed_query(text))
+        except Exception as e:
+            logger.error(f"Ошибка генерации эмбеддинга через GigaChat: {e}")
+            return None
+
+
+# Модель локального бэкенда в рабочем процессе
+_local_model = None
+
+
+def _init_local_worker(model_name: str, runtime: str, threads: int) -> None:
+    """Загружает модель один раз при старте рабочего процесса"""
+    global _local_model
+    from sentence_transformers import SentenceTransformer
+    try:
+        import torch
+        # Процессы делят ядра между собой, иначе потоки torch конкурируют друг с другом
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    kwargs = {"device": "cpu"}
+    if runtime != "torch":
+        kwargs["backend"] = runtime
+    _local_model = SentenceTransformer(model_name, **kwargs)
+
+
+def _encode_local_batch(texts: List[str]) -> List[List[float]]:
+    vectors = _local_model.encode(texts, batch_size=len(texts), normalize_embeddings=True, show_progress_bar=False)
+    return vectors.tolist()
+
+
+class LocalBackend(EmbeddingBackend):
+    """
+    Локальная модель sentence-transformers на CPU.
+    Батчи распределяются по пулу процессов, поэтому массовая векторизация загружает все выделенные ядра.
+    """
+    kind = "local"
+
+    def __init__(self, model_name: str = LOCAL_EMBEDDING_MODEL, dimension: int = LOCAL_EMBEDDING_DIMENSION):
+        super().__init__(model_name, dimension)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def batch_size(self) -> int:
+        # По батчу на каждый рабочий процесс
+        return LOCAL_EMBEDDING_BATCH_SIZE * LOCAL_EMBEDDING_WORKERS
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                threads = max(1, (os.cpu_count() or 1) // LOCAL_EMBEDDING_WORKERS)
+                # spawn: процесс приложения многопоточный, fork в таком процессе небезопасен
+                self._pool = ProcessPoolExecutor(
+                    max_workers=LOCAL_EMBEDDING_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_local_worker,
+                    initargs=(self.model_name, LOCAL_EMBEDDING_RUNTIME, threads),
+                )
+            return self._pool
+
+    def _encode(self, texts: List[str]) -> List[Optional[List[float]]]:
+        if not LOCAL_EMBEDDINGS_AVAILABLE:
+            logger.warning("sentence-transformers не установлен. Локальные эмбеддинги недоступны.")
+            return [None] * len(texts)
+        positions = [i for i, t in enumerate(texts) if t and t.strip()]
+        result: List[Optional[List[float]]] = [None] * len(texts)
+        if not positions:
+            return result
+        batches = [
+            positions[start:start + LOCAL_EMBEDDING_BATCH_SIZE]
+            for start in range(0, len(positions), LOCAL_EMBEDDING_BATCH_SIZE)
+        ]
+        pool = self._get_pool()
+        futures = [pool.submit(_encode_local_batch, [texts[i] for i in batch]) for batch in batches]
+        for batch, future in zip(batches, futures):
+            try:
+                vectors = future.result()
+            except Exception as e:
+                logger.error(f"Ошибка локальной генерации эмбеддингов ({self.model_name}): {e}")
+                continue
+            for position, vector in zip(batch, vectors):
+                result[position] = self._checked(vector)
+        return result
+
+    def embed_documents(self, texts: List[str]) -> List[Optional[List[float]]]:
+        return self._encode([LOCAL_EMBEDDING_DOCUMENT_PREFIX + t if t and t.strip() else t for t in texts])
+
+    def embed_query(self, text: str) -> Optional[List[float]]:
+        if not text or not text.strip():
+            return None
+        return self._encode([LOCAL_EMBEDDING_QUERY_PREFIX + text])[0]
+
+
+EMBEDDING_BACKENDS = {
+    GigaChatBackend.kind: GigaChatBackend,
+    LocalBackend.kind: LocalBackend,
+}
+
+_backends: Dict[str, EmbeddingBackend] = {}
+_backends_lock = threading.Lock()
+
+# Активная модель, прочитанная из БД: (бэкенд, время чтения)
+_active_backend: Optional[tuple[EmbeddingBackend, float]] = None
+
+
+def get_embedding_backend(
+    kind: Optional[str] = None,
+    model_name: Optional[str] = None,
+    dimension: Optional[int] = None,
+) -> EmbeddingBackend:
+    """
+    Бэкенд эмбеддингов по названию и модели (по умолчанию - из настроек EMBEDDING_BACKEND и модели бэкенда).
+    Это модель для новых векторов; поиск использует модель, которую возвращает get_active_backend.
+    """
+    kind = kind or EMBEDDING_BACKEND
+    if kind not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд эмбеддингов: {kind}")
+    backend_class = EMBEDDING_BACKENDS[kind]
+    with _backends_lock:
+        default = _backends.get(kind)
+        if default is None:
+            default = _backends[kind] = backend_class()
+        if model_name is None or model_name == default.model_name:
+            return default
+        key = f"{kind}:{model_name}"
+        backend = _backends.get(key)
+        if backend is None:
+            backend = _backends[key] = backend_class(model_name, dimension or default.dimension)
+        return backend
+
+
+def get_active_backend() -> EmbeddingBackend:
+    """
+    Бэкенд модели, векторы которой сейчас используются для поиска.
+    После смены модели в настройках поиск продолжает работать на прежней модели,
+    пока задание перевекторизации не пересчитает векторы и не переключит активную модель в БД.
+    """
+    global _active_backend
+    cached = _active_backend
+    if cached is not None and time.monotonic() - cached[1] < ACTIVE_MODEL_CACHE_SECONDS:
+        return cached[0]
+
+    from app.core.database import SessionLocal
+    from app.models import EmbeddingModel
+
+    backend = None
+    db = SessionLocal()
+    try:
+        active = db.query(EmbeddingModel).filter(EmbeddingModel.status == "active").first()
+        if active is not None:
+            backend = get_embedding_backend(active.backend, active.model_name, active.dimension)
+    except Exception as e:
+        logger.warning(f"Не удалось получить активную модель эмбеддингов из БД: {e}")
+    finally:
+        db.close()
+
+    if backend is None:
+        backend = get_embedding_backend()
+    _active_backend = (backend, time.monotonic())
+    return backend
+
+
+def reset_active_backend() -> None:
+    """Сбрасывает кэш активной модели (после переключения моделей)"""
+    global _active_backend
+    _active_backend = None
+
+
+def vector_index_name(model_key: str) -> str:
+    """Имя частичного индекса HNSW для векторов модели"""
+    slug = re.sub(r"[^a-z0-9]+", "_", model_key.lower()).strip("_")[:40]
+    return f"chunk_embeddings_{slug}_idx"
+
+
+def vector_index_sql(model_key: str, dimension: int, concurrently: bool = False) -> str:
+    """
+    Частичный индекс HNSW для векторов одной модели.
+    Колонка embedding не имеет фиксированной размерности, поэтому индексируется выражение с приведением типа.
+    concurrently - построение без блокировки записи (только вне транзакции).
+    """
+    quoted_key = model_key.replace("'", "''")
+    return (
+        f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {vector_index_name(model_key)} "
+        f"ON chunk_embeddings USING hnsw ((embedding::vector({int(dimension)})) vector_cosine_ops) "
+        f"WHERE model = '{quoted_key}'"
+    )
@@ -0,0 +1,243 @@
+"""Отдача файлов материалов: ETag, условные запросы (304) и запросы диапазонов (206)"""
+import logging
+import mimetypes
+import os
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Iterator, Optional
+from urllib.parse import quote
+
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при чтении файла для ответа
+READ_CHUNK_SIZE = 256 * 1024  # 256 КБ
+
+# Кэширование на клиенте только для авторизованного пользователя; после истечения - повторная проверка по ETag
+MATERIAL_FILE_CACHE_CONTROL = "private, max-age=3600, must-revalidate"
+
+# Сколько секунд доверяем результату проверки доступа к материалу
+ACCESS_CACHE_TTL_SECONDS = 60
+ACCESS_CACHE_SIZE = 10000
+
+# Типы файлов HLS (mimetypes знает их не на всех системах)
+HLS_MEDIA_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+}
+
+# Сегменты HLS не меняются после упаковки
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# Тип содержимого по типу материала, если его не удалось определить по расширению
+MEDIA_TYPE_FALLBACK = {
+    'video': 'video/mp4',
+    'pdf': 'application/pdf',
+    'audio': 'audio/mpeg',
+    'presentation': 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+}
+
+
+class MaterialFile:
+    """Сведения о файле материала, нужные для ответа (без обращения к БД)"""
+    __slots__ = ("path", "file_name", "media_type", "content_hash", "hls_path")
+
+    def __init__(
+        self,
+        path: Path,
+        file_name: str,
+        media_type: str,
+        content_hash: Optional[str],
+        hls_path: Optional[str] = None,
+    ):
+        self.path = path
+        self.file_name = file_name
+        self.media_type = media_type
+        self.content_hash = content_hash
+        self.hls_path = hls_path
+
+
+# Результаты проверки доступа по (user_id, material_id): (время истечения, MaterialFile)
+_access_cache: dict[tuple[int, int], tuple[float, MaterialFile]] = {}
+_access_lock = threading.Lock()
+
+
+def get_cached_material_file(user_id: int, material_id: int) -> Optional[MaterialFile]:
+    """Файл материала, доступ к которому недавно проверялся для пользователя"""
+    with _access_lock:
+        cached = _access_cache.get((user_id, material_id))
+    if cached is None or cached[0] < time.monotonic():
+        return None
+    return cached[1]
+
+
+def remember_material_file(user_id: int, material_id: int, material_file: MaterialFile) -> None:
+    """Запоминает успешную проверку доступа к материалу"""
+    with _access_lock:
+        if len(_access_cache) >= ACCESS_CACHE_SIZE:
+            now = time.monotonic()
+            for key in [key for key, (expires, _) in _access_cache.items() if expires < now]:
+                del _access_cache[key]
+            if len(_access_cache) >= ACCESS_CACHE_SIZE:
+                _access_cache.clear()
+        _access_cache[(user_id, material_id)] = (time.monotonic() + ACCESS_CACHE_TTL_SECONDS, material_file)
+
+
+def forget_material_file(material_id: int) -> None:
+    """Сбрасывает проверки доступа к материалу (после удаления или замены файла)"""
+    with _access_lock:
+        for key in [key for key in _access_cache if key[1] == material_id]:
+            del _access_cache[key]
+
+
+def guess_media_type(file_name: str, file_type: str) -> str:
+    """Тип содержимого по расширению файла, иначе по типу материала"""
+    suffix = Path(file_name).suffix.lower()
+    if suffix in HLS_MEDIA_TYPES:
+        return HLS_MEDIA_TYPES[suffix]
+    media_type, _ = mimetypes.guess_type(file_name)
+    return media_type or MEDIA_TYPE_FALLBACK.get(file_type, 'application/octet-stream')
+
+
+def make_etag(content_hash: Optional[str], stat: os.stat_result) -> str:
+    """
+    Сильный ETag из хэша содержимого, размера и времени изменения файла.
+    Размер и время учитываются, т.к. файл может быть перезаписан загрузкой с тем же именем.
+    """
+    if content_hash:
+        return f'"{content_hash[:16]}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def content_disposition(file_name: str) -> str:
+    """Заголовок Content-Disposition (имена на кириллице передаются через filename*)"""
+    try:
+        file_name.encode("latin-1")
+    except UnicodeEncodeError:
+        return f"inline; filename*=utf-8''{quote(file_name)}"
+    return f'inline; filename="{file_name}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    candidates = [value.strip() for value in header.split(",")]
+    # Для If-None-Match используется слабое сравнение
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    return since is not None and int(mtime) <= since.timestamp()
+
+
+def parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    Разбирает заголовок Range с одним диапазоном.
+    Возвращает (start, end) включительно, None - если заголовок не поддерживается (отдаем файл целиком).
+    Выбрасывает 416, если диапазон за пределами файла.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start_text, _, end_text = ranges.strip().partition("-")
+    try:
+        if start_text == "":
+            # bytes=-N: последние N байт
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+            end = min(end, size - 1)
+    except ValueError:
+        return None
+    if start < 0 or start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Запрошенный диапазон недоступен",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+
+def _iter_file(path: Path, start: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def serve_material_file(
+    request: Request,
+    material_file: MaterialFile,
+    cache_control: str = MATERIAL_FILE_CACHE_CONTROL,
+) -> Response:
+    """Ответ с файлом материала с учетом If-None-Match, If-Modified-Since, Range и If-Range"""
+    try:
+        stat = material_file.path.stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Файл не найден")
+
+    etag = make_etag(material_file.content_hash, stat)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+
+    # Условные запросы: If-None-Match имеет приоритет над If-Modified-Since
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and _not_modified_since(if_modified_since, stat.st_mtime):
+            return Response(status_code=304, headers=headers)
+
+    headers["Content-Disposition"] = content_disposition(material_file.file_name)
+    size = stat.st_size
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header:
+        # If-Range: диапазон отдаем, только если у клиента та же версия файла
+        if_range = request.headers.get("if-range")
+        if not if_range or if_range.strip() == etag:
+            byte_range = parse_range(range_header, size)
+
+    if byte_range is None:
+        # Файл целиком отдает сервер (sendfile, если поддерживается), без чтения блоками в Python
+        return FileResponse(
+            material_file.path,
+            media_type=material_file.media_type,
+            headers=headers,
+            stat_result=stat
+        )
+
+    start, end = byte_range
+    length = end - start + 1
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(length)
+    return StreamingResponse(
+        _iter_file(material_file.path, start, length),
+        status_code=206,
+        media_type=material_file.media_type,
+        headers=headers
+    )
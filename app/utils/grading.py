@@ -0,0 +1,244 @@
+"""Проверка ответов на тесты по закэшированному ключу ответов"""
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.models import AttemptAnswer, Question
+
+logger = logging.getLogger(__name__)
+
+# Максимальное количество ключей ответов в кэше процесса
+ANSWER_KEYS_CACHE_SIZE = 512
+
+# Кэш ключей ответов по ID теста: (версия теста - Test.updated_at, ключ)
+_answer_keys_cache: "OrderedDict[int, Tuple[Optional[str], AnswerKey]]" = OrderedDict()
+_answer_keys_lock = threading.Lock()
+
+
+def resolve_correct_index(options: List[str], correct_answer: str, hinted_index: Any = None) -> int:
+    """
+    Определяет индекс правильного варианта ответа.
+    Сначала ищет вариант, совпадающий с текстом правильного ответа, затем - совпадающий без учета регистра и пробелов.
+    Подсказка (correct_index от LLM) принимается, только если её вариант согласуется с текстом правильного ответа.
+    Возвращает -1, если правильный вариант определить не удалось.
+    """
+    for idx, option in enumerate(options):
+        if option == correct_answer:
+            return idx
+    normalized_answer = _normalize_option(correct_answer)
+    matches = [idx for idx, option in enumerate(options) if _normalize_option(option) == normalized_answer]
+    if hinted_index in matches:
+        return hinted_index
+    if matches:
+        return matches[0]
+    if isinstance(hinted_index, int) and 0 <= hinted_index < len(options):
+        logger.warning(
+            f"Подсказка correct_index={hinted_index} не совпадает с правильным ответом "
+            f"{correct_answer!r}, правильный вариант не определен"
+        )
+    return -1
+
+
+def _normalize_option(text: Any) -> str:
+    return " ".join(str(text or "").split()).casefold()
+
+
+def parse_choice(value: Any) -> Optional[int]:
+    """
+    Преобразует ответ студента в индекс варианта.
+    Возвращает -1, если ответа нет, и None, если ответ некорректен.
+    """
+    if value is None or value == "":
+        return -1
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_open_answer_correct(student_answer: str, correct_answer: str) -> bool:
+    """Проверка ответа на открытый вопрос (совпадение или вхождение без учета регистра)"""
+    student_answer_text = (student_answer or "").strip().lower()
+    correct_answer_text = (correct_answer or "").strip().lower()
+    if not correct_answer_text:
+        return False
+    return (
+        student_answer_text == correct_answer_text
+        or correct_answer_text in student_answer_text
+        or student_answer_text in correct_answer_text
+    )
+
+
+def pack_correct_mask(is_correct: np.ndarray) -> bytes:
+    """Упаковывает вектор правильности ответов в битовую маску"""
+    return np.packbits(is_correct.astype(bool)).tobytes()
+
+
+def unpack_correct_mask(mask: Optional[bytes], total_questions: int) -> Optional[List[bool]]:
+    """Распаковывает битовую маску правильности ответов (None, если маски нет)"""
+    if mask is None:
+        return None
+    bits = np.unpackbits(np.frombuffer(mask, dtype=np.uint8))[:total_questions]
+    return bits.astype(bool).tolist()
+
+
+class AnswerKey:
+    """
+    Ключ ответов теста: вопросы в порядке order_index, распарсенные варианты и индексы правильных ответов.
+    Строится один раз на тест и переиспользуется при проверке и просмотре истории попыток.
+    """
+    __slots__ = (
+        "test_id",
+        "question_ids",
+        "question_texts",
+        "question_types",
+        "order_indexes",
+        "correct_answers",
+        "options",
+        "options_json",
+        "correct_index",
+        "multiple_choice",
+    )
+
+    def __init__(self, test_id: int, questions: List[Question]):
+        self.test_id = test_id
+        self.question_ids = [q.id for q in questions]
+        self.question_texts = [q.question_text for q in questions]
+        self.question_types = [q.question_type for q in questions]
+        self.order_indexes = [q.order_index for q in questions]
+        self.correct_answers = [q.correct_answer or "" for q in questions]
+        self.options = [list(q.options) if q.options else [] for q in questions]
+        # В API варианты по-прежнему отдаются JSON строкой - сериализуем один раз
+        self.options_json = [
+            json.dumps(opts, ensure_ascii=False) if q.options is not None else None
+            for q, opts in zip(questions, self.options)
+        ]
+
+        correct_index = []
+        for q, opts in zip(questions, self.options):
+            if q.correct_index is not None:
+                correct_index.append(q.correct_index)
+            else:
+                # Вопрос создан до появления correct_index
+                correct_index.append(resolve_correct_index(opts, q.correct_answer))
+        self.correct_index = np.array(correct_index, dtype=np.int32)
+        self.multiple_choice = np.array(
+            [qt == "multiple_choice" for qt in self.question_types], dtype=bool
+        )
+
+    def __len__(self) -> int:
+        return len(self.question_ids)
+
+    def chosen_indexes(self, answers: dict) -> np.ndarray:
+        """Вектор выбранных индексов по вопросам теста (-1 - ответа нет или он некорректен)"""
+        chosen = np.full(len(self.question_ids), -1, dtype=np.int32)
+        for pos, question_id in enumerate(self.question_ids):
+            if not self.multiple_choice[pos]:
+                continue
+            index = parse_choice(answers.get(str(question_id), ""))
+            if index is not None:
+                chosen[pos] = index
+        return chosen
+
+    def grade(self, answers: dict, chosen: Optional[np.ndarray] = None) -> np.ndarray:
+        """Вектор правильности ответов по вопросам теста"""
+        if chosen is None:
+            chosen = self.chosen_indexes(answers)
+        is_correct = (chosen == self.correct_index) & (chosen >= 0) & self.multiple_choice
+        # Открытые вопросы (если останутся) проверяем по тексту
+        for pos in np.flatnonzero(~self.multiple_choice):
+            student_answer = str(answers.get(str(self.question_ids[pos]), ""))
+            is_correct[pos] = is_open_answer_correct(student_answer, self.correct_answers[pos])
+        return is_correct
+
+    def answer_columns(self, answers: dict) -> Tuple[np.ndarray, np.ndarray, List[Optional[str]]]:
+        """
+        Проверяет ответы и раскладывает их по вопросам теста:
+        выбранные индексы, правильность и тексты ответов на открытые вопросы.
+        """
+        chosen = self.chosen_indexes(answers)
+        is_correct = self.grade(answers, chosen)
+        answer_texts = [
+            None if self.multiple_choice[pos] else str(answers.get(str(question_id), ""))
+            for pos, question_id in enumerate(self.question_ids)
+        ]
+        return chosen, is_correct, answer_texts
+
+    def columns_from_rows(self, rows: Dict[int, AttemptAnswer]) -> Tuple[np.ndarray, np.ndarray, List[Optional[str]]]:
+        """Те же столбцы, что и answer_columns, но по сохраненным строкам attempt_answers"""
+        chosen = np.full(len(self.question_ids), -1, dtype=np.int32)
+        is_correct = np.zeros(len(self.question_ids), dtype=bool)
+        answer_texts: List[Optional[str]] = [None] * len(self.question_ids)
+        for pos, question_id in enumerate(self.question_ids):
+            row = rows.get(question_id)
+            if row is None:
+                continue
+            chosen[pos] = row.chosen_index
+            is_correct[pos] = row.is_correct
+            answer_texts[pos] = row.answer_text
+        return chosen, is_correct, answer_texts
+
+    def option_text(self, pos: int, index: int) -> Optional[str]:
+        """Текст варианта по индексу (None, если индекс вне диапазона)"""
+        options = self.options[pos]
+        if 0 <= index < len(options):
+            return options[index]
+        return None
+
+
+def get_answer_key(db: Session, test_id: int, version: Optional[str] = None) -> AnswerKey:
+    """
+    Возвращает ключ ответов теста из кэша или строит его по вопросам из БД.
+    version - Test.updated_at: ключ, построенный до замены вопросов (в том числе в другом процессе), перестраивается.
+    """
+    with _answer_keys_lock:
+        cached = _answer_keys_cache.get(test_id)
+        if cached is not None and cached[0] == version:
+            _answer_keys_cache.move_to_end(test_id)
+            return cached[1]
+
+    questions = db.query(Question).filter(Question.test_id == test_id).order_by(Question.order_index).all()
+    key = AnswerKey(test_id, questions)
+
+    with _answer_keys_lock:
+        _answer_keys_cache[test_id] = (version, key)
+        _answer_keys_cache.move_to_end(test_id)
+        while len(_answer_keys_cache) > ANSWER_KEYS_CACHE_SIZE:
+            _answer_keys_cache.popitem(last=False)
+    return key
+
+
+def invalidate_answer_key(test_id: int) -> None:
+    """Сбрасывает ключ ответов теста (после замены вопросов)"""
+    with _answer_keys_lock:
+        _answer_keys_cache.pop(test_id, None)
+
+
+def load_attempt_answers(db: Session, attempt_ids: List[int]) -> Dict[int, Dict[int, AttemptAnswer]]:
+    """Загружает проверенные ответы попыток одним запросом: {attempt_id: {question_id: AttemptAnswer}}"""
+    if not attempt_ids:
+        return {}
+    rows = db.query(AttemptAnswer).filter(AttemptAnswer.attempt_id.in_(attempt_ids)).all()
+    answers_by_attempt: Dict[int, Dict[int, AttemptAnswer]] = {}
+    for row in rows:
+        answers_by_attempt.setdefault(row.attempt_id, {})[row.question_id] = row
+    return answers_by_attempt
+
+
+def attempt_columns(key: AnswerKey, attempt, rows: Optional[Dict[int, AttemptAnswer]]) -> Tuple[np.ndarray, np.ndarray, List[Optional[str]]]:
+    """
+    Столбцы ответов попытки: из attempt_answers, а для попыток без строк
+    (сохраненных до появления таблицы) - проверкой JSON с ответами.
+    """
+    if rows:
+        return key.columns_from_rows(rows)
+    try:
+        answers = json.loads(attempt.answers)
+    except (json.JSONDecodeError, TypeError):
+        answers = {}
+    return key.answer_columns(answers)
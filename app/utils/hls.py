@@ -0,0 +1,158 @@
+"""Упаковка видео материалов в HLS с несколькими качествами (адаптивный битрейт)"""
+import json
+import logging
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+from app.core.config import HLS_RENDITIONS, HLS_SEGMENT_SECONDS
+from app.utils.transcription import ensure_ffmpeg_in_path, find_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# Лестница качеств: высота кадра -> (битрейт видео, битрейт аудио)
+RENDITION_LADDER = {
+    240: ("400k", "64k"),
+    360: ("800k", "96k"),
+    480: ("1400k", "128k"),
+    720: ("2800k", "128k"),
+    1080: ("5000k", "160k"),
+}
+
+MASTER_PLAYLIST = "master.m3u8"
+
+# Ограничение времени упаковки одного видео (секунды)
+HLS_TIMEOUT_SECONDS = 4 * 60 * 60
+
+
+def hls_dir(lecture_id: int, material_id: int) -> Path:
+    """Директория HLS версии материала (рядом с файлами лекции)"""
+    return Path("uploads/lectures") / str(lecture_id) / "hls" / str(material_id)
+
+
+def _ffprobe_path(ffmpeg_path: str) -> str:
+    if ffmpeg_path == "ffmpeg":
+        return "ffprobe"
+    return str(Path(ffmpeg_path).with_name(Path(ffmpeg_path).name.replace("ffmpeg", "ffprobe")))
+
+
+def probe_video(ffmpeg_path: str, input_path: Path) -> tuple[Optional[int], bool]:
+    """Высота кадра исходного видео и наличие звуковой дорожки"""
+    command = [
+        _ffprobe_path(ffmpeg_path),
+        '-v', 'quiet',
+        '-print_format', 'json',
+        '-show_streams',
+        str(input_path)
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=60)
+    streams = json.loads(result.stdout or "{}").get("streams", [])
+    height = next((s.get("height") for s in streams if s.get("codec_type") == "video"), None)
+    has_audio = any(s.get("codec_type") == "audio" for s in streams)
+    return height, has_audio
+
+
+def select_renditions(source_height: Optional[int]) -> list[int]:
+    """Качества из настроек, не превышающие исходное (минимум одно - самое низкое)"""
+    configured = sorted(h for h in HLS_RENDITIONS if h in RENDITION_LADDER)
+    if not configured:
+        configured = [360, 720]
+    if source_height:
+        selected = [h for h in configured if h <= source_height]
+        return selected or configured[:1]
+    return configured
+
+
+def build_hls_command(ffmpeg_path: str, input_path: Path, output_dir: Path, heights: list[int], has_audio: bool) -> list[str]:
+    """Команда ffmpeg: одно декодирование, масштабирование в несколько качеств, сегменты и мастер-плейлист"""
+    count = len(heights)
+    split = f"[0:v]split={count}" + "".join(f"[v{i}]" for i in range(count))
+    scales = [f"[v{i}]scale=-2:{height}[v{i}out]" for i, height in enumerate(heights)]
+
+    command = [
+        ffmpeg_path, '-y', '-i', str(input_path),
+        '-filter_complex', ";".join([split] + scales),
+    ]
+    for i, height in enumerate(heights):
+        video_bitrate, audio_bitrate = RENDITION_LADDER[height]
+        command += [
+            '-map', f'[v{i}out]',
+            f'-c:v:{i}', 'libx264',
+            f'-b:v:{i}', video_bitrate,
+            f'-maxrate:v:{i}', video_bitrate,
+            f'-bufsize:v:{i}', video_bitrate,
+        ]
+        if has_audio:
+            command += ['-map', 'a:0', f'-c:a:{i}', 'aac', f'-b:a:{i}', audio_bitrate, '-ac', '2']
+
+    stream_map = " ".join(
+        f"v:{i},a:{i},name:{height}p" if has_audio else f"v:{i},name:{height}p"
+        for i, height in enumerate(heights)
+    )
+    command += [
+        '-preset', 'veryfast',
+        # Ключевые кадры на границах сегментов, чтобы качества переключались без артефактов
+        '-force_key_frames', f'expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})',
+        '-sc_threshold', '0',
+        '-f', 'hls',
+        '-hls_time', str(HLS_SEGMENT_SECONDS),
+        '-hls_playlist_type', 'vod',
+        '-hls_flags', 'independent_segments',
+        '-hls_segment_filename', str(output_dir / '%v' / 'seg_%05d.ts'),
+        '-master_pl_name', MASTER_PLAYLIST,
+        '-var_stream_map', stream_map,
+        str(output_dir / '%v' / 'index.m3u8'),
+    ]
+    return command
+
+
+def package_hls(input_path: Path, lecture_id: int, material_id: int) -> Optional[str]:
+    """
+    Упаковывает видео в HLS.
+    Возвращает путь к мастер-плейлисту относительно рабочей директории или None при ошибке.
+    Результат появляется атомарно: сначала пишется во временную директорию, затем переименовывается.
+    """
+    ffmpeg_path = find_ffmpeg()
+    if not ffmpeg_path:
+        logger.warning(f"FFmpeg не найден, HLS для материала {material_id} не создан")
+        return None
+    ensure_ffmpeg_in_path(ffmpeg_path)
+
+    target_dir = hls_dir(lecture_id, material_id)
+    work_dir = target_dir.with_name(f".{material_id}.tmp")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    work_dir.mkdir(parents=True)
+
+    try:
+        source_height, has_audio = probe_video(ffmpeg_path, input_path)
+        heights = select_renditions(source_height)
+        logger.info(f"Упаковка HLS для материала {material_id}: качества {heights}")
+
+        command = build_hls_command(ffmpeg_path, input_path, work_dir, heights, has_audio)
+        result = subprocess.run(
+            command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            timeout=HLS_TIMEOUT_SECONDS
+        )
+        if result.returncode != 0 or not (work_dir / MASTER_PLAYLIST).exists():
+            logger.error(f"Ошибка упаковки HLS для материала {material_id}: {result.stderr[-2000:]}")
+            shutil.rmtree(work_dir, ignore_errors=True)
+            return None
+
+        shutil.rmtree(target_dir, ignore_errors=True)
+        os.replace(work_dir, target_dir)
+        logger.info(f"HLS для материала {material_id} готов: {target_dir}")
+        return (target_dir / MASTER_PLAYLIST).as_posix()
+    except Exception as e:
+        logger.error(f"Ошибка упаковки HLS для материала {material_id}: {e}", exc_info=True)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return None
+
+
+def remove_hls(lecture_id: int, material_id: int) -> None:
+    """Удаляет HLS версию материала"""
+    shutil.rmtree(hls_dir(lecture_id, material_id), ignore_errors=True)
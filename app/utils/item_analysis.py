@@ -0,0 +1,173 @@
+"""Анализ заданий теста: трудность, дискриминативность и частоты выбора вариантов"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models import AttemptAnswer, TestAttempt
+from app.utils.grading import AnswerKey, get_answer_key
+
+logger = logging.getLogger(__name__)
+
+# Доля студентов в верхней и нижней группах для индекса дискриминации (классические 27%)
+DISCRIMINATION_GROUP_SHARE = 0.27
+
+# Максимальное количество результатов анализа в кэше процесса
+ITEM_ANALYSIS_CACHE_SIZE = 128
+
+# Кэш результатов по (test_id, first_only); сбрасывается при появлении новых попыток
+_analysis_cache: "OrderedDict[tuple[int, bool], tuple[tuple, dict]]" = OrderedDict()
+_analysis_lock = threading.Lock()
+
+
+def _attempts_query(db: Session, test_id: int, first_only: bool, since: Optional[str] = None):
+    """
+    Попытки для анализа. since - Test.updated_at: попытки до замены вопросов отвечали на другие вопросы
+    и учитываются без них (иначе новые вопросы выглядели бы неотвеченными).
+    """
+    query = db.query(TestAttempt).filter(TestAttempt.test_id == test_id)
+    if since is not None:
+        query = query.filter(TestAttempt.completed_at >= since)
+    if first_only:
+        # Первые попытки не искажены повторным прохождением того же теста
+        if since is None:
+            query = query.filter(TestAttempt.attempt_number == 1)
+        else:
+            # Первая попытка студента по текущим вопросам
+            first_ids = db.query(func.min(TestAttempt.id)).filter(
+                TestAttempt.test_id == test_id,
+                TestAttempt.completed_at >= since
+            ).group_by(TestAttempt.user_id)
+            query = query.filter(TestAttempt.id.in_(first_ids.scalar_subquery()))
+    return query
+
+
+def load_chosen_matrix(db: Session, key: AnswerKey, first_only: bool = True, since: Optional[str] = None) -> np.ndarray:
+    """
+    Матрица выбранных индексов: строки - попытки, столбцы - вопросы теста (-1 - нет ответа).
+    Строится по проверенным ответам из attempt_answers без разбора JSON.
+    """
+    rows = (
+        _attempts_query(db, key.test_id, first_only, since)
+        .join(AttemptAnswer, AttemptAnswer.attempt_id == TestAttempt.id)
+        .with_entities(AttemptAnswer.attempt_id, AttemptAnswer.question_id, AttemptAnswer.chosen_index)
+        .all()
+    )
+    if not rows or not len(key):
+        return np.full((0, len(key)), -1, dtype=np.int32)
+
+    data = np.array(rows, dtype=np.int64)
+    attempt_ids, row_positions = np.unique(data[:, 0], return_inverse=True)
+
+    # Позиции вопросов в ключе ответов (вопросы, которых нет в тесте, отбрасываем)
+    question_ids = np.array(key.question_ids, dtype=np.int64)
+    order = np.argsort(question_ids)
+    found = np.searchsorted(question_ids[order], data[:, 1])
+    found = np.minimum(found, len(question_ids) - 1)
+    known = question_ids[order][found] == data[:, 1]
+
+    chosen = np.full((len(attempt_ids), len(key)), -1, dtype=np.int32)
+    chosen[row_positions[known], order[found[known]]] = data[known, 2]
+    return chosen
+
+
+def analyze_items(key: AnswerKey, chosen: np.ndarray) -> dict:
+    """
+    Считает статистику заданий за один проход по матрице ответов.
+    difficulty - доля правильных ответов, discrimination - разница долей правильных ответов
+    в верхней и нижней группах по суммарному баллу, point_biserial - корреляция задания
+    с баллом за остальные задания.
+    """
+    attempts_count, questions_count = chosen.shape
+    correct = (chosen == key.correct_index) & (chosen >= 0) & key.multiple_choice
+    scores = correct.sum(axis=1)
+
+    difficulty = correct.mean(axis=0) if attempts_count else np.zeros(questions_count)
+
+    # Верхняя и нижняя группы по суммарному баллу
+    group_size = max(int(round(attempts_count * DISCRIMINATION_GROUP_SHARE)), 1)
+    if attempts_count >= 2:
+        order = np.argsort(scores, kind="stable")
+        lower = correct[order[:group_size]].mean(axis=0)
+        upper = correct[order[-group_size:]].mean(axis=0)
+        discrimination = upper - lower
+    else:
+        discrimination = np.zeros(questions_count)
+
+    # Скорректированная точечно-бисериальная корреляция (балл без текущего задания)
+    point_biserial = np.zeros(questions_count)
+    if attempts_count >= 2:
+        item = correct.astype(np.float64)
+        rest = scores[:, None] - item
+        item_centered = item - item.mean(axis=0)
+        rest_centered = rest - rest.mean(axis=0)
+        denominator = np.sqrt((item_centered ** 2).sum(axis=0) * (rest_centered ** 2).sum(axis=0))
+        numerator = (item_centered * rest_centered).sum(axis=0)
+        np.divide(numerator, denominator, out=point_biserial, where=denominator > 0)
+
+    items = []
+    for pos in range(questions_count):
+        options = key.options[pos]
+        column = chosen[:, pos]
+        answered = column[(column >= 0) & (column < len(options))]
+        option_counts = np.bincount(answered, minlength=len(options)) if options else np.zeros(0, dtype=np.int64)
+        items.append({
+            "question_id": key.question_ids[pos],
+            "question_text": key.question_texts[pos],
+            "order_index": key.order_indexes[pos],
+            "correct_index": int(key.correct_index[pos]),
+            "difficulty": round(float(difficulty[pos]), 4),
+            "discrimination": round(float(discrimination[pos]), 4),
+            "point_biserial": round(float(point_biserial[pos]), 4),
+            "unanswered": int(attempts_count - answered.size),
+            "options": [
+                {
+                    "index": index,
+                    "text": option,
+                    "count": int(option_counts[index]),
+                    "share": round(float(option_counts[index]) / attempts_count, 4) if attempts_count else 0,
+                    "is_correct": index == int(key.correct_index[pos]),
+                }
+                for index, option in enumerate(options)
+            ],
+        })
+
+    return {
+        "attempts_count": int(attempts_count),
+        "questions_count": int(questions_count),
+        "average_score": round(float(scores.mean()), 4) if attempts_count else 0,
+        "items": items,
+    }
+
+
+def get_item_analysis(db: Session, test_id: int, first_only: bool = True, version: Optional[str] = None) -> dict:
+    """
+    Возвращает анализ заданий теста.
+    Результат кэшируется и пересчитывается, только если появились новые попытки или заменены вопросы (version).
+    Учитываются только попытки, сделанные после последней замены вопросов теста.
+    """
+    signature = tuple(
+        _attempts_query(db, test_id, first_only, version)
+        .with_entities(func.count(TestAttempt.id), func.max(TestAttempt.id))
+        .one()
+    ) + (version,)
+    cache_key = (test_id, first_only)
+    with _analysis_lock:
+        cached = _analysis_cache.get(cache_key)
+        if cached is not None and cached[0] == signature:
+            _analysis_cache.move_to_end(cache_key)
+            return cached[1]
+
+    key = get_answer_key(db, test_id, version)
+    result = analyze_items(key, load_chosen_matrix(db, key, first_only, version))
+
+    with _analysis_lock:
+        _analysis_cache[cache_key] = (signature, result)
+        _analysis_cache.move_to_end(cache_key)
+        while len(_analysis_cache) > ITEM_ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+    return result
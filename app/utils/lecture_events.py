@@ -0,0 +1,188 @@
+"""
+События обработки лекций для клиентов (Server-Sent Events).
+События доставляются подписчикам в памяти процесса; другим процессам приложения они рассылаются
+через PostgreSQL NOTIFY, каждый процесс слушает канал и передает события своим подписчикам.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy import text
+
+from app.core.database import engine
+
+logger = logging.getLogger(__name__)
+
+# Канал PostgreSQL для рассылки событий между процессами
+NOTIFY_CHANNEL = "lecture_events"
+
+# Этапы, после которых обработка лекции завершена
+TERMINAL_STAGES = {"published", "failed"}
+
+# Для скольких лекций хранится последнее состояние (для клиентов, подключившихся во время обработки)
+LATEST_STATES_SIZE = 1024
+
+# Предел размера NOTIFY в PostgreSQL - 8000 байт; берем с запасом
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+# Размер очереди событий подписчика (промежуточные события прогресса при переполнении отбрасываются)
+SUBSCRIBER_QUEUE_SIZE = 256
+
+# Идентификатор процесса: свои события, вернувшиеся через NOTIFY, повторно не доставляются
+_ORIGIN = uuid.uuid4().hex
+
+# Последние события лекций: lecture_id -> {"lecture" или id материала -> событие}
+_latest: "OrderedDict[int, Dict[Any, Dict[str, Any]]]" = OrderedDict()
+_subscribers: Dict[int, Set["Subscription"]] = {}
+_lock = threading.Lock()
+
+_listener_thread: Optional[threading.Thread] = None
+_listener_lock = threading.Lock()
+
+
+class Subscription:
+    """Подписка клиента на события лекции: очередь в event loop клиента"""
+
+    def __init__(self, lecture_id: int, loop: asyncio.AbstractEventLoop):
+        self.lecture_id = lecture_id
+        self.loop = loop
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def _put(self, event: Dict[str, Any]) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    def deliver(self, event: Dict[str, Any]) -> None:
+        # События публикуются из рабочих потоков, очередь принадлежит event loop клиента
+        self.loop.call_soon_threadsafe(self._put, event)
+
+
+def _dispatch(event: Dict[str, Any]) -> None:
+    lecture_id = event["lecture_id"]
+    with _lock:
+        states = _latest.setdefault(lecture_id, {})
+        if event["stage"] == "queued":
+            # Новая обработка: состояние предыдущей больше не актуально
+            states.clear()
+        states[event.get("material_id") or "lecture"] = event
+        _latest.move_to_end(lecture_id)
+        while len(_latest) > LATEST_STATES_SIZE:
+            _latest.popitem(last=False)
+        subscribers = list(_subscribers.get(lecture_id, ()))
+    for subscription in subscribers:
+        subscription.deliver(event)
+
+
+def publish_event(lecture_id: int, stage: str, material_id: Optional[int] = None, **data: Any) -> None:
+    """
+    Публикует событие обработки лекции: этап (queued, extracting, transcribing, embedding,
+    material_done, material_failed, generating_test, published, failed) и данные этапа.
+    Ошибки доставки не влияют на обработку.
+    """
+    event = {"lecture_id": lecture_id, "stage": stage, "ts": time.time(), **data}
+    if material_id is not None:
+        event["material_id"] = material_id
+    _dispatch(event)
+    try:
+        payload = _notify_payload(event)
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": NOTIFY_CHANNEL, "payload": payload})
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"Не удалось разослать событие лекции {lecture_id} через NOTIFY: {e}")
+
+
+def _notify_payload(event: Dict[str, Any]) -> str:
+    """
+    Событие для NOTIFY в пределах лимита размера: список ошибок не передается (он есть в /processing),
+    длинный текст ошибки обрезается. Иначе другие процессы не получили бы завершающее событие.
+    """
+    event = {key: value for key, value in event.items() if key != "errors"}
+    payload = json.dumps({"origin": _ORIGIN, "event": event}, ensure_ascii=False)
+    if len(payload.encode("utf-8")) > NOTIFY_PAYLOAD_LIMIT and event.get("error"):
+        event["error"] = str(event["error"])[:500] + "…"
+        payload = json.dumps({"origin": _ORIGIN, "event": event}, ensure_ascii=False)
+    return payload
+
+
+def get_latest_events(lecture_id: int) -> List[Dict[str, Any]]:
+    """Последние события лекции (состояние лекции и её материалов) в порядке публикации"""
+    with _lock:
+        states = _latest.get(lecture_id)
+        return sorted(states.values(), key=lambda event: event["ts"]) if states else []
+
+
+def subscribe(lecture_id: int) -> Subscription:
+    """Подписывает текущий event loop на события лекции"""
+    start_event_listener()
+    subscription = Subscription(lecture_id, asyncio.get_running_loop())
+    with _lock:
+        _subscribers.setdefault(lecture_id, set()).add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription: Subscription) -> None:
+    with _lock:
+        subscribers = _subscribers.get(subscription.lecture_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del _subscribers[subscription.lecture_id]
+
+
+def _listen() -> None:
+    """Слушает канал NOTIFY и передает события других процессов подписчикам этого процесса"""
+    while True:
+        connection = None
+        try:
+            # Соединение изымается из пула: оно занято LISTEN всё время работы процесса
+            connection = engine.raw_connection()
+            connection.detach()
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            logger.info("Подписка на события обработки лекций (LISTEN) запущена")
+            while True:
+                if select.select([dbapi_connection], [], [], 30) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    try:
+                        message = json.loads(notify.payload)
+                    except ValueError:
+                        continue
+                    if message.get("origin") != _ORIGIN:
+                        _dispatch(message["event"])
+        except Exception as e:
+            logger.warning(f"Подписка на события обработки лекций прервана, переподключение: {e}")
+            time.sleep(5)
+        finally:
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+
+def start_event_listener() -> None:
+    """Запускает поток LISTEN (один на процесс)"""
+    global _listener_thread
+    with _listener_lock:
+        if _listener_thread is None or not _listener_thread.is_alive():
+            _listener_thread = threading.Thread(target=_listen, name="lecture-events", daemon=True)
+            _listener_thread.start()
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """Событие в формате Server-Sent Events"""
+    return f"event: {event['stage']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
@@ -0,0 +1,169 @@
+"""
+Состояние обработки материалов лекции, сохраняемое в строке лекции.
+Переходы выполняются условными UPDATE: повторная публикация во время обработки присоединяется
+к уже запущенной обработке, а не запускает вторую (транскрибация и генерация теста не повторяются).
+"""
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import LECTURE_PROCESSING_STALE_MINUTES
+
+# Состояния обработки лекции
+QUEUED = "queued"          # Обработка поставлена в очередь
+RUNNING = "running"        # Материалы обрабатываются
+FAILED = "failed"          # Ни один материал не обработан или публикация не удалась
+PARTIAL = "partial"        # Часть материалов обработана; повторная публикация обработает только остальные
+PUBLISHED = "published"    # Все материалы обработаны, лекция опубликована
+
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# Состояния материала
+MATERIAL_PENDING = "pending"
+MATERIAL_RUNNING = "running"
+MATERIAL_DONE = "done"
+MATERIAL_FAILED = "failed"
+
+# Как часто длительный этап (транскрибация) обновляет processing_updated_at, чтобы обработка не считалась прерванной
+HEARTBEAT_SECONDS = 60
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def claim_lecture_processing(db: Session, lecture_id: int, materials: Iterable[Any]) -> bool:
+    """
+    Переводит лекцию в состояние queued, если она не обрабатывается (опубликованная лекция
+    остается доступной студентам, пока обрабатываются её новые материалы).
+    Обработка, которая давно не обновляла состояние (процесс остановлен), считается прерванной.
+    Возвращает False, если обработка уже идет: запускать новую не нужно. Коммит выполняет вызывающий код.
+    """
+    now = datetime.now()
+    material_states = {
+        str(material.id): {"file_name": material.file_name, "status": MATERIAL_PENDING}
+        for material in materials
+    }
+    row = db.execute(text("""
+        UPDATE lectures
+        SET processing_status = :queued,
+            processing_materials = CAST(:materials AS jsonb),
+            processing_error = NULL,
+            processing_started_at = :now,
+            processing_finished_at = NULL,
+            processing_updated_at = :now
+        WHERE id = :lecture_id
+            AND (
+                processing_status IS NULL
+                OR processing_status NOT IN (:queued, :running)
+                OR processing_updated_at IS NULL
+                OR processing_updated_at < :stale_before
+            )
+        RETURNING id
+    """), {
+        "lecture_id": lecture_id,
+        "queued": QUEUED,
+        "running": RUNNING,
+        "materials": json.dumps(material_states, ensure_ascii=False),
+        "now": now.isoformat(),
+        "stale_before": (now - timedelta(minutes=LECTURE_PROCESSING_STALE_MINUTES)).isoformat(),
+    }).first()
+    return row is not None
+
+
+def start_lecture_processing(db: Session, lecture_id: int) -> bool:
+    """Переход queued -> running; False, если обработку уже начал другой процесс. Коммит выполняет вызывающий код"""
+    row = db.execute(text("""
+        UPDATE lectures
+        SET processing_status = :running, processing_updated_at = :now
+        WHERE id = :lecture_id AND processing_status = :queued
+        RETURNING id
+    """), {"lecture_id": lecture_id, "queued": QUEUED, "running": RUNNING, "now": _now()}).first()
+    return row is not None
+
+
+def set_material_state(
+    db: Session,
+    lecture_id: int,
+    material_id: int,
+    status: str,
+    error: Optional[str] = None,
+) -> None:
+    """
+    Обновляет состояние материала в processing_materials одним UPDATE (материалы обрабатываются параллельно).
+    Коммит выполняет вызывающий код.
+    """
+    state: Dict[str, Any] = {"status": status}
+    if status == MATERIAL_RUNNING:
+        state["started_at"] = _now()
+    else:
+        state["finished_at"] = _now()
+        state["error"] = error
+    db.execute(text("""
+        UPDATE lectures
+        SET processing_materials = jsonb_set(
+                COALESCE(processing_materials, '{}'::jsonb),
+                ARRAY[CAST(:key AS text)],
+                COALESCE(processing_materials -> CAST(:key AS text), '{}'::jsonb) || CAST(:state AS jsonb)
+            ),
+            processing_updated_at = :now
+        WHERE id = :lecture_id
+    """), {
+        "lecture_id": lecture_id,
+        "key": str(material_id),
+        "state": json.dumps(state, ensure_ascii=False),
+        "now": _now(),
+    })
+
+
+def touch_lecture_processing(db: Session, lecture_id: int) -> None:
+    """Отмечает, что обработка лекции продолжается (processing_updated_at). Коммит выполняет вызывающий код"""
+    db.execute(text("""
+        UPDATE lectures
+        SET processing_updated_at = :now
+        WHERE id = :lecture_id AND processing_status IN (:queued, :running)
+    """), {"lecture_id": lecture_id, "now": _now(), "queued": QUEUED, "running": RUNNING})
+
+
+def finish_lecture_processing(db: Session, lecture_id: int, status: str, error: Optional[str] = None) -> None:
+    """Завершает обработку (published, partial или failed). Коммит выполняет вызывающий код"""
+    now = _now()
+    db.execute(text("""
+        UPDATE lectures
+        SET processing_status = :status,
+            processing_error = :error,
+            processing_finished_at = :now,
+            processing_updated_at = :now
+        WHERE id = :lecture_id AND processing_status IN (:queued, :running)
+    """), {
+        "lecture_id": lecture_id,
+        "status": status,
+        "error": error,
+        "now": now,
+        "queued": QUEUED,
+        "running": RUNNING,
+    })
+
+
+def serialize_processing_state(lecture: Any) -> Dict[str, Any]:
+    """Состояние обработки лекции для API (из уже загруженной строки лекции)"""
+    material_states = lecture.processing_materials or {}
+    materials = [
+        {"material_id": int(material_id), **state}
+        for material_id, state in sorted(material_states.items(), key=lambda item: int(item[0]))
+    ]
+    return {
+        "lecture_id": lecture.id,
+        "published": lecture.published or False,
+        "status": lecture.processing_status,
+        "error": lecture.processing_error,
+        "started_at": lecture.processing_started_at,
+        "finished_at": lecture.processing_finished_at,
+        "updated_at": lecture.processing_updated_at,
+        "materials_done": sum(1 for state in materials if state.get("status") in (MATERIAL_DONE, MATERIAL_FAILED)),
+        "materials_total": len(materials),
+        "materials": materials,
+    }
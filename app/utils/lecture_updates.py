@@ -0,0 +1,204 @@
+"""
+Инкрементальное обновление производных данных лекции.
+Граф зависимостей: материал (content_hash) -> обработанный текст и чанки с эмбеддингами -> вопросы теста
+(Question.source_material_id). Повторная обработка затрагивает только новые и измененные материалы,
+а в общем тесте заново генерируются только вопросы по ним (тест тот же, попытки студентов сохраняются).
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from app.models import LectureMaterial, ProcessedMaterial, Question, Test
+
+logger = logging.getLogger(__name__)
+
+
+def is_processed_current(material: LectureMaterial, processed: Optional[ProcessedMaterial]) -> bool:
+    """
+    Актуален ли обработанный материал: он есть и получен из того же содержимого файла.
+    Материалы, обработанные до появления хэшей, считаются актуальными.
+    """
+    if processed is None:
+        return False
+    if not processed.content_hash or not material.content_hash:
+        return True
+    return processed.content_hash == material.content_hash
+
+
+def materials_to_process(db: Session, lecture_id: int) -> List[LectureMaterial]:
+    """Новые и измененные материалы лекции (в порядке материалов лекции)"""
+    rows = db.query(LectureMaterial, ProcessedMaterial).outerjoin(
+        ProcessedMaterial, ProcessedMaterial.material_id == LectureMaterial.id
+    ).filter(
+        LectureMaterial.lecture_id == lecture_id
+    ).order_by(LectureMaterial.order_index, LectureMaterial.id).all()
+    # У материала может быть несколько строк обработки (старые данные): достаточно одной актуальной
+    current: Dict[int, bool] = {}
+    materials: Dict[int, LectureMaterial] = {}
+    for material, processed in rows:
+        materials[material.id] = material
+        current[material.id] = current.get(material.id, False) or is_processed_current(material, processed)
+    return [material for material_id, material in materials.items() if not current[material_id]]
+
+
+def get_shared_test(db: Session, lecture_id: int) -> Optional[Test]:
+    """Текущая версия общего теста лекции (режим once)"""
+    return db.query(Test).filter(
+        Test.lecture_id == lecture_id,
+        Test.user_id.is_(None)
+    ).order_by(Test.created_at.desc()).first()
+
+
+def _processed_material_ids(db: Session, lecture_id: int) -> Set[int]:
+    return {
+        material_id for material_id, in db.query(ProcessedMaterial.material_id).filter(
+            ProcessedMaterial.lecture_id == lecture_id,
+            ProcessedMaterial.processed_text.isnot(None)
+        )
+    }
+
+
+def is_test_stale(db: Session, lecture_id: int) -> bool:
+    """Есть ли в общем тесте вопросы по удаленным материалам"""
+    test = get_shared_test(db, lecture_id)
+    if test is None:
+        return False
+    processed_ids = _processed_material_ids(db, lecture_id)
+    return any(
+        question.source_material_id is not None and question.source_material_id not in processed_ids
+        for question in test.questions
+    )
+
+
+def lecture_needs_update(db: Session, lecture: Any) -> bool:
+    """Нужна ли обработка опубликованной лекции: изменились материалы или тест ссылается на удаленные материалы"""
+    if materials_to_process(db, lecture.id):
+        return True
+    return bool(lecture.generate_test and lecture.test_generation_mode == "once" and is_test_stale(db, lecture.id))
+
+
+def _new_question(test_id: int, q_data: Dict[str, Any]) -> Question:
+    return Question(
+        test_id=test_id,
+        question_text=q_data["question_text"],
+        correct_answer=q_data["correct_answer"],
+        options=q_data.get("options"),
+        correct_index=q_data.get("correct_index"),
+        question_type=q_data["question_type"],
+        order_index=q_data["order_index"],
+        source_material_id=q_data.get("source_material_id")
+    )
+
+
+def add_generated_test(db: Session, lecture_id: int, questions: list, user_id: Optional[int] = None) -> Test:
+    """Добавляет в сессию тест со сгенерированными вопросами (commit выполняет вызывающий код)"""
+    test = Test(
+        lecture_id=lecture_id,
+        created_at=datetime.now().isoformat(),
+        user_id=user_id
+    )
+    db.add(test)
+    db.flush()
+
+    for q_data in questions:
+        db.add(_new_question(test.id, q_data))
+    return test
+
+
+def replace_test_questions(db: Session, test: Test, questions: list) -> Test:
+    """
+    Заменяет вопросы теста, сохраняя сам тест: попытки, лимит попыток и ведомость остаются привязаны к нему.
+    Вопросы с ключом "id" (текущие вопросы теста) сохраняются с новым order_index, остальные текущие
+    удаляются вместе с ответами на них (итоги прошлых попыток сохраняются).
+    Commit выполняет вызывающий код; после него нужно сбросить кэши теста (invalidate_test_snapshot).
+    """
+    keep_ids = {q_data["id"] for q_data in questions if q_data.get("id") is not None}
+    db.query(Question).filter(
+        Question.test_id == test.id,
+        Question.id.notin_(keep_ids)
+    ).delete(synchronize_session=False)
+    kept = {
+        question.id: question
+        for question in db.query(Question).filter(Question.id.in_(keep_ids))
+    } if keep_ids else {}
+
+    for q_data in questions:
+        question = kept.get(q_data.get("id"))
+        if question is not None:
+            question.order_index = q_data["order_index"]
+        else:
+            db.add(_new_question(test.id, q_data))
+    test.updated_at = datetime.now().isoformat()
+    db.expire(test, ["questions"])
+    return test
+
+
+def _question_data(question: Question) -> Dict[str, Any]:
+    return {
+        "id": question.id,
+        "question_text": question.question_text,
+        "correct_answer": question.correct_answer,
+        "options": question.options,
+        "correct_index": question.correct_index,
+        "question_type": question.question_type,
+        "source_material_id": question.source_material_id,
+    }
+
+
+def update_lecture_test(
+    db: Session,
+    lecture_id: int,
+    changed_material_ids: Iterable[int],
+    seed: int = 0,
+) -> Optional[Test]:
+    """
+    Обновляет общий тест после обработки измененных материалов, заменяя вопросы в том же тесте.
+    Вопросы по неизмененным материалам остаются, по измененным - генерируются заново, по удаленным - убираются
+    (в том числе когда заново генерировать нечего, поэтому тест перестает ссылаться на удаленные материалы).
+    Если в тесте есть вопросы без известного материала (тест создан до появления связи), вопросы генерируются целиком.
+    Возвращает измененный или созданный тест; None - если вопросы не изменились.
+    Commit выполняет вызывающий код, после него нужно сбросить кэши теста (invalidate_test_snapshot).
+    """
+    from app.utils.rag import generate_lecture_questions
+
+    changed = set(changed_material_ids)
+    current = get_shared_test(db, lecture_id)
+    if current is None or any(question.source_material_id is None for question in current.questions):
+        questions = generate_lecture_questions(db, lecture_id, seed=seed)
+        if not questions:
+            # Не удалось сгенерировать: текущие вопросы лучше, чем пустой тест
+            return None
+    else:
+        processed_ids = _processed_material_ids(db, lecture_id)
+        kept = [
+            _question_data(question)
+            for question in sorted(current.questions, key=lambda question: question.order_index or 0)
+            if question.source_material_id in processed_ids and question.source_material_id not in changed
+        ]
+        regenerate = processed_ids & changed
+        if not regenerate and len(kept) == len(current.questions):
+            return None
+        questions = kept + (generate_lecture_questions(db, lecture_id, seed=seed, material_ids=regenerate) if regenerate else [])
+        logger.info(
+            f"Обновление теста {current.id} лекции {lecture_id}: оставлено вопросов {len(kept)}, "
+            f"заново по материалам {sorted(regenerate)}: {len(questions) - len(kept)}"
+        )
+        if regenerate and len(questions) == len(kept):
+            logger.warning(f"Не удалось сгенерировать вопросы по материалам {sorted(regenerate)} лекции {lecture_id}")
+
+    # Вопросы идут в порядке материалов лекции
+    positions = {
+        material_id: position for position, (material_id,) in enumerate(
+            db.query(LectureMaterial.id).filter(
+                LectureMaterial.lecture_id == lecture_id
+            ).order_by(LectureMaterial.order_index, LectureMaterial.id)
+        )
+    }
+    questions.sort(key=lambda q_data: positions.get(q_data.get("source_material_id"), len(positions)))
+    for order_index, q_data in enumerate(questions):
+        q_data["order_index"] = order_index
+    if current is None:
+        return add_generated_test(db, lecture_id, questions)
+    return replace_test_questions(db, current, questions)
@@ -0,0 +1,112 @@
+"""
+Постоянный кэш ответов LLM при генерации вопросов.
+Ключ - хэш модели, температуры, версии шаблона промпта, текста фрагментов, количества вопросов и seed,
+поэтому повторная генерация по тем же материалам (переопубликование, одинаковые варианты per_student)
+стоит одного запроса к БД вместо запроса к GigaChat.
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from app.core.config import LLM_CACHE_ENABLED, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_DAYS
+from app.core.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Запись кэша (или обновление просроченной); затем удаление просроченных и самых давно использованных сверх лимита
+STORE_SQL = text("""
+    INSERT INTO llm_response_cache (key, model, response, created_at, last_used_at, hits)
+    VALUES (:key, :model, CAST(:response AS JSONB), :now, :now, 0)
+    ON CONFLICT (key) DO UPDATE SET
+        response = EXCLUDED.response,
+        created_at = EXCLUDED.created_at,
+        last_used_at = EXCLUDED.last_used_at
+""")
+
+EVICT_SQL = text("""
+    DELETE FROM llm_response_cache
+    WHERE created_at < :expires_before
+        OR key IN (
+            SELECT key FROM llm_response_cache
+            ORDER BY last_used_at DESC
+            OFFSET :max_entries
+        )
+""")
+
+LOOKUP_SQL = text("""
+    UPDATE llm_response_cache
+    SET hits = hits + 1, last_used_at = :now
+    WHERE key = :key AND created_at >= :expires_before
+    RETURNING response
+""")
+
+
+def questions_cache_key(
+    model: str,
+    temperature: float,
+    prompt_version: int,
+    source_text: str,
+    num_questions: int,
+    seed: int,
+) -> str:
+    """Ключ кэша: sha256 от параметров генерации и sha256 текста"""
+    parts = {
+        "model": model,
+        "temperature": temperature,
+        "prompt_version": prompt_version,
+        "text": hashlib.sha256(source_text.encode("utf-8")).hexdigest(),
+        "num_questions": num_questions,
+        "seed": seed,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _expires_before() -> str:
+    return (datetime.now() - timedelta(days=LLM_CACHE_TTL_DAYS)).isoformat()
+
+
+def get_cached_questions(key: str) -> Optional[List[Dict[str, Any]]]:
+    """Вопросы из кэша (None - нет записи, она просрочена или кэш отключен)"""
+    if not LLM_CACHE_ENABLED:
+        return None
+    # Отдельная сессия: кэш не должен участвовать в транзакции вызывающего кода
+    db = SessionLocal()
+    try:
+        response = db.execute(LOOKUP_SQL, {
+            "key": key,
+            "now": datetime.now().isoformat(),
+            "expires_before": _expires_before(),
+        }).scalar()
+        db.commit()
+        return response
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Не удалось прочитать кэш ответов LLM: {e}")
+        return None
+    finally:
+        db.close()
+
+
+def store_questions(key: str, model: str, questions: List[Dict[str, Any]]) -> None:
+    """Сохраняет вопросы в кэш и вытесняет просроченные и лишние записи"""
+    if not LLM_CACHE_ENABLED:
+        return
+    db = SessionLocal()
+    try:
+        db.execute(STORE_SQL, {
+            "key": key,
+            "model": model,
+            "response": json.dumps(questions, ensure_ascii=False),
+            "now": datetime.now().isoformat(),
+        })
+        db.execute(EVICT_SQL, {"expires_before": _expires_before(), "max_entries": LLM_CACHE_MAX_ENTRIES})
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Не удалось сохранить ответ LLM в кэш: {e}")
+    finally:
+        db.close()
@@ -0,0 +1,202 @@
+"""
+Разбор и проверка ответов LLM с вопросами теста.
+Ответ разбирается по одному вопросу: испорченный или оборванный вопрос не мешает сохранить остальные,
+а ошибки каждого вопроса возвращаются, чтобы переспросить модель только о них.
+"""
+import json
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils.grading import resolve_correct_index
+
+# Количество вариантов ответа в вопросе
+OPTIONS_COUNT = 4
+
+# Режимы сбоев (ключи счетчиков)
+NO_JSON = "no_json"                        # В ответе нет JSON
+MALFORMED_ITEM = "malformed_item"          # Вопрос не разбирается как JSON даже после исправления
+TRUNCATED = "truncated"                    # Ответ оборван (лимит токенов), последний вопрос потерян
+MISSING_TEXT = "missing_text"              # Нет текста вопроса
+BAD_OPTIONS = "bad_options"                # Вариантов не 4 или есть пустые
+DUPLICATE_OPTIONS = "duplicate_options"    # Варианты повторяются
+NO_CORRECT_ANSWER = "no_correct_answer"    # Правильный ответ не совпадает ни с одним вариантом
+
+# Описания ошибок для промпта исправления
+ERROR_DESCRIPTIONS = {
+    MISSING_TEXT: "нет текста вопроса",
+    BAD_OPTIONS: f"должно быть ровно {OPTIONS_COUNT} непустых варианта ответа",
+    DUPLICATE_OPTIONS: "варианты ответа повторяются",
+    NO_CORRECT_ANSWER: "правильный ответ не совпадает ни с одним из вариантов",
+}
+
+_FENCE_RE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+# Буквенная метка варианта: "A) ", "Б. ", "c: "
+_OPTION_LABEL_RE = re.compile(r"^\s*[A-DА-Г]\s*[).:]\s+", re.IGNORECASE)
+_LETTERS = {"A": 0, "B": 1, "C": 2, "D": 3, "А": 0, "Б": 1, "В": 2, "Г": 3}
+
+_decoder = json.JSONDecoder()
+
+_stats: Dict[str, int] = {}
+_stats_lock = threading.Lock()
+
+
+def count_event(name: str, value: int = 1) -> None:
+    """Увеличивает счетчик генерации вопросов"""
+    if value:
+        with _stats_lock:
+            _stats[name] = _stats.get(name, 0) + value
+
+
+def get_question_generation_stats() -> Dict[str, int]:
+    """Счетчики генерации вопросов с момента запуска процесса: ответы, валидные вопросы, режимы сбоев"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _balanced_end(text: str, start: int) -> int:
+    """Позиция после объекта, начинающегося с '{' в start; -1, если объект не закрыт (ответ оборван)"""
+    depth = 0
+    in_string = False
+    escaped = False
+    for position in range(start, len(text)):
+        char = text[position]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return position + 1
+    return -1
+
+
+def _repair(fragment: str) -> Optional[Any]:
+    """Исправляет типичные ошибки JSON от LLM: висячие запятые и типографские кавычки"""
+    fragment = _TRAILING_COMMA_RE.sub(r"\1", fragment)
+    fragment = fragment.replace("“", '"').replace("”", '"')
+    try:
+        return json.loads(fragment)
+    except ValueError:
+        return None
+
+
+def _items_start(text: str) -> int:
+    """Позиция начала массива вопросов: после "questions": [ или первой [; -1, если JSON нет"""
+    key = text.find('"questions"')
+    if key != -1:
+        bracket = text.find("[", key)
+        if bracket != -1:
+            return bracket + 1
+    bracket = text.find("[")
+    brace = text.find("{")
+    if bracket != -1 and (brace == -1 or bracket < brace):
+        return bracket + 1
+    # Один вопрос без массива
+    return brace
+
+
+def parse_questions_response(response_text: str) -> Tuple[List[Any], Dict[str, int]]:
+    """
+    Разбирает ответ LLM по одному вопросу.
+    Возвращает разобранные объекты вопросов и количество сбоев разбора по режимам.
+    """
+    failures: Dict[str, int] = {}
+    text = _FENCE_RE.sub("", response_text or "")
+    position = _items_start(text)
+    if position == -1:
+        failures[NO_JSON] = 1
+        return [], failures
+
+    items = []
+    while position < len(text):
+        char = text[position]
+        if char in " \t\r\n,":
+            position += 1
+            continue
+        if char != "{":
+            # Конец массива или посторонний текст после него
+            break
+        try:
+            item, position = _decoder.raw_decode(text, position)
+            items.append(item)
+            continue
+        except ValueError:
+            pass
+        end = _balanced_end(text, position)
+        if end == -1:
+            failures[TRUNCATED] = failures.get(TRUNCATED, 0) + 1
+            break
+        item = _repair(text[position:end])
+        if item is None:
+            failures[MALFORMED_ITEM] = failures.get(MALFORMED_ITEM, 0) + 1
+        else:
+            items.append(item)
+        position = end
+    if not items and not failures:
+        failures[NO_JSON] = 1
+    return items, failures
+
+
+def _clean_option(option: Any) -> str:
+    return str(option).strip() if option is not None else ""
+
+
+def _strip_labels(options: List[str]) -> List[str]:
+    """Убирает буквенные метки вариантов ("A) ..."), только если они есть у всех вариантов (инициалы не трогаем)"""
+    if options and all(_OPTION_LABEL_RE.match(option) for option in options):
+        return [_OPTION_LABEL_RE.sub("", option).strip() for option in options]
+    return options
+
+
+def validate_question(item: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Проверяет вопрос по схеме: текст, ровно 4 различных непустых варианта, правильный ответ среди вариантов.
+    Возвращает (вопрос в формате генератора, None) или (None, режим сбоя).
+    """
+    if not isinstance(item, dict):
+        return None, MALFORMED_ITEM
+    question_text = str(item.get("question_text") or item.get("question") or "").strip()
+    if not question_text:
+        return None, MISSING_TEXT
+
+    options = item.get("options")
+    if not isinstance(options, list):
+        return None, BAD_OPTIONS
+    options = _strip_labels([_clean_option(option) for option in options])
+    if len(options) != OPTIONS_COUNT or not all(options):
+        return None, BAD_OPTIONS
+    if len({option.lower() for option in options}) != len(options):
+        return None, DUPLICATE_OPTIONS
+
+    correct_answer = _clean_option(item.get("correct_answer"))
+    if correct_answer not in options:
+        correct_answer = _OPTION_LABEL_RE.sub("", correct_answer).strip() or correct_answer
+    hinted_index = item.get("correct_index")
+    if isinstance(hinted_index, str) and hinted_index.strip().isdigit():
+        hinted_index = int(hinted_index.strip())
+    # Правильный ответ буквой: "B" - это явная ссылка на вариант
+    if correct_answer.upper() in _LETTERS and correct_answer not in options:
+        hinted_index = _LETTERS[correct_answer.upper()]
+        if hinted_index < len(options):
+            correct_answer = options[hinted_index]
+    correct_index = resolve_correct_index(options, correct_answer, hinted_index)
+    if correct_index < 0:
+        return None, NO_CORRECT_ANSWER
+
+    return {
+        "question_text": question_text,
+        "correct_answer": options[correct_index],
+        "options": options,
+        "correct_index": correct_index,
+        "question_type": "multiple_choice",
+    }, None
@@ -0,0 +1,146 @@
+"""Извлечение текста из PDF: диапазоны страниц обрабатываются параллельно в пуле процессов"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from app.core.config import PDF_EXTRACTION_MODE, PDF_EXTRACTION_WORKERS, PDF_PARALLEL_MIN_PAGES
+
+logger = logging.getLogger(__name__)
+
+# Импорты библиотек для парсинга PDF
+try:
+    import pdfplumber
+    PDFPLUMBER_AVAILABLE = True
+except ImportError:
+    PDFPLUMBER_AVAILABLE = False
+
+try:
+    import PyPDF2
+    PYPDF2_AVAILABLE = True
+except ImportError:
+    PYPDF2_AVAILABLE = False
+
+# Сколько первых страниц проверяем, чтобы понять, есть ли в PDF нормальный текстовый слой
+TEXT_LAYER_SAMPLE_PAGES = 5
+# Среднее количество символов на страницу, начиная с которого текстовый слой считаем пригодным
+TEXT_LAYER_MIN_CHARS_PER_PAGE = 200
+
+# Пул процессов создается при первом большом PDF и переиспользуется
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def _extract_range(file_path: str, start: int, end: int, extractor: str) -> List[Tuple[int, str]]:
+    """
+    Извлекает текст страниц [start, end) (выполняется в отдельном процессе).
+    Возвращает список (номер страницы с 1, текст).
+    """
+    pages = []
+    if extractor == "pypdf2":
+        with open(file_path, "rb") as f:
+            reader = PyPDF2.PdfReader(f)
+            for index in range(start, end):
+                pages.append((index + 1, (reader.pages[index].extract_text() or "").strip()))
+    else:
+        with pdfplumber.open(file_path, pages=list(range(start + 1, end + 1))) as pdf:
+            for offset, page in enumerate(pdf.pages):
+                pages.append((start + offset + 1, (page.extract_text() or "").strip()))
+                # Освобождаем разобранные объекты страницы, чтобы память не росла на больших диапазонах
+                page.flush_cache()
+    return pages
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn: процесс приложения многопоточный, fork в таком процессе небезопасен
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACTION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+
+def _count_pages(file_path: Path) -> int:
+    if PYPDF2_AVAILABLE:
+        with open(file_path, "rb") as f:
+            return len(PyPDF2.PdfReader(f).pages)
+    with pdfplumber.open(str(file_path)) as pdf:
+        return len(pdf.pages)
+
+
+def _choose_extractor(file_path: Path, pages_count: int) -> str:
+    """
+    Выбирает способ извлечения.
+    В режиме auto PDF с хорошим текстовым слоем читается быстрым PyPDF2, остальные - pdfplumber.
+    """
+    if not PDFPLUMBER_AVAILABLE:
+        return "pypdf2"
+    if PDF_EXTRACTION_MODE == "accurate" or not PYPDF2_AVAILABLE:
+        return "pdfplumber"
+    if PDF_EXTRACTION_MODE == "fast":
+        return "pypdf2"
+
+    sample_end = min(pages_count, TEXT_LAYER_SAMPLE_PAGES)
+    if sample_end == 0:
+        return "pdfplumber"
+    try:
+        sample = _extract_range(str(file_path), 0, sample_end, "pypdf2")
+    except Exception as e:
+        logger.debug(f"PyPDF2 не смог прочитать {file_path.name}: {e}")
+        return "pdfplumber"
+    chars = sum(len(text) for _, text in sample)
+    return "pypdf2" if chars / sample_end >= TEXT_LAYER_MIN_CHARS_PER_PAGE else "pdfplumber"
+
+
+def _page_ranges(pages_count: int, workers: int) -> List[Tuple[int, int]]:
+    """Делит страницы на диапазоны: по несколько диапазонов на процесс для равномерной загрузки"""
+    ranges_count = max(1, min(pages_count // PDF_PARALLEL_MIN_PAGES * 2, workers * 4))
+    size = -(-pages_count // ranges_count)
+    return [(start, min(start + size, pages_count)) for start in range(0, pages_count, size)]
+
+
+def _iter_pages(file_path: Path, pages_count: int, extractor: str) -> Iterator[Tuple[int, str]]:
+    if pages_count < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACTION_WORKERS <= 1:
+        yield from _extract_range(str(file_path), 0, pages_count, extractor)
+        return
+
+    ranges = _page_ranges(pages_count, PDF_EXTRACTION_WORKERS)
+    logger.info(f"Параллельное извлечение текста {file_path.name}: {pages_count} стр., {len(ranges)} диапазонов, {extractor}")
+
+    pool = _get_process_pool()
+    futures = [pool.submit(_extract_range, str(file_path), start, end, extractor) for start, end in ranges]
+    try:
+        # Результаты отдаем в порядке диапазонов - текст страниц идет по порядку
+        for (start, end), future in zip(ranges, futures):
+            try:
+                pages = future.result()
+            except Exception as e:
+                logger.warning(f"Ошибка извлечения страниц {start + 1}-{end} из {file_path.name} ({extractor}): {e}")
+                if extractor == "pypdf2" or not PYPDF2_AVAILABLE:
+                    raise
+                pages = _extract_range(str(file_path), start, end, "pypdf2")
+            yield from pages
+    finally:
+        # Если потребитель остановился раньше (лимит объема текста), оставшиеся диапазоны не разбираем
+        for future in futures:
+            future.cancel()
+
+
+def _check_available() -> None:
+    if not PDFPLUMBER_AVAILABLE and not PYPDF2_AVAILABLE:
+        raise Exception("Библиотеки для парсинга PDF не установлены")
+
+
+def iter_pdf_pages(file_path: Path) -> Iterator[Tuple[int, str]]:
+    """
+    Потоково отдает страницы PDF по порядку: (номер страницы с 1, текст).
+    Страницы первого диапазона доступны, не дожидаясь разбора всего документа.
+    """
+    _check_available()
+    pages_count = _count_pages(file_path)
+    yield from _iter_pages(file_path, pages_count, _choose_extractor(file_path, pages_count))
@@ -1,16 +1,32 @@
 """Утилиты для RAG (Retrieval-Augmented Generation) и генерации вопросов"""
 import logging
 import threading
-from typing import List, Optional, Dict, Any
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional
+import numpy as np
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import and_, text
 import json
 
+from app.core.config import QUESTION_FRAGMENTS_PER_QUESTION, QUESTION_REPAIR_ATTEMPTS, SEARCH_CANDIDATES, SEARCH_RRF_K
+from app.models import ChunkEmbedding, MaterialChunk, ProcessedMaterial
+from app.utils.chunking import chunk_text
+from app.utils.embedding_backends import get_active_backend
+from app.utils.llm_cache import get_cached_questions, questions_cache_key, store_questions
+from app.utils.llm_output import ERROR_DESCRIPTIONS, count_event, parse_questions_response, validate_question
+from app.utils.search import build_tsquery
+
 logger = logging.getLogger(__name__)
 
 # Семафор для ограничения одновременных запросов к GigaChat API (максимум 10)
 _gigachat_semaphore = threading.Semaphore(10)
 
+# Версия шаблона промпта генерации вопросов (входит в ключ кэша ответов LLM; увеличивается при изменении промпта)
+QUESTION_PROMPT_VERSION = 2
+
+# Итераций k-means при выборе фрагментов для вопросов (кластеров мало, сходится за несколько итераций)
+KMEANS_ITERATIONS = 20
+
 # Попытка импортировать GigaChat для генерации вопросов
 GIGACHAT_CHAT_AVAILABLE = False
 try:
@@ -24,25 +40,91 @@ except ImportError:
         logger.warning("GigaChat Chat не установлен. Генерация вопросов будет недоступна.")
 
 
+@lru_cache(maxsize=8)
+def hybrid_materials_sql(dimension: int):
+    """
+    Гибридный поиск материалов лекции: материалы ранжируются по ближайшему чанку (векторы активной модели)
+    и по полнотекстовому поиску по чанкам, ранги объединяются (RRF) за один запрос к БД.
+    """
+    vector_type = f"vector({int(dimension)})"
+    return text(f"""
+        WITH nearest_chunks AS (
+            SELECT mc.material_id, ce.embedding::{vector_type} <=> CAST(:embedding AS {vector_type}) AS distance
+            FROM chunk_embeddings ce
+            JOIN material_chunks mc ON mc.id = ce.chunk_id
+            WHERE ce.model = :model
+                AND mc.lecture_id = :lecture_id
+            ORDER BY ce.embedding::{vector_type} <=> CAST(:embedding AS {vector_type})
+            LIMIT :candidates
+        ),
+        vector_hits AS (
+            SELECT material_id, MIN(distance) AS distance, ROW_NUMBER() OVER (ORDER BY MIN(distance)) AS rank
+            FROM nearest_chunks
+            GROUP BY material_id
+        ),
+        lexical_hits AS (
+            SELECT material_id, ROW_NUMBER() OVER (ORDER BY MAX(lexical_rank) DESC) AS rank
+            FROM (
+                SELECT mc.material_id, ts_rank_cd(mc.search_vector, query, 1) AS lexical_rank
+                FROM material_chunks mc, to_tsquery('russian', :tsquery) query
+                WHERE mc.lecture_id = :lecture_id
+                    AND mc.search_vector @@ query
+            ) matched
+            GROUP BY material_id
+            ORDER BY MAX(lexical_rank) DESC
+            LIMIT :candidates
+        ),
+        fused AS (
+            SELECT material_id, SUM(1.0 / (:rrf_k + rank)) AS score
+            FROM (
+                SELECT material_id, rank FROM vector_hits
+                UNION ALL
+                SELECT material_id, rank FROM lexical_hits
+            ) hits
+            GROUP BY material_id
+        )
+        SELECT
+            pm.id,
+            pm.lecture_id,
+            pm.material_id,
+            pm.file_url,
+            pm.file_type,
+            pm.processed_text,
+            f.score,
+            1 - vh.distance AS similarity
+        FROM fused f
+        JOIN processed_materials pm ON pm.material_id = f.material_id
+        LEFT JOIN vector_hits vh ON vh.material_id = f.material_id
+        WHERE pm.processed_text IS NOT NULL
+        ORDER BY f.score DESC
+        LIMIT :limit
+    """)
+
+
 def search_similar_materials(
     db: Session,
     query_embedding: List[float],
     lecture_id: int,
-    limit: int = 5
+    limit: int = 5,
+    query_text: Optional[str] = None
 ) -> List[Dict[str, Any]]:
     """
     Поиск похожих материалов по эмбеддингу запроса (RAG поиск).
+    Если передан текст запроса, результаты векторного поиска объединяются с полнотекстовым
+    (термины, формулы и имена плохо находятся только по эмбеддингам).
     
     Args:
         db: Сессия базы данных
-        query_embedding: Эмбеддинг запроса (список из 1024 чисел)
+        query_embedding: Эмбеддинг запроса активной моделью эмбеддингов
         lecture_id: ID лекции для поиска
         limit: Количество результатов
+        query_text: Текст запроса для полнотекстового поиска
         
     Returns:
         Список словарей с информацией о материалах
     """
-    if not query_embedding or len(query_embedding) != 1024:
+    backend = get_active_backend()
+    if not query_embedding or len(query_embedding) != backend.dimension:
         logger.warning("Некорректный эмбеддинг запроса")
         return []
     
@@ -50,29 +132,15 @@ def search_similar_materials(
         # Преобразуем список в строку для PostgreSQL
         embedding_str = "[" + ",".join(map(str, query_embedding)) + "]"
         
-        # SQL запрос для векторного поиска (косинусное расстояние)
-        query = text("""
-            SELECT 
-                pm.id,
-                pm.lecture_id,
-                pm.material_id,
-                pm.file_url,
-                pm.file_type,
-                pm.processed_text,
-                1 - (pm.embedding <=> :embedding::vector) as similarity
-            FROM processed_materials pm
-            WHERE pm.lecture_id = :lecture_id
-                AND pm.embedding IS NOT NULL
-                AND pm.processed_text IS NOT NULL
-            ORDER BY pm.embedding <=> :embedding::vector
-            LIMIT :limit
-        """)
-        
         result = db.execute(
-            query,
+            hybrid_materials_sql(backend.dimension),
             {
+                "model": backend.model_key,
                 "embedding": embedding_str,
+                "tsquery": build_tsquery(query_text) if query_text else None,
                 "lecture_id": lecture_id,
+                "candidates": max(SEARCH_CANDIDATES, limit),
+                "rrf_k": SEARCH_RRF_K,
                 "limit": limit
             }
         )
@@ -86,7 +154,8 @@ def search_similar_materials(
                 "file_url": row.file_url,
                 "file_type": row.file_type,
                 "processed_text": row.processed_text,
-                "similarity": float(row.similarity) if row.similarity else 0.0
+                "similarity": float(row.similarity) if row.similarity else 0.0,
+                "score": float(row.score)
             })
         
         return materials
@@ -95,31 +164,220 @@ def search_similar_materials(
         return []
 
 
-def generate_questions_from_text(
-    text: str,
-    num_questions: int = 5
+def questions_count(text_length: int) -> int:
+    """Количество вопросов по материалу в зависимости от объема его текста"""
+    if text_length < 500:
+        return 2
+    if text_length < 1500:
+        return 2 if text_length < 1000 else 3
+    return 3
+
+
+def _spread_indices(count: int, k: int, seed: int) -> List[int]:
+    """k равномерно расположенных позиций из count (со сдвигом внутри шага, зависящим от seed)"""
+    if count <= k:
+        return list(range(count))
+    step = count / k
+    shift = np.random.default_rng(seed).random()
+    return sorted({min(count - 1, int((i + shift) * step)) for i in range(k)})
+
+
+def _kmeans_representatives(vectors: np.ndarray, k: int, seed: int) -> List[int]:
+    """
+    Индексы k чанков, представляющих разные темы материала: векторы кластеризуются k-means
+    (косинусная близость, инициализация k-means++), от каждого кластера берется ближайший к центру чанк.
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms > 0, norms, 1)
+    rng = np.random.default_rng(seed)
+    count = len(vectors)
+
+    # k-means++: следующий центр выбирается с вероятностью, пропорциональной удаленности от уже выбранных
+    centers = [int(rng.integers(count))]
+    distance = 1 - vectors @ vectors[centers[0]]
+    for _ in range(1, k):
+        weights = np.maximum(distance, 0)
+        total = weights.sum()
+        center = int(rng.choice(count, p=weights / total)) if total > 0 else int(rng.integers(count))
+        centers.append(center)
+        distance = np.minimum(distance, 1 - vectors @ vectors[center])
+    centroids = vectors[centers]
+
+    for _ in range(KMEANS_ITERATIONS):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        updated = np.array([
+            vectors[labels == j].mean(axis=0) if np.any(labels == j) else centroids[j]
+            for j in range(k)
+        ])
+        norms = np.linalg.norm(updated, axis=1, keepdims=True)
+        updated = updated / np.where(norms > 0, norms, 1)
+        if np.allclose(updated, centroids):
+            break
+        centroids = updated
+
+    # Представитель кластера - ближайший к центру чанк, чанки не повторяются
+    similarity = vectors @ centroids.T
+    chosen: List[int] = []
+    for j in range(k):
+        for index in np.argsort(-similarity[:, j]):
+            if int(index) not in chosen:
+                chosen.append(int(index))
+                break
+    return sorted(chosen)
+
+
+def select_question_fragments(
+    db: Session,
+    material_id: int,
+    processed_text: str,
+    num_fragments: int,
+    seed: int = 0
+) -> List[str]:
+    """
+    Фрагменты материала для генерации вопросов: разнообразные чанки со всего материала.
+    Чанки выбираются кластеризацией их векторов; если векторов активной модели нет - равномерно по тексту.
+    Объем промпта зависит только от количества фрагментов, а не от длины материала.
+    """
+    backend = get_active_backend()
+    rows = db.query(MaterialChunk.text, ChunkEmbedding.embedding).outerjoin(
+        ChunkEmbedding,
+        and_(ChunkEmbedding.chunk_id == MaterialChunk.id, ChunkEmbedding.model == backend.model_key)
+    ).filter(MaterialChunk.material_id == material_id).order_by(MaterialChunk.chunk_index).all()
+
+    # Материалы, обработанные до появления чанков, разбиваются на лету
+    texts = [row.text for row in rows] or [chunk.text for chunk in chunk_text(processed_text)]
+    if len(texts) <= num_fragments:
+        return texts
+
+    with_vectors = [i for i, row in enumerate(rows) if row.embedding is not None]
+    if len(with_vectors) >= num_fragments:
+        vectors = np.array([rows[i].embedding for i in with_vectors], dtype=np.float32)
+        selected = [with_vectors[i] for i in _kmeans_representatives(vectors, num_fragments, seed)]
+    else:
+        selected = _spread_indices(len(texts), num_fragments, seed)
+    return [texts[i] for i in selected]
+
+
+# Формат ответа LLM с вопросами
+QUESTIONS_FORMAT = """Формат ответа (JSON):
+{
+  "questions": [
+    {
+      "question_text": "Текст вопроса",
+      "options": ["Вариант A", "Вариант B", "Вариант C", "Вариант D"],
+      "correct_answer": "Вариант A",
+      "correct_index": 0
+    }
+  ]
+}
+
+Верни ТОЛЬКО валидный JSON, без дополнительного текста."""
+
+
+def _questions_prompt(fragments: List[str], num_questions: int, existing: Optional[List[str]] = None) -> str:
+    fragments_text = "\n\n".join(f"[Фрагмент {i}]\n{fragment}" for i, fragment in enumerate(fragments, start=1))
+    # При дозапросе недостающих вопросов перечисляем уже полученные, чтобы они не повторялись
+    existing_text = ""
+    if existing:
+        existing_text = "\n\nЭти вопросы уже есть, не повторяй их:\n" + "\n".join(f"- {question}" for question in existing)
+    return f"""На основе следующих фрагментов учебного материала создай {num_questions} вопросов с вариантами ответов для проверки знаний студентов.
+
+Фрагменты:
+{fragments_text}{existing_text}
+
+Требования к вопросам:
+1. Вопросы должны проверять понимание ключевых концепций из фрагментов
+2. Вопросы должны охватывать разные фрагменты, а не только первый
+3. Вопросы должны быть разного уровня сложности
+4. Каждый вопрос должен иметь 4 варианта ответа (A, B, C, D)
+5. Только один вариант должен быть правильным
+6. Неправильные варианты должны быть правдоподобными, но неверными
+7. Вопросы должны быть на русском языке
+
+{QUESTIONS_FORMAT}"""
+
+
+def _repair_prompt(invalid: List[tuple]) -> str:
+    items_text = "\n\n".join(
+        f"Вопрос {i}:\n{json.dumps(item, ensure_ascii=False)}\nОшибка: {ERROR_DESCRIPTIONS.get(error, error)}"
+        for i, (item, error) in enumerate(invalid, start=1)
+    )
+    return f"""Следующие вопросы теста с вариантами ответов составлены с ошибками. Исправь каждый вопрос, сохранив его смысл.
+У каждого вопроса должно быть 4 различных варианта ответа, правильный ответ должен дословно совпадать с одним из них.
+
+{items_text}
+
+{QUESTIONS_FORMAT}"""
+
+
+def _collect_questions(response_text: str) -> tuple[List[Dict[str, Any]], List[tuple]]:
+    """Разбирает ответ LLM: валидные вопросы и невалидные вопросы с режимом сбоя (сбои учитываются в счетчиках)"""
+    items, failures = parse_questions_response(response_text)
+    for mode, count in failures.items():
+        count_event(mode, count)
+    valid, invalid = [], []
+    for item in items:
+        question, error = validate_question(item)
+        if error:
+            count_event(error)
+            invalid.append((item, error))
+        else:
+            valid.append(question)
+    return valid, invalid
+
+
+def _invoke_chat(chat, prompt: str) -> str:
+    # Ограничиваем одновременные запросы к GigaChat через семафор
+    with _gigachat_semaphore:
+        response = chat.invoke(prompt)
+    count_event("llm_requests")
+    return response.content if hasattr(response, 'content') else str(response)
+
+
+def generate_questions_from_fragments(
+    fragments: List[str],
+    num_questions: int = 5,
+    seed: int = 0,
+    use_cache: bool = True
 ) -> Optional[List[Dict[str, Any]]]:
     """
-    Генерирует вопросы по тексту используя GigaChat.
+    Генерирует вопросы по фрагментам материала используя GigaChat.
+    Ответ разбирается и проверяется по одному вопросу; о невалидных вопросах модель переспрашивается отдельно,
+    недостающие (оборванный ответ) дозапрашиваются, не повторяя полученные.
+    Полный набор вопросов сохраняется в кэш ответов LLM; use_cache=False - сгенерировать заново (кэш обновится).
     
     Args:
-        text: Текст для генерации вопросов
+        fragments: Фрагменты текста (например, выбранные select_question_fragments)
         num_questions: Количество вопросов
+        seed: Вариант набора вопросов (входит в ключ кэша)
+        use_cache: Брать ли вопросы из кэша
         
     Returns:
         Список словарей с вопросами или None в случае ошибки
     """
-    if not GIGACHAT_CHAT_AVAILABLE:
-        logger.warning("GigaChat Chat недоступен. Установите langchain-gigachat.")
-        return None
+    from app.core.config import GIGA_API_KEY, GIGACHAT_MODEL, GIGACHAT_SCOPE, GIGACHAT_TEMPERATURE
     
-    if not text or not text.strip():
+    fragments = [fragment.strip() for fragment in fragments if fragment and fragment.strip()]
+    if not fragments:
         logger.warning("Текст для генерации вопросов пуст")
         return None
     
+    cache_key = questions_cache_key(
+        GIGACHAT_MODEL, GIGACHAT_TEMPERATURE, QUESTION_PROMPT_VERSION,
+        "\n\n".join(fragments), num_questions, seed
+    )
+    if use_cache:
+        cached = get_cached_questions(cache_key)
+        if cached:
+            count_event("cache_hits")
+            return cached
+        count_event("cache_misses")
+    
+    if not GIGACHAT_CHAT_AVAILABLE:
+        logger.warning("GigaChat Chat недоступен. Установите langchain-gigachat.")
+        return None
+    
     try:
-        from app.core.config import GIGA_API_KEY, GIGACHAT_MODEL, GIGACHAT_SCOPE, GIGACHAT_TEMPERATURE
-        
         if not GIGA_API_KEY:
             logger.error("GIGA_API_KEY не установлен")
             return None
@@ -133,81 +391,87 @@ def generate_questions_from_text(
             temperature=GIGACHAT_TEMPERATURE
         )
         
-        # Ограничиваем длину текста для промпта (GigaChat имеет лимит)
-        text_for_prompt = text[:4000] if len(text) > 4000 else text
-        
-        # Формируем промпт для генерации вопросов
-        prompt = f"""На основе следующего текста создай {num_questions} вопросов с вариантами ответов для проверки знаний студентов.
-
-Текст:
-{text_for_prompt}
-
-Требования к вопросам:
-1. Вопросы должны проверять понимание ключевых концепций из текста
-2. Вопросы должны быть разного уровня сложности
-3. Каждый вопрос должен иметь 4 варианта ответа (A, B, C, D)
-4. Только один вариант должен быть правильным
-5. Неправильные варианты должны быть правдоподобными, но неверными
-6. Вопросы должны быть на русском языке
-
-Формат ответа (JSON):
-{{
-  "questions": [
-    {{
-      "question_text": "Текст вопроса",
-      "options": ["Вариант A", "Вариант B", "Вариант C", "Вариант D"],
-      "correct_answer": "Вариант A",
-      "correct_index": 0
-    }}
-  ]
-}}
-
-Верни ТОЛЬКО валидный JSON, без дополнительного текста."""
-
-        # Генерируем вопросы
-        # Ограничиваем одновременные запросы к GigaChat через семафор
-        with _gigachat_semaphore:
-            response = chat.invoke(prompt)
-        
-        # Парсим ответ
-        response_text = response.content if hasattr(response, 'content') else str(response)
-        
-        # Извлекаем JSON из ответа
-        json_start = response_text.find('{')
-        json_end = response_text.rfind('}') + 1
-        
-        if json_start == -1 or json_end == 0:
-            logger.error("Не удалось найти JSON в ответе GigaChat")
-            return None
-        
-        json_str = response_text[json_start:json_end]
-        data = json.loads(json_str)
-        
-        questions = []
-        for i, q in enumerate(data.get("questions", [])[:num_questions]):
-            options = q.get("options", [])
-            correct_answer = q.get("correct_answer", "")
-            correct_index = q.get("correct_index", 0)
-            
-            # Сохраняем варианты как JSON строку
-            options_json = json.dumps(options, ensure_ascii=False)
-            
-            questions.append({
-                "question_text": q.get("question_text", ""),
-                "correct_answer": correct_answer,
-                "options": options_json,
-                "question_type": "multiple_choice",
-                "order_index": i
-            })
-        
-        logger.info(f"Сгенерировано {len(questions)} вопросов")
-        return questions
-        
-    except json.JSONDecodeError as e:
-        logger.error(f"Ошибка парсинга JSON ответа GigaChat: {e}")
-        logger.debug(f"Ответ GigaChat: {response_text if 'response_text' in locals() else 'N/A'}")
-        return None
+        response_text = _invoke_chat(chat, _questions_prompt(fragments, num_questions))
     except Exception as e:
         logger.error(f"Ошибка генерации вопросов через GigaChat: {e}", exc_info=True)
         return None
+    
+    questions, invalid = _collect_questions(response_text)
+    questions = questions[:num_questions]
+    for _ in range(QUESTION_REPAIR_ATTEMPTS):
+        missing = num_questions - len(questions)
+        if missing <= 0:
+            break
+        try:
+            if invalid:
+                # Переспрашиваем только о невалидных вопросах, без фрагментов материала
+                count_event("repair_requests")
+                repaired, invalid = _collect_questions(_invoke_chat(chat, _repair_prompt(invalid[:missing])))
+                count_event("questions_repaired", len(repaired[:missing]))
+                questions.extend(repaired[:missing])
+            else:
+                count_event("reask_requests")
+                existing = [question["question_text"] for question in questions]
+                extra, invalid = _collect_questions(_invoke_chat(chat, _questions_prompt(fragments, missing, existing)))
+                questions.extend(extra[:missing])
+        except Exception as e:
+            logger.warning(f"Ошибка повторного запроса вопросов к GigaChat: {e}")
+            break
+    
+    if not questions:
+        logger.error("GigaChat не вернул ни одного валидного вопроса")
+        logger.debug(f"Ответ GigaChat: {response_text}")
+        return None
+    
+    for i, question in enumerate(questions):
+        question["order_index"] = i
+    count_event("questions_valid", len(questions))
+    if len(questions) < num_questions:
+        count_event("questions_short", num_questions - len(questions))
+    else:
+        # Неполный набор не кэшируется: при следующей генерации модель получит еще одну попытку
+        store_questions(cache_key, GIGACHAT_MODEL, questions)
+    logger.info(f"Сгенерировано {len(questions)} вопросов")
+    return questions
+
 
+def generate_lecture_questions(
+    db: Session,
+    lecture_id: int,
+    seed: int = 0,
+    use_cache: bool = True,
+    material_ids: Optional[Iterable[int]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Генерирует вопросы по всем обработанным материалам лекции (по каждому материалу отдельно).
+    seed меняет выбор фрагментов: разные seed дают разные наборы вопросов (режим per_student).
+    use_cache=False - сгенерировать вопросы заново, не используя кэш ответов LLM.
+    material_ids - только по этим материалам (обновление теста после изменения материалов).
+    У каждого вопроса указан source_material_id - материал, по которому он составлен.
+    """
+    query = db.query(ProcessedMaterial.material_id, ProcessedMaterial.processed_text).filter(
+        ProcessedMaterial.lecture_id == lecture_id,
+        ProcessedMaterial.processed_text.isnot(None)
+    )
+    if material_ids is not None:
+        query = query.filter(ProcessedMaterial.material_id.in_(list(material_ids)))
+    processed_materials = query.order_by(ProcessedMaterial.id).all()
+    
+    all_questions = []
+    for material_id, processed_text in processed_materials:
+        if not processed_text or not processed_text.strip():
+            continue
+        
+        num_questions = questions_count(len(processed_text.strip()))
+        fragments = select_question_fragments(
+            db, material_id, processed_text, num_questions * QUESTION_FRAGMENTS_PER_QUESTION, seed
+        )
+        questions_data = generate_questions_from_fragments(fragments, num_questions, seed, use_cache)
+        if questions_data:
+            for q_data in questions_data:
+                q_data["source_material_id"] = material_id
+            all_questions.extend(questions_data)
+    
+    for order_index, q_data in enumerate(all_questions):
+        q_data["order_index"] = order_index
+    return all_questions
@@ -0,0 +1,428 @@
+"""
+Перевекторизация материалов при смене модели эмбеддингов.
+Векторы новой модели записываются в chunk_embeddings рядом с векторами активной модели, поэтому поиск
+работает на прежней модели всё время пересчета. Когда все чанки пересчитаны, строится индекс новой модели
+и она становится активной одной транзакцией.
+То же задание создает чанки материалов, обработанных до появления чанков (иначе они не находятся поиском).
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, exists, func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import (
+    REEMBED_AUTO_START,
+    REEMBED_MAX_RETRIES,
+    REEMBED_PAGE_SIZE,
+    REEMBED_REQUESTS_PER_MINUTE,
+)
+from app.core.database import SessionLocal, engine
+from app.models import ChunkEmbedding, EmbeddingModel, MaterialChunk, ProcessedMaterial
+from app.utils.chunking import chunk_text
+from app.utils.embedding_backends import (
+    HNSW_MAX_DIMENSION,
+    EmbeddingBackend,
+    get_active_backend,
+    get_embedding_backend,
+    reset_active_backend,
+    vector_index_name,
+    vector_index_sql,
+)
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory lock PostgreSQL: задание выполняет только один процесс приложения
+REEMBED_LOCK_KEY = 7_340_043
+
+_job_thread: Optional[threading.Thread] = None
+_job_lock = threading.Lock()
+
+
+class ReembeddingError(Exception):
+    """Модель эмбеддингов не вернула векторы после всех повторов"""
+
+
+class _Throttle:
+    """Ограничение частоты запросов к модели: не больше rate_per_minute вызовов в минуту"""
+
+    def __init__(self, rate_per_minute: int):
+        self.interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0.0
+        self.next_at = 0.0
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_at > now:
+            time.sleep(self.next_at - now)
+        self.next_at = max(now, self.next_at) + self.interval
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def serialize_embedding_model(state: EmbeddingModel) -> Dict[str, Any]:
+    """Состояние модели и прогресс её перевекторизации для API"""
+    progress = None
+    if state.status == "building" and state.materials_total:
+        progress = round(min(state.materials_done / state.materials_total, 1.0), 4)
+    return {
+        "model": state.model,
+        "backend": state.backend,
+        "model_name": state.model_name,
+        "dimension": state.dimension,
+        "status": state.status,
+        "materials_done": state.materials_done,
+        "materials_total": state.materials_total,
+        "chunks_done": state.chunks_done,
+        "progress": progress,
+        "error": state.error,
+        "started_at": state.started_at,
+        "updated_at": state.updated_at,
+        "activated_at": state.activated_at,
+    }
+
+
+def get_target_backends(db: Session) -> List[EmbeddingBackend]:
+    """Модели, которые сейчас пересчитываются: новые материалы векторизуются и ими, чтобы не пересчитывать их повторно"""
+    return [
+        get_embedding_backend(state.backend, state.model_name, state.dimension)
+        for state in db.query(EmbeddingModel).filter(EmbeddingModel.status == "building").all()
+    ]
+
+
+def _missing_chunks(db: Session, model_key: str, *filters):
+    """Запрос чанков, у которых еще нет вектора модели"""
+    has_embedding = exists().where(and_(
+        ChunkEmbedding.chunk_id == MaterialChunk.id,
+        ChunkEmbedding.model == model_key,
+    ))
+    return db.query(MaterialChunk.id, MaterialChunk.text).filter(*filters, ~has_embedding).order_by(MaterialChunk.id)
+
+
+def _embed_and_store(db: Session, backend: EmbeddingBackend, chunks: list, throttle: _Throttle) -> int:
+    """Векторизует чанки батчами с ограничением частоты и записывает векторы (без commit); возвращает число векторов"""
+    stored = 0
+    for start in range(0, len(chunks), backend.batch_size):
+        batch = chunks[start:start + backend.batch_size]
+        for attempt in range(REEMBED_MAX_RETRIES):
+            throttle.wait()
+            embeddings = backend.embed_documents([chunk.text for chunk in batch])
+            if any(embeddings):
+                break
+            # Модель недоступна или ограничивает запросы - ждем с экспоненциальной задержкой
+            delay = min(60, 2 ** attempt)
+            logger.warning(f"Перевекторизация {backend.model_key}: модель не вернула векторы, повтор через {delay}с")
+            time.sleep(delay)
+        else:
+            raise ReembeddingError(f"Модель {backend.model_key} не вернула векторы после {REEMBED_MAX_RETRIES} попыток")
+
+        rows = [
+            {"chunk_id": chunk.id, "model": backend.model_key, "dimension": backend.dimension, "embedding": embedding}
+            for chunk, embedding in zip(batch, embeddings)
+            if embedding
+        ]
+        if len(rows) < len(batch):
+            logger.warning(f"Перевекторизация {backend.model_key}: не получены векторы для {len(batch) - len(rows)} чанков")
+        if rows:
+            db.execute(insert(ChunkEmbedding).values(rows).on_conflict_do_nothing(index_elements=["chunk_id", "model"]))
+        stored += len(rows)
+    return stored
+
+
+def backfill_material_chunks() -> None:
+    """
+    Создает чанки с векторами активной модели для обработанных материалов без чанков.
+    Каждый материал сохраняется своей транзакцией; материал, который не удалось векторизовать,
+    пропускается и будет обработан при следующем запуске задания.
+    """
+    db = SessionLocal()
+    try:
+        has_chunks = exists().where(MaterialChunk.material_id == ProcessedMaterial.material_id)
+        backend = None
+        throttle = _Throttle(REEMBED_REQUESTS_PER_MINUTE)
+        last_id = 0
+        done = 0
+        while True:
+            page = db.query(ProcessedMaterial).filter(
+                ProcessedMaterial.id > last_id,
+                ProcessedMaterial.processed_text.isnot(None),
+                ~has_chunks
+            ).order_by(ProcessedMaterial.id).limit(REEMBED_PAGE_SIZE).all()
+            if not page:
+                break
+            backend = backend or get_active_backend()
+            for processed in page:
+                last_id = processed.id
+                chunks = [
+                    MaterialChunk(
+                        lecture_id=processed.lecture_id,
+                        material_id=processed.material_id,
+                        chunk_index=chunk.chunk_index,
+                        text=chunk.text,
+                        token_count=chunk.token_count,
+                        block_kind=chunk.block_kind,
+                        first_block=chunk.first_block,
+                        last_block=chunk.last_block,
+                        start_offset=chunk.start_offset,
+                        end_offset=chunk.end_offset,
+                    )
+                    for chunk in chunk_text(processed.processed_text)
+                ]
+                if not chunks:
+                    continue
+                try:
+                    db.add_all(chunks)
+                    db.flush()
+                    _embed_and_store(db, backend, chunks, throttle)
+                    db.commit()
+                    done += 1
+                except (ReembeddingError, IntegrityError) as e:
+                    # Модель недоступна или материал удалили/переобработали во время заполнения
+                    db.rollback()
+                    logger.warning(f"Не удалось создать чанки обработанного материала {last_id}: {e}")
+        if done:
+            logger.info(f"Созданы чанки для {done} материалов, обработанных до появления чанков")
+    except Exception as e:
+        logger.error(f"Ошибка заполнения чанков материалов: {e}", exc_info=True)
+        db.rollback()
+    finally:
+        db.close()
+
+
+def _build_index(backend: EmbeddingBackend) -> None:
+    """Строит индекс HNSW новой модели без блокировки записи (недостроенный после сбоя индекс пересоздается)"""
+    if backend.dimension > HNSW_MAX_DIMENSION:
+        logger.warning(f"Размерность {backend.model_key} больше {HNSW_MAX_DIMENSION}, индекс HNSW не строится")
+        return
+    index_name = vector_index_name(backend.model_key)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        valid = conn.execute(text("""
+            SELECT i.indisvalid
+            FROM pg_class c
+            JOIN pg_index i ON i.indexrelid = c.oid
+            WHERE c.relname = :name
+        """), {"name": index_name}).scalar()
+        if valid is False:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+        conn.execute(text(vector_index_sql(backend.model_key, backend.dimension, concurrently=True)))
+
+
+def _activate(db: Session, model_key: str) -> bool:
+    """Делает модель активной вместо текущей одной транзакцией"""
+    now = _now()
+    db.query(EmbeddingModel).filter(EmbeddingModel.status == "active").update(
+        {"status": "retired", "updated_at": now}, synchronize_session=False
+    )
+    # Уникальный индекс по активной модели проверяется построчно, поэтому прежняя модель снимается первой
+    activated = db.query(EmbeddingModel).filter(
+        EmbeddingModel.model == model_key,
+        EmbeddingModel.status == "building"
+    ).update({"status": "active", "activated_at": now, "updated_at": now, "error": None}, synchronize_session=False)
+    if not activated:
+        db.rollback()
+        return False
+    db.commit()
+    reset_active_backend()
+    return True
+
+
+def run_reembedding(model_key: str) -> None:
+    """
+    Пересчитывает векторы всех чанков моделью model_key.
+    Материалы читаются страницами по id; векторы материала и контрольная точка сохраняются одной транзакцией,
+    поэтому после перезапуска задание продолжается с того же места.
+    """
+    db = SessionLocal()
+    state = None
+    try:
+        state = db.query(EmbeddingModel).filter(EmbeddingModel.model == model_key).first()
+        if state is None or state.status != "building":
+            return
+        backend = get_embedding_backend(state.backend, state.model_name, state.dimension)
+        throttle = _Throttle(REEMBED_REQUESTS_PER_MINUTE)
+
+        state.materials_total = state.materials_done + db.query(func.count(ProcessedMaterial.id)).filter(
+            ProcessedMaterial.id > state.last_material_id
+        ).scalar()
+        state.started_at = state.started_at or _now()
+        state.updated_at = _now()
+        db.commit()
+        logger.info(f"Перевекторизация {model_key}: материалов {state.materials_total}, продолжение с id > {state.last_material_id}")
+
+        while True:
+            page = db.query(ProcessedMaterial.id, ProcessedMaterial.material_id).filter(
+                ProcessedMaterial.id > state.last_material_id
+            ).order_by(ProcessedMaterial.id).limit(REEMBED_PAGE_SIZE).all()
+            if not page:
+                break
+            for processed_id, material_id in page:
+                # Задание могли остановить (перевекторизация другой моделью)
+                db.refresh(state)
+                if state.status != "building":
+                    logger.info(f"Перевекторизация {model_key} остановлена")
+                    return
+                chunks = _missing_chunks(db, model_key, MaterialChunk.material_id == material_id).all()
+                try:
+                    state.chunks_done += _embed_and_store(db, backend, chunks, throttle)
+                    state.last_material_id = processed_id
+                    state.materials_done += 1
+                    state.updated_at = _now()
+                    db.commit()
+                except IntegrityError:
+                    # Материал удалили во время пересчета
+                    db.rollback()
+                    state.last_material_id = processed_id
+                    state.materials_done += 1
+                    db.commit()
+
+        # Чанки, появившиеся позади контрольной точки (материалы переобработаны во время пересчета)
+        last_chunk_id = 0
+        while True:
+            chunks = _missing_chunks(db, model_key, MaterialChunk.id > last_chunk_id).limit(backend.batch_size).all()
+            if not chunks:
+                break
+            try:
+                state.chunks_done += _embed_and_store(db, backend, chunks, throttle)
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+            last_chunk_id = chunks[-1].id
+
+        _build_index(backend)
+        if _activate(db, model_key):
+            logger.info(f"Перевекторизация завершена, активная модель эмбеддингов: {model_key}")
+    except Exception as e:
+        logger.error(f"Ошибка перевекторизации {model_key}: {e}", exc_info=True)
+        db.rollback()
+        if state is not None:
+            state.status = "failed"
+            state.error = str(e)[:2000]
+            state.updated_at = _now()
+            db.commit()
+    finally:
+        db.close()
+
+
+def _building_model() -> Optional[str]:
+    """Модель, ожидающая пересчета (её могли запросить, пока пересчитывалась другая)"""
+    db = SessionLocal()
+    try:
+        state = db.query(EmbeddingModel).filter(EmbeddingModel.status == "building").first()
+        return state.model if state is not None else None
+    finally:
+        db.close()
+
+
+def _run_job() -> None:
+    """Пересчитывает модели в статусе building, пока такие есть: модель, запрошенная во время пересчета, не теряется"""
+    global _job_thread
+    while True:
+        # Сессионная advisory-блокировка держится на отдельном соединении всё время задания
+        with engine.connect() as conn:
+            if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": REEMBED_LOCK_KEY}).scalar():
+                logger.info("Перевекторизация уже выполняется другим процессом")
+                return
+            try:
+                # Новые чанки сразу попадают и в пересчет модели (он векторизует все чанки без её векторов)
+                backfill_material_chunks()
+                model_key = _building_model()
+                if model_key is not None:
+                    run_reembedding(model_key)
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": REEMBED_LOCK_KEY})
+
+        # Поток завершается под _job_lock: модель, запрошенная после этой проверки, запустит новый поток
+        with _job_lock:
+            if _building_model() is None:
+                _job_thread = None
+                return
+
+
+def _start_thread() -> None:
+    global _job_thread
+    with _job_lock:
+        if _job_thread is not None and _job_thread.is_alive():
+            return
+        _job_thread = threading.Thread(target=_run_job, name="reembedding", daemon=True)
+        _job_thread.start()
+
+
+def start_reembedding(db: Session, backend: Optional[EmbeddingBackend] = None) -> Optional[EmbeddingModel]:
+    """
+    Запускает (или продолжает после ошибки) перевекторизацию моделью backend, по умолчанию - моделью из настроек.
+    Возвращает состояние модели; None - если модель уже активна.
+    """
+    backend = backend or get_embedding_backend()
+    state = db.query(EmbeddingModel).filter(EmbeddingModel.model == backend.model_key).first()
+    if state is not None and state.status == "active":
+        return None
+
+    # Одновременно пересчитывается одна модель
+    db.query(EmbeddingModel).filter(
+        EmbeddingModel.status == "building",
+        EmbeddingModel.model != backend.model_key
+    ).update({"status": "retired", "updated_at": _now()}, synchronize_session=False)
+
+    if state is None:
+        state = EmbeddingModel(
+            model=backend.model_key,
+            backend=backend.kind,
+            model_name=backend.model_name,
+            dimension=backend.dimension,
+            last_material_id=0,
+            materials_done=0,
+            chunks_done=0,
+        )
+        db.add(state)
+    elif state.status == "retired":
+        # Сохранившиеся векторы модели не пересчитываются, но материалы проверяются заново
+        state.last_material_id = 0
+        state.materials_done = 0
+        state.started_at = None
+    state.status = "building"
+    state.error = None
+    state.updated_at = _now()
+    db.commit()
+
+    _start_thread()
+    return state
+
+
+def resume_reembedding() -> None:
+    """
+    При старте приложения: продолжает прерванную перевекторизацию
+    или запускает новую, если модель в настройках отличается от активной.
+    Иначе задание только создает чанки материалов, обработанных до их появления.
+    """
+    db = SessionLocal()
+    try:
+        building = db.query(EmbeddingModel).filter(EmbeddingModel.status == "building").first()
+        if building is not None:
+            _start_thread()
+            return
+        active = db.query(EmbeddingModel).filter(EmbeddingModel.status == "active").first()
+        configured = get_embedding_backend()
+        if active is None or active.model == configured.model_key:
+            _start_thread()
+            return
+        if REEMBED_AUTO_START:
+            logger.info(f"Модель эмбеддингов изменена ({active.model} -> {configured.model_key}), запускается перевекторизация")
+            start_reembedding(db, configured)
+        else:
+            logger.warning(
+                f"Модель эмбеддингов в настройках ({configured.model_key}) отличается от активной ({active.model}); "
+                f"поиск использует {active.model}, перевекторизация запускается вручную"
+            )
+            _start_thread()
+    except Exception as e:
+        logger.error(f"Не удалось возобновить перевекторизацию: {e}", exc_info=True)
+    finally:
+        db.close()
@@ -0,0 +1,183 @@
+"""
+Общий планировщик тяжелых задач обработки (транскрибация, разбор документов с эмбеддингами, генерация вопросов LLM).
+У каждого ресурса свой пул потоков фиксированного размера на процесс, поэтому одновременные публикации
+не умножают количество потоков.
+Очередь пула - взвешенная справедливая (start-time fair queuing): задачи одного владельца (преподавателя)
+выстраиваются друг за другом по стоимости, и владелец с большой очередью не задерживает задачи других.
+Короткие задачи дополнительно обслуживает выделенный поток, поэтому небольшая публикация не ждет
+окончания длинной транскрибации.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import (
+    SCHEDULER_DOCUMENT_WORKERS,
+    SCHEDULER_LLM_WORKERS,
+    SCHEDULER_SHORT_JOB_MB,
+    SCHEDULER_SHORT_LLM_JOB_MATERIALS,
+    SCHEDULER_TRANSCRIPTION_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Ресурсы
+TRANSCRIPTION = "transcription"  # Whisper (CPU/GPU); стоимость - размер файла в МБ
+DOCUMENTS = "documents"          # Разбор документов и эмбеддинги; стоимость - размер файла в МБ
+LLM = "llm"                      # Генерация вопросов; стоимость - количество материалов
+
+# Минимальная стоимость задачи: задачи нулевого размера тоже продвигают очередь владельца
+MIN_COST = 0.1
+
+# Сколько завершенных владельцев хранить, прежде чем очищать их метки
+OWNER_TAGS_LIMIT = 1000
+
+
+class _Job:
+    __slots__ = ("owner", "cost", "start", "finish", "fn", "args", "kwargs", "future", "submitted_at")
+
+    def __init__(self, owner: str, cost: float, start: float, finish: float, fn: Callable, args: tuple, kwargs: dict):
+        self.owner = owner
+        self.cost = cost
+        self.start = start
+        self.finish = finish
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.submitted_at = time.monotonic()
+
+
+class ResourcePool:
+    """Пул потоков одного ресурса со справедливой очередью и выделенным потоком для коротких задач"""
+
+    def __init__(self, name: str, workers: int, short_cost: float):
+        self.name = name
+        self.workers = max(1, workers)
+        self.short_cost = short_cost
+        self._short: List[Tuple[float, int, _Job]] = []
+        self._long: List[Tuple[float, int, _Job]] = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._owner_finish: Dict[str, float] = {}
+        self._running: Dict[str, int] = {}
+        self._threads: List[threading.Thread] = []
+        self._completed = 0
+        self._wait_seconds = 0.0
+
+    def _ensure_workers(self) -> None:
+        if self._threads:
+            return
+        for index in range(self.workers):
+            self._start_worker(f"{self.name}-{index}", express=False)
+        self._start_worker(f"{self.name}-short", express=True)
+
+    def _start_worker(self, thread_name: str, express: bool) -> None:
+        thread = threading.Thread(target=self._work, args=(express,), name=f"scheduler-{thread_name}", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def submit(self, owner: str, cost: float, fn: Callable, *args: Any, weight: float = 1.0, **kwargs: Any) -> Future:
+        """
+        Ставит задачу в очередь. Метка окончания = max(виртуальное время, окончание предыдущей задачи владельца)
+        + стоимость / вес; потоки берут задачу с наименьшей меткой.
+        """
+        cost = max(float(cost or 0), MIN_COST)
+        with self._cond:
+            self._ensure_workers()
+            start = max(self._virtual_time, self._owner_finish.get(owner, 0.0))
+            finish = start + cost / max(weight, 1e-6)
+            self._owner_finish[owner] = finish
+            if len(self._owner_finish) > OWNER_TAGS_LIMIT:
+                # Метки владельцев без задач в очереди больше не влияют на порядок
+                self._owner_finish = {
+                    key: tag for key, tag in self._owner_finish.items() if tag > self._virtual_time
+                }
+            job = _Job(owner, cost, start, finish, fn, args, kwargs)
+            heapq.heappush(self._short if cost <= self.short_cost else self._long, (finish, next(self._seq), job))
+            self._cond.notify_all()
+        return job.future
+
+    def _next_job(self, express: bool) -> Optional[_Job]:
+        """Задача с наименьшей меткой окончания (выделенный поток берет только короткие задачи)"""
+        queues = [queue for queue in ((self._short,) if express else (self._short, self._long)) if queue]
+        if not queues:
+            return None
+        queue = min(queues, key=lambda candidates: candidates[0][0])
+        return heapq.heappop(queue)[2]
+
+    def _work(self, express: bool) -> None:
+        while True:
+            with self._cond:
+                job = self._next_job(express)
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job(express)
+                self._virtual_time = max(self._virtual_time, job.start)
+                self._running[job.owner] = self._running.get(job.owner, 0) + 1
+                self._wait_seconds += time.monotonic() - job.submitted_at
+
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result(job.fn(*job.args, **job.kwargs))
+                except BaseException as e:
+                    job.future.set_exception(e)
+
+            with self._cond:
+                self._running[job.owner] -= 1
+                if not self._running[job.owner]:
+                    del self._running[job.owner]
+                self._completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            queued: Dict[str, int] = {}
+            for _, _, job in itertools.chain(self._short, self._long):
+                queued[job.owner] = queued.get(job.owner, 0) + 1
+            return {
+                "workers": self.workers,
+                "short_cost": self.short_cost,
+                "queued": len(self._short) + len(self._long),
+                "queued_short": len(self._short),
+                "queued_by_owner": queued,
+                "running_by_owner": dict(self._running),
+                "completed": self._completed,
+                "avg_wait_seconds": round(self._wait_seconds / self._completed, 3) if self._completed else None,
+            }
+
+
+_POOL_SETTINGS = {
+    TRANSCRIPTION: (SCHEDULER_TRANSCRIPTION_WORKERS, SCHEDULER_SHORT_JOB_MB),
+    DOCUMENTS: (SCHEDULER_DOCUMENT_WORKERS, SCHEDULER_SHORT_JOB_MB),
+    LLM: (SCHEDULER_LLM_WORKERS, SCHEDULER_SHORT_LLM_JOB_MATERIALS),
+}
+
+_pools: Dict[str, ResourcePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(resource: str) -> ResourcePool:
+    """Пул ресурса (создается при первом обращении)"""
+    with _pools_lock:
+        pool = _pools.get(resource)
+        if pool is None:
+            workers, short_cost = _POOL_SETTINGS[resource]
+            pool = _pools[resource] = ResourcePool(resource, workers, short_cost)
+        return pool
+
+
+def submit_job(resource: str, owner: str, cost: float, fn: Callable, *args: Any, **kwargs: Any) -> Future:
+    """Ставит задачу в очередь пула ресурса от имени владельца (например, teacher:12)"""
+    return get_pool(resource).submit(owner, cost, fn, *args, **kwargs)
+
+
+def get_scheduler_stats() -> Dict[str, Any]:
+    """Очереди и потоки пулов в этом процессе"""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {resource: pool.stats() for resource, pool in pools.items()}
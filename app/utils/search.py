@@ -0,0 +1,265 @@
+"""Поиск по чанкам материалов курса: векторный и полнотекстовый поиск, объединение результатов и подсветка"""
+import logging
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import (
+    SEARCH_CANDIDATES,
+    SEARCH_HNSW_EF_SEARCH,
+    SEARCH_QUERY_CACHE_SIZE,
+    SEARCH_RRF_K,
+    SEARCH_SNIPPET_CHARS,
+)
+from app.utils.embedding_backends import EmbeddingBackend, get_active_backend
+
+logger = logging.getLogger(__name__)
+
+# Кэш эмбеддингов запросов: при наборе запроса одни и те же префиксы и запросы повторяются
+_query_cache: "OrderedDict[tuple[str, str], List[float]]" = OrderedDict()
+_query_lock = threading.Lock()
+
+_WORD_RE = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=8)
+def hybrid_search_sql(dimension: int):
+    """
+    Гибридный поиск чанков по лекциям, доступным пользователю: кандидаты векторного и полнотекстового
+    поиска объединяются через reciprocal rank fusion за один запрос к БД.
+    Размерность подставляется в текст запроса, чтобы использовался частичный индекс модели.
+    """
+    vector_type = f"vector({int(dimension)})"
+    return text(f"""
+        WITH vector_hits AS (
+            SELECT id, ROW_NUMBER() OVER () AS rank
+            FROM (
+                SELECT ce.chunk_id AS id
+                FROM chunk_embeddings ce
+                JOIN material_chunks mc ON mc.id = ce.chunk_id
+                WHERE ce.model = :model
+                    AND mc.lecture_id = ANY(:lecture_ids)
+                    AND CAST(:embedding AS {vector_type}) IS NOT NULL
+                ORDER BY ce.embedding::{vector_type} <=> CAST(:embedding AS {vector_type})
+                LIMIT :candidates
+            ) nearest
+        ),
+        lexical_hits AS (
+            SELECT mc.id, ROW_NUMBER() OVER (ORDER BY ts_rank_cd(mc.search_vector, query, 1) DESC) AS rank
+            FROM material_chunks mc, to_tsquery('russian', :tsquery) query
+            WHERE mc.lecture_id = ANY(:lecture_ids)
+                AND mc.search_vector @@ query
+            ORDER BY ts_rank_cd(mc.search_vector, query, 1) DESC
+            LIMIT :candidates
+        ),
+        fused AS (
+            SELECT
+                id,
+                SUM(1.0 / (:rrf_k + rank)) AS score,
+                MIN(rank) FILTER (WHERE source = 'vector') AS vector_rank,
+                MIN(rank) FILTER (WHERE source = 'lexical') AS lexical_rank
+            FROM (
+                SELECT id, rank, 'vector' AS source FROM vector_hits
+                UNION ALL
+                SELECT id, rank, 'lexical' AS source FROM lexical_hits
+            ) hits
+            GROUP BY id
+        )
+        SELECT
+            mc.id,
+            mc.lecture_id,
+            mc.material_id,
+            lm.file_name,
+            lm.file_type,
+            mc.text,
+            mc.block_kind,
+            mc.first_block,
+            mc.last_block,
+            mc.start_time,
+            mc.end_time,
+            f.score,
+            f.vector_rank,
+            f.lexical_rank,
+            1 - (ce.embedding::{vector_type} <=> CAST(:embedding AS {vector_type})) AS similarity
+        FROM fused f
+        JOIN material_chunks mc ON mc.id = f.id
+        JOIN lecture_materials lm ON lm.id = mc.material_id
+        LEFT JOIN chunk_embeddings ce ON ce.chunk_id = mc.id AND ce.model = :model
+        ORDER BY f.score DESC
+        LIMIT :limit
+    """)
+
+
+def build_tsquery(query: str) -> Optional[str]:
+    """
+    Запрос для to_tsquery: слова через OR (ранжирование учитывает, сколько слов совпало),
+    последнее слово - как префикс, т.к. при наборе оно может быть еще не дописано.
+    """
+    words = _WORD_RE.findall(query.lower())
+    if not words:
+        return None
+    words[-1] += ":*"
+    return " | ".join(words)
+
+
+def normalize_query(query: str) -> str:
+    """Запрос без различий в регистре и пробелах (ключ кэша)"""
+    return " ".join(query.lower().split())
+
+
+def get_query_embedding(query: str, backend: Optional[EmbeddingBackend] = None) -> Optional[List[float]]:
+    """Эмбеддинг поискового запроса активной моделью (с кэшем в памяти процесса)"""
+    backend = backend or get_active_backend()
+    cache_key = (backend.model_key, normalize_query(query))
+    with _query_lock:
+        embedding = _query_cache.get(cache_key)
+        if embedding is not None:
+            _query_cache.move_to_end(cache_key)
+            return embedding
+
+    embedding = backend.embed_query(cache_key[1])
+    if not embedding:
+        return None
+
+    with _query_lock:
+        _query_cache[cache_key] = embedding
+        _query_cache.move_to_end(cache_key)
+        while len(_query_cache) > SEARCH_QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+    return embedding
+
+
+def query_terms(query: str) -> List[str]:
+    """Основы слов запроса для подсветки (окончания отбрасываются, чтобы находить другие формы слова)"""
+    terms = []
+    for word in _WORD_RE.findall(query.lower()):
+        if len(word) < 3:
+            continue
+        stem = word[:max(4, len(word) - 2)]
+        if stem not in terms:
+            terms.append(stem)
+    return terms
+
+
+def make_snippet(chunk_text: str, terms: List[str], width: int = SEARCH_SNIPPET_CHARS) -> Dict[str, Any]:
+    """
+    Фрагмент чанка с наибольшим количеством слов запроса.
+    highlights - пары [начало, конец) найденных слов в тексте фрагмента.
+    """
+    matches = [
+        (match.start(), match.end())
+        for match in _WORD_RE.finditer(chunk_text)
+        if any(match.group().lower().startswith(term) for term in terms)
+    ]
+
+    # Окно шириной width с наибольшим количеством совпадений (два указателя по совпадениям)
+    start = 0
+    if matches and len(chunk_text) > width:
+        best_count, left = 0, 0
+        for right in range(len(matches)):
+            while matches[right][1] - matches[left][0] > width:
+                left += 1
+            if right - left + 1 > best_count:
+                best_count = right - left + 1
+                start = matches[left][0]
+        # Немного контекста перед первым совпадением
+        start = max(0, min(start - width // 5, len(chunk_text) - width))
+        space = chunk_text.rfind(" ", 0, start)
+        if start > 0 and space != -1 and start - space < 20:
+            start = space + 1
+    end = min(len(chunk_text), start + width)
+    if end < len(chunk_text):
+        space = chunk_text.rfind(" ", start, end)
+        if space > start:
+            end = space
+
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(chunk_text) else ""
+    shift = len(prefix) - start
+    highlights = [
+        [match_start + shift, match_end + shift]
+        for match_start, match_end in matches
+        if match_start >= start and match_end <= end
+    ]
+    return {"snippet": prefix + chunk_text[start:end] + suffix, "highlights": highlights}
+
+
+def _tune_vector_scan(db: Session) -> None:
+    """
+    Параметры HNSW на время транзакции: ширина списка кандидатов и итеративное сканирование,
+    чтобы фильтр по лекциям не уменьшал количество результатов (pgvector 0.8+; на старых версиях пропускается).
+    """
+    settings = (("hnsw.ef_search", str(SEARCH_HNSW_EF_SEARCH)), ("hnsw.iterative_scan", "relaxed_order"))
+    for name, value in settings:
+        try:
+            with db.begin_nested():
+                db.execute(text("SELECT set_config(:name, :value, true)"), {"name": name, "value": value})
+        except Exception as e:
+            logger.debug(f"Параметр {name} не поддерживается: {e}")
+
+
+def search_chunks(
+    db: Session,
+    query: str,
+    lecture_names: Dict[int, str],
+    limit: int = 10,
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Ищет чанки материалов перечисленных лекций: близкие к запросу по смыслу и содержащие его слова.
+    Если эмбеддинг запроса получить не удалось, поиск выполняется только по словам.
+    Возвращает None, если запрос не удалось обработать ни одним способом.
+    """
+    if not lecture_names:
+        return []
+    # Модель фиксируется на весь запрос: во время переключения моделей вектор запроса и векторы чанков не смешиваются
+    backend = get_active_backend()
+    embedding = get_query_embedding(query, backend)
+    tsquery = build_tsquery(query)
+    if embedding is None and tsquery is None:
+        return None
+
+    if embedding is not None:
+        _tune_vector_scan(db)
+    rows = db.execute(
+        hybrid_search_sql(backend.dimension),
+        {
+            "model": backend.model_key,
+            "embedding": "[" + ",".join(map(str, embedding)) + "]" if embedding is not None else None,
+            "tsquery": tsquery,
+            "lecture_ids": list(lecture_names),
+            "candidates": max(SEARCH_CANDIDATES, limit),
+            "rrf_k": SEARCH_RRF_K,
+            "limit": limit,
+        }
+    ).fetchall()
+
+    terms = query_terms(query)
+    results = []
+    for row in rows:
+        result = {
+            "chunk_id": row.id,
+            "lecture_id": row.lecture_id,
+            "lecture_name": lecture_names.get(row.lecture_id),
+            "material_id": row.material_id,
+            "file_name": row.file_name,
+            "file_type": row.file_type,
+            "location": {
+                "kind": row.block_kind,
+                "from": row.first_block,
+                "to": row.last_block,
+                "start_time": row.start_time,
+                "end_time": row.end_time,
+            },
+            "score": round(float(row.score), 6),
+            "similarity": round(float(row.similarity), 4) if row.similarity is not None else None,
+            "vector_rank": row.vector_rank,
+            "lexical_rank": row.lexical_rank,
+        }
+        result.update(make_snippet(row.text, terms))
+        results.append(result)
+    return results
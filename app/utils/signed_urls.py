@@ -0,0 +1,69 @@
+"""Подписанные ссылки с ограниченным сроком действия на файлы из директории uploads"""
+import hashlib
+import hmac
+import time
+from pathlib import Path, PurePosixPath
+from typing import Optional
+
+from app.core.config import MEDIA_URL_SECRET, MEDIA_URL_TTL_SECONDS, SECRET_KEY
+
+# Корень файлов, доступных по подписанным ссылкам
+MEDIA_ROOT = Path("uploads")
+
+# Ключ подписи: отдельный секрет или производный от SECRET_KEY (чтобы не подписывать ссылки ключом JWT напрямую)
+_signing_key = (MEDIA_URL_SECRET or hmac.new(SECRET_KEY.encode(), b"media-urls", hashlib.sha256).hexdigest()).encode()
+
+
+def _signature(expires: int, scope: str) -> str:
+    message = f"{expires}:{scope}".encode()
+    return hmac.new(_signing_key, message, hashlib.sha256).hexdigest()[:32]
+
+
+def _split(path: str) -> list[str]:
+    return [part for part in PurePosixPath(path).parts if part not in ("/", "")]
+
+
+def sign_media_path(path: str, scope_parts: Optional[int] = None, ttl: int = MEDIA_URL_TTL_SECONDS) -> str:
+    """
+    Подписанная ссылка (относительно корня API) на файл из uploads.
+    scope_parts - сколько первых компонентов пути покрывает подпись: по умолчанию весь путь,
+    для HLS - директория с плейлистами, чтобы по той же подписи открывались сегменты.
+    """
+    parts = _split(path)
+    if parts and parts[0] == MEDIA_ROOT.name:
+        parts = parts[1:]
+    if scope_parts is None:
+        scope_parts = len(parts)
+    expires = int(time.time()) + ttl
+    scope = "/".join(parts[:scope_parts])
+    token = f"{expires}-{scope_parts}-{_signature(expires, scope)}"
+    return f"/media/{token}/{'/'.join(parts)}"
+
+
+def verify_media_token(token: str, path: str) -> Optional[Path]:
+    """
+    Проверяет подпись и срок действия ссылки без обращения к БД.
+    Возвращает путь к файлу или None, если ссылка недействительна.
+    """
+    try:
+        expires_text, scope_text, signature = token.split("-", 2)
+        expires, scope_parts = int(expires_text), int(scope_text)
+    except ValueError:
+        return None
+    if expires < time.time():
+        return None
+
+    parts = _split(path)
+    if not parts or ".." in parts or scope_parts < 0 or scope_parts > len(parts):
+        return None
+    if not hmac.compare_digest(signature, _signature(expires, "/".join(parts[:scope_parts]))):
+        return None
+    return MEDIA_ROOT.joinpath(*parts)
+
+
+def seconds_left(token: str) -> int:
+    """Сколько секунд ссылка еще действительна (для Cache-Control)"""
+    try:
+        return max(int(token.split("-", 1)[0]) - int(time.time()), 0)
+    except ValueError:
+        return 0
@@ -0,0 +1,130 @@
+"""Политика прохождения теста лекции: дедлайн, попытки, показ ответов"""
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+
+import pytz
+
+from app.models import Lecture
+
+logger = logging.getLogger(__name__)
+
+# Дедлайны хранятся без таймзоны и считаются московским временем
+MOSCOW_TZ = pytz.timezone('Europe/Moscow')
+
+# Кэш скомпилированных политик по ID лекции
+_policies_cache: dict[int, "TestPolicy"] = {}
+_policies_lock = threading.Lock()
+
+
+def _policy_signature(lecture: Lecture) -> tuple:
+    """Набор полей лекции, от которых зависит политика теста"""
+    return (
+        lecture.generate_test,
+        lecture.test_generation_mode,
+        lecture.test_max_attempts,
+        lecture.test_show_answers,
+        lecture.test_deadline,
+    )
+
+
+def _parse_deadline(value: Optional[str], lecture_id: int) -> Optional[datetime]:
+    """Парсит дедлайн из ISO строки в naive datetime (None, если не задан или некорректен)"""
+    if not value:
+        return None
+    try:
+        deadline = datetime.fromisoformat(value)
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Ошибка парсинга дедлайна лекции {lecture_id}: {e}")
+        return None
+    # Если deadline имеет таймзону, убираем её для сравнения с naive datetime
+    if deadline.tzinfo is not None:
+        deadline = deadline.replace(tzinfo=None)
+    return deadline
+
+
+class TestPolicy:
+    """
+    Скомпилированные настройки теста лекции.
+    Дедлайн парсится один раз при построении, дальнейшие проверки - только сравнения.
+    """
+    __slots__ = (
+        "lecture_id",
+        "signature",
+        "generate_test",
+        "generation_mode",
+        "max_attempts",
+        "show_answers",
+        "deadline",
+        "closed_detail",
+        "attempts_exhausted_detail",
+    )
+
+    def __init__(self, lecture: Lecture):
+        self.lecture_id = lecture.id
+        self.signature = _policy_signature(lecture)
+        self.generate_test = bool(lecture.generate_test)
+        self.generation_mode = lecture.test_generation_mode or "once"
+        # None или 0 - количество попыток не ограничивается
+        self.max_attempts = lecture.test_max_attempts
+        self.show_answers = bool(lecture.test_show_answers)
+        self.deadline = _parse_deadline(lecture.test_deadline, lecture.id)
+
+        # Тексты ошибок формируем заранее, чтобы не форматировать их в каждом запросе
+        self.closed_detail = None
+        if self.deadline is not None:
+            deadline_local = MOSCOW_TZ.localize(self.deadline)
+            self.closed_detail = f"Дедлайн выполнения теста истек: {deadline_local.strftime('%d.%m.%Y %H:%M')}"
+        self.attempts_exhausted_detail = (
+            f"Превышено максимальное количество попыток ({self.max_attempts}). Вы использовали все попытки."
+        )
+
+    @property
+    def per_student(self) -> bool:
+        """Генерируется ли отдельный тест для каждого студента"""
+        return self.generation_mode == "per_student"
+
+    @property
+    def max_attempts_display(self) -> int:
+        """Максимальное количество попыток для ответа API"""
+        return self.max_attempts or 1
+
+    def deadline_passed(self, now: Optional[datetime] = None) -> bool:
+        """Истек ли дедлайн"""
+        if self.deadline is None:
+            return False
+        return (now or datetime.now()) > self.deadline
+
+    def is_open(self, now: Optional[datetime] = None) -> bool:
+        """Можно ли сейчас проходить тест"""
+        return not self.deadline_passed(now)
+
+    def attempts_left(self, attempts_used: int) -> Optional[int]:
+        """Количество оставшихся попыток (None - без ограничения)"""
+        if not self.max_attempts:
+            return None
+        return max(self.max_attempts - attempts_used, 0)
+
+    def may_show_answers(self, now: Optional[datetime] = None) -> bool:
+        """Показывать ли правильные ответы: только если разрешено и дедлайн истек"""
+        return self.show_answers and self.deadline_passed(now)
+
+
+def get_test_policy(lecture: Lecture) -> TestPolicy:
+    """
+    Возвращает скомпилированную политику теста лекции из кэша.
+    Политика пересобирается, если настройки лекции изменились (в том числе в другом воркере).
+    """
+    policy = _policies_cache.get(lecture.id)
+    if policy is None or policy.signature != _policy_signature(lecture):
+        policy = TestPolicy(lecture)
+        with _policies_lock:
+            _policies_cache[lecture.id] = policy
+    return policy
+
+
+def invalidate_test_policy(lecture_id: int) -> None:
+    """Удаляет политику лекции из кэша (после изменения или удаления лекции)"""
+    with _policies_lock:
+        _policies_cache.pop(lecture_id, None)
@@ -0,0 +1,147 @@
+"""Готовые (сериализованные) представления тестов и счетчики попыток для пиковой нагрузки"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from app.models import Test, TestAttempt
+from app.utils.grading import get_answer_key, invalidate_answer_key
+
+logger = logging.getLogger(__name__)
+
+# Размеры кэшей процесса
+TEST_SNAPSHOTS_CACHE_SIZE = 256
+ATTEMPT_COUNTERS_CACHE_SIZE = 50000
+
+# Кэш снимков по ID теста (снимок хранит версию теста и перестраивается после замены вопросов)
+_snapshots_cache: "OrderedDict[int, TestSnapshot]" = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+# Счетчики попыток по (test_id, user_id)
+_attempt_counters: "OrderedDict[tuple[int, int], int]" = OrderedDict()
+_attempt_counters_lock = threading.Lock()
+
+
+def _make_etag(test_id: int, body: bytes) -> str:
+    """Сильный ETag по содержимому ответа"""
+    return f'"{test_id}-{hashlib.sha1(body).hexdigest()[:16]}"'
+
+
+class TestSnapshot:
+    """
+    Неизменяемое JSON представление теста в формате TestResponse.
+    Хранит два варианта: со скрытыми и с показанными правильными ответами.
+    """
+    __slots__ = ("test_id", "version", "hidden_body", "hidden_etag", "revealed_body", "revealed_etag")
+
+    def __init__(self, test_id: int, version: Optional[str], hidden_body: bytes, revealed_body: bytes):
+        self.test_id = test_id
+        self.version = version
+        self.hidden_body = hidden_body
+        self.hidden_etag = _make_etag(test_id, hidden_body)
+        self.revealed_body = revealed_body
+        self.revealed_etag = _make_etag(test_id, revealed_body)
+
+    def render(self, show_answers: bool) -> tuple[bytes, str]:
+        """Возвращает тело ответа и его ETag"""
+        if show_answers:
+            return self.revealed_body, self.revealed_etag
+        return self.hidden_body, self.hidden_etag
+
+
+def build_test_snapshot(db: Session, test: Test) -> TestSnapshot:
+    """Сериализует тест в оба варианта представления"""
+    key = get_answer_key(db, test.id, test.updated_at)
+
+    def serialize(show_answers: bool) -> bytes:
+        payload = {
+            "id": test.id,
+            "lecture_id": test.lecture_id,
+            "created_at": test.created_at,
+            "questions": [
+                {
+                    "id": key.question_ids[pos],
+                    "test_id": test.id,
+                    "question_text": key.question_texts[pos],
+                    "correct_answer": key.correct_answers[pos] if show_answers else "",
+                    "options": key.options_json[pos],
+                    "question_type": key.question_types[pos],
+                    "order_index": key.order_indexes[pos],
+                }
+                for pos in range(len(key))
+            ],
+        }
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    return TestSnapshot(test.id, test.updated_at, serialize(False), serialize(True))
+
+
+def get_test_snapshot(db: Session, test: Test) -> TestSnapshot:
+    """Возвращает снимок теста из кэша или строит его"""
+    with _snapshots_lock:
+        snapshot = _snapshots_cache.get(test.id)
+        if snapshot is not None and snapshot.version == test.updated_at:
+            _snapshots_cache.move_to_end(test.id)
+            return snapshot
+
+    snapshot = build_test_snapshot(db, test)
+
+    with _snapshots_lock:
+        _snapshots_cache[test.id] = snapshot
+        _snapshots_cache.move_to_end(test.id)
+        while len(_snapshots_cache) > TEST_SNAPSHOTS_CACHE_SIZE:
+            _snapshots_cache.popitem(last=False)
+    return snapshot
+
+
+def invalidate_test_snapshot(test_id: int) -> None:
+    """Сбрасывает снимок и ключ ответов теста после замены его вопросов (другие процессы сверяют версию теста)"""
+    with _snapshots_lock:
+        _snapshots_cache.pop(test_id, None)
+    invalidate_answer_key(test_id)
+
+
+def warm_test_snapshot(db: Session, test_id: int) -> None:
+    """Заранее строит снимок теста (вызывается при публикации лекции)"""
+    try:
+        test = db.query(Test).filter(Test.id == test_id).first()
+        if test:
+            get_test_snapshot(db, test)
+            logger.info(f"Снимок теста {test_id} подготовлен")
+    except Exception as e:
+        logger.warning(f"Не удалось подготовить снимок теста {test_id}: {e}")
+
+
+def get_attempts_count(db: Session, test_id: int, user_id: int) -> int:
+    """
+    Количество попыток студента по тесту.
+    Берется из счетчика процесса, при промахе - из БД.
+    Окончательно лимит попыток проверяется при сохранении попытки.
+    """
+    counter_key = (test_id, user_id)
+    with _attempt_counters_lock:
+        count = _attempt_counters.get(counter_key)
+        if count is not None:
+            _attempt_counters.move_to_end(counter_key)
+            return count
+
+    count = db.query(TestAttempt).filter(
+        TestAttempt.test_id == test_id,
+        TestAttempt.user_id == user_id
+    ).count()
+    record_attempts_count(test_id, user_id, count)
+    return count
+
+
+def record_attempts_count(test_id: int, user_id: int, count: int) -> None:
+    """Обновляет счетчик попыток (счетчик только растет)"""
+    counter_key = (test_id, user_id)
+    with _attempt_counters_lock:
+        _attempt_counters[counter_key] = max(count, _attempt_counters.get(counter_key, 0))
+        _attempt_counters.move_to_end(counter_key)
+        while len(_attempt_counters) > ATTEMPT_COUNTERS_CACHE_SIZE:
+            _attempt_counters.popitem(last=False)
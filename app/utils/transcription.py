@@ -6,9 +6,15 @@ import threading
 import time
 from queue import Queue
 from pathlib import Path
+from typing import Callable, List, Optional
+
+from app.utils.documents import TextBlock
 
 logger = logging.getLogger(__name__)
 
+# Разделитель сегментов в тексте транскрипта
+TRANSCRIPT_SEPARATOR = " "
+
 # Импорт ffmpeg-python
 FFMPEG_PYTHON_AVAILABLE = False
 try:
@@ -302,6 +308,19 @@ def transcribe_file(file_path: Path, model_name: str = None) -> str:
     Returns:
         Текст транскрипта
     """
+    return TRANSCRIPT_SEPARATOR.join(segment.text for segment in transcribe_segments(file_path, model_name))
+
+
+def transcribe_segments(
+    file_path: Path,
+    model_name: str = None,
+    on_progress: Optional[Callable[[float], None]] = None,
+) -> List[TextBlock]:
+    """
+    Транскрибирует один файл (видео или аудио) и возвращает сегменты Whisper:
+    текст, смещение в транскрипте (сегменты через TRANSCRIPT_SEPARATOR) и время в записи.
+    on_progress получает долю распознанной записи (0..1) по мере получения сегментов.
+    """
     # Используем значение из конфигурации, если не передано
     if model_name is None:
         from app.core.config import WHISPER_MODEL
@@ -364,19 +383,31 @@ def transcribe_file(file_path: Path, model_name: str = None) -> str:
             logger.error(f"Ошибка запуска транскрибации: {e}", exc_info=True)
             raise
         
-        # Собираем текст из сегментов
-        text_parts = []
-        segment_count = 0
+        # Собираем сегменты с временем и смещением в тексте транскрипта
+        blocks: List[TextBlock] = []
+        offset = 0
+        duration = getattr(info, "duration", None) or 0
+        reported = 0.0
         for segment in segments:
-            text_parts.append(segment.text)
-            segment_count += 1
-            if segment_count % 10 == 0:
-                logger.debug(f"Обработано сегментов: {segment_count}")
+            if on_progress and duration:
+                # Прогресс сообщается шагами не меньше 1%, чтобы не создавать событие на каждый сегмент
+                progress = min(segment.end / duration, 1.0)
+                if progress - reported >= 0.01:
+                    reported = progress
+                    on_progress(progress)
+            segment_text = segment.text.strip()
+            if not segment_text:
+                continue
+            if blocks:
+                offset += len(TRANSCRIPT_SEPARATOR)
+            blocks.append(TextBlock(segment_text, "segment", len(blocks) + 1, offset, segment.start, segment.end))
+            offset += len(segment_text)
+            if len(blocks) % 10 == 0:
+                logger.debug(f"Обработано сегментов: {len(blocks)}")
         
-        text = " ".join(text_parts).strip()
-        logger.info(f"Транскрибация завершена: {file_path.name}, сегментов: {segment_count}, длина текста: {len(text)} символов")
+        logger.info(f"Транскрибация завершена: {file_path.name}, сегментов: {len(blocks)}, длина текста: {offset} символов")
         
-        return text
+        return blocks
 
 
 def find_ffmpeg():
@@ -0,0 +1,220 @@
+"""Сохранение загружаемых материалов лекций: типы, лимиты размера и запись файлов на диск"""
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from app.core.config import (
+    MAX_AUDIO_UPLOAD_MB,
+    MAX_OTHER_UPLOAD_MB,
+    MAX_PDF_UPLOAD_MB,
+    MAX_VIDEO_UPLOAD_MB,
+)
+from app.models import LectureMaterial
+from app.utils.file_serving import forget_material_file
+from app.utils.hls import remove_hls
+
+logger = logging.getLogger(__name__)
+
+# Директория для хранения файлов лекций
+UPLOAD_DIR = Path("uploads/lectures")
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+# Размер блока при копировании загруженного файла
+COPY_CHUNK_SIZE = 1024 * 1024  # 1 МБ
+
+FILE_TYPE_MAP = {
+    '.mp4': 'video', '.avi': 'video', '.mov': 'video', '.mkv': 'video', '.webm': 'video',
+    '.pdf': 'pdf',
+    '.pptx': 'presentation', '.ppt': 'presentation',
+    '.mp3': 'audio', '.wav': 'audio', '.ogg': 'audio', '.m4a': 'audio',
+    '.zip': 'scorm', '.scorm': 'scorm'
+}
+
+MAX_UPLOAD_MB = {
+    'video': MAX_VIDEO_UPLOAD_MB,
+    'audio': MAX_AUDIO_UPLOAD_MB,
+    'pdf': MAX_PDF_UPLOAD_MB,
+}
+
+
+def detect_file_type(file_name: str) -> str:
+    """Тип материала по расширению файла"""
+    return FILE_TYPE_MAP.get(Path(file_name).suffix.lower(), 'other')
+
+
+def max_upload_size(file_type: str) -> int:
+    """Максимальный размер файла для типа материала (в байтах)"""
+    return MAX_UPLOAD_MB.get(file_type, MAX_OTHER_UPLOAD_MB) * 1024 * 1024
+
+
+def check_upload_size(file_type: str, file_size: int) -> None:
+    """Выбрасывает 413, если файл больше лимита для своего типа"""
+    max_size = max_upload_size(file_type)
+    if file_size > max_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Файл слишком большой. Максимальный размер для {file_type}: {max_size // (1024 * 1024)} МБ. Размер вашего файла: {file_size / (1024 * 1024):.2f} МБ"
+        )
+
+
+def safe_file_name(file_name: str) -> str:
+    """Имя файла без компонентов пути"""
+    name = Path((file_name or "").replace("\\", "/")).name
+    if not name or name in (".", ".."):
+        raise HTTPException(status_code=400, detail="Некорректное имя файла")
+    return name
+
+
+def lecture_upload_dir(lecture_id: int) -> Path:
+    """Директория файлов лекции (создается при необходимости)"""
+    lecture_dir = UPLOAD_DIR / str(lecture_id)
+    lecture_dir.mkdir(parents=True, exist_ok=True)
+    return lecture_dir
+
+
+def partial_upload_path(lecture_id: int, upload_id: str) -> Path:
+    """
+    Путь к недокачанному файлу.
+    Лежит рядом с итоговым файлом, поэтому завершение загрузки - это переименование без копирования.
+    """
+    return lecture_upload_dir(lecture_id) / f".{upload_id}.part"
+
+
+def write_at(fd: int, data: bytes, offset: int) -> None:
+    """Записывает данные по смещению (os.pwrite может записать не все байты за один вызов)"""
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def finalize_upload(part_path: Path, final_path: Path) -> None:
+    """Сбрасывает файл на диск и атомарно переименовывает его в итоговый"""
+    fd = os.open(part_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(part_path, final_path)
+
+
+def hash_file(path: Path) -> str:
+    """SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_upload_file(source: BinaryIO, lecture_id: int, file_name: str, file_type: str) -> tuple[int, str]:
+    """
+    Копирует загруженный файл сразу в директорию лекции, проверяя лимит размера по ходу записи.
+    Возвращает размер файла в байтах и SHA-256 содержимого (считается в том же проходе).
+    """
+    part_path = lecture_upload_dir(lecture_id) / f".{os.urandom(8).hex()}.part"
+    max_size = max_upload_size(file_type)
+    digest = hashlib.sha256()
+    file_size = 0
+    fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        try:
+            # Сбрасываем позицию файла на начало (на случай если он уже был прочитан)
+            source.seek(0)
+            while True:
+                chunk = source.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                # Проверяем размер до записи очередного блока
+                if file_size + len(chunk) > max_size:
+                    check_upload_size(file_type, file_size + len(chunk))
+                write_at(fd, chunk, file_size)
+                digest.update(chunk)
+                file_size += len(chunk)
+        finally:
+            os.close(fd)
+        finalize_upload(part_path, lecture_upload_dir(lecture_id) / file_name)
+    except Exception:
+        if part_path.exists():
+            try:
+                os.unlink(part_path)
+            except OSError:
+                pass
+        raise
+    return file_size, digest.hexdigest()
+
+
+def create_material_record(
+    db: Session,
+    lecture_id: int,
+    file_name: str,
+    file_type: str,
+    file_size: int,
+    content_hash: Optional[str] = None,
+) -> dict:
+    """
+    Создает запись о материале лекции и возвращает её представление для API.
+    Если файл с таким именем уже был загружен (и перезаписан на диске), обновляется существующий материал:
+    новый content_hash отмечает его как измененный для повторной обработки.
+    """
+    # Формируем путь как uploads/lectures/{lecture_id}/{filename}
+    file_path = f"uploads/lectures/{lecture_id}/{file_name}"
+    material = db.query(LectureMaterial).filter(
+        LectureMaterial.lecture_id == lecture_id,
+        LectureMaterial.file_path == file_path
+    ).first()
+
+    if material is not None:
+        material.file_type = file_type
+        material.file_size = file_size
+        material.content_hash = content_hash
+        if material.hls_path:
+            # HLS версия собрана из прежнего файла
+            remove_hls(lecture_id, material.id)
+            material.hls_path = None
+        forget_material_file(material.id)
+    else:
+        # Получаем текущий максимальный order_index
+        max_order = db.query(LectureMaterial).filter(LectureMaterial.lecture_id == lecture_id).count()
+
+        material = LectureMaterial(
+            lecture_id=lecture_id,
+            file_path=file_path,
+            file_type=file_type,
+            file_name=file_name,
+            file_size=file_size,
+            content_hash=content_hash,
+            order_index=max_order
+        )
+        db.add(material)
+    db.commit()
+    db.refresh(material)
+
+    return {
+        "id": material.id,
+        "file_path": material.file_path,
+        "file_type": material.file_type,
+        "file_name": material.file_name,
+        "file_size": material.file_size,
+        "order_index": material.order_index
+    }
+
+
+def remove_partial_upload(lecture_id: int, upload_id: str) -> None:
+    """Удаляет недокачанный файл сессии (если он есть)"""
+    part_path = UPLOAD_DIR / str(lecture_id) / f".{upload_id}.part"
+    try:
+        part_path.unlink()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Не удалось удалить {part_path}: {e}")
@@ -0,0 +1,108 @@
+"""
+Сравнение разбиения на чанки: прежнее посимвольное split_text_into_chunks и chunk_text по токенам.
+Запуск из корня проекта:
+    python -m benchmarks.bench_chunking [файлы с текстом...] [--repeat N]
+Без файлов используется синтетический текст (--size-mb).
+"""
+import argparse
+import random
+import statistics
+import time
+from pathlib import Path
+from typing import List
+
+from app.core.config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from app.utils.chunking import chunk_text, estimate_tokens
+
+WORDS = [
+    "лекция", "материал", "студент", "преподаватель", "вычислительная", "сложность", "алгоритма",
+    "граф", "вершина", "ребро", "matrix", "vector", "gradient", "O(n)", "2024", "электроэнцефалография",
+]
+ENDINGS = [". ", "! ", "? ", ".\n", "\n\n", ", "]
+
+
+def split_text_into_chunks(text: str, chunk_size: int = 2000, overlap: int = 200) -> List[str]:
+    """Прежняя реализация из app/utils/embeddings.py: чанки по chunk_size символов с перекрытием"""
+    if not text or len(text) <= chunk_size:
+        return [text] if text else []
+
+    chunks = []
+    start = 0
+
+    while start < len(text):
+        end = start + chunk_size
+        chunk = text[start:end]
+
+        # Пытаемся разбить по предложениям (точка, восклицательный знак, вопросительный)
+        if end < len(text):
+            for sep in ['. ', '! ', '? ', '\n\n', '\n']:
+                last_sep = chunk.rfind(sep)
+                if last_sep > chunk_size * 0.5:
+                    chunk = chunk[:last_sep + len(sep)]
+                    end = start + len(chunk)
+                    break
+
+        chunks.append(chunk.strip())
+
+        start = end - overlap
+        if start >= len(text):
+            break
+
+    return chunks
+
+
+def synthetic_text(size_mb: float, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    limit = int(size_mb * 1024 * 1024)
+    while size < limit:
+        word = rng.choice(WORDS)
+        separator = rng.choice(ENDINGS) if rng.random() < 0.08 else " "
+        parts.append(word)
+        parts.append(separator)
+        size += len(word) + len(separator)
+    return "".join(parts)
+
+
+def measure(name: str, split, text: str, repeat: int) -> None:
+    timings = []
+    chunks = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = split(text)
+        timings.append(time.perf_counter() - started)
+    tokens = [estimate_tokens(chunk) for chunk in chunks]
+    over_limit = sum(1 for count in tokens if count > CHUNK_MAX_TOKENS)
+    print(
+        f"{name:<24} {statistics.median(timings):8.3f} с  чанков: {len(chunks):7d}  "
+        f"токенов в чанке: сред. {statistics.mean(tokens):6.1f}, макс. {max(tokens):5d}  "
+        f"больше лимита ({CHUNK_MAX_TOKENS}): {over_limit}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", type=Path, help="Файлы с текстом материалов")
+    parser.add_argument("--size-mb", type=float, default=8.0, help="Объем синтетического текста")
+    parser.add_argument("--repeat", type=int, default=3, help="Количество повторов (берется медиана)")
+    args = parser.parse_args()
+
+    if args.files:
+        texts = [(path.name, path.read_text(encoding="utf-8")) for path in args.files]
+    else:
+        texts = [(f"синтетический текст {args.size_mb} МБ", synthetic_text(args.size_mb))]
+
+    for name, text in texts:
+        print(f"{name}: {len(text)} символов, ~{estimate_tokens(text)} токенов")
+        measure("split_text_into_chunks", split_text_into_chunks, text, args.repeat)
+        measure(
+            "chunk_text",
+            lambda value: [chunk.text for chunk in chunk_text(value, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS)],
+            text,
+            args.repeat
+        )
+
+
+if __name__ == "__main__":
+    main()
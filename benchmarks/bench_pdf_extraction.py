@@ -0,0 +1,69 @@
+"""
+Сравнение извлечения текста PDF: прежний последовательный разбор pdfplumber и iter_pdf_pages
+(диапазоны страниц в пуле процессов, выбор PyPDF2 для PDF с текстовым слоем).
+Запуск из корня проекта:
+    python -m benchmarks.bench_pdf_extraction лекция.pdf [другие.pdf...] [--repeat N]
+Режим и число процессов задаются как в приложении: PDF_EXTRACTION_MODE, PDF_EXTRACTION_WORKERS.
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+from typing import List
+
+import pdfplumber
+
+from app.core.config import PDF_EXTRACTION_MODE, PDF_EXTRACTION_WORKERS, PDF_PARALLEL_MIN_PAGES
+from app.utils.pdf_extraction import _choose_extractor, _count_pages, iter_pdf_pages
+
+
+def extract_sequential(file_path: Path) -> List[str]:
+    """Прежний разбор из process_single_material: все страницы pdfplumber в текущем потоке"""
+    text_parts = []
+    with pdfplumber.open(str(file_path)) as pdf:
+        for page in pdf.pages:
+            text = page.extract_text()
+            if text:
+                text_parts.append(text)
+    return text_parts
+
+
+def extract_parallel(file_path: Path) -> List[str]:
+    return [text for _, text in iter_pdf_pages(file_path) if text]
+
+
+def measure(name: str, extract, file_path: Path, repeat: int) -> List[str]:
+    timings = []
+    pages = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        pages = extract(file_path)
+        timings.append(time.perf_counter() - started)
+    print(
+        f"  {name:<20} первый запуск {timings[0]:8.2f} с, медиана {statistics.median(timings):8.2f} с  "
+        f"страниц с текстом: {len(pages)}, символов: {sum(len(text) for text in pages)}"
+    )
+    return pages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", type=Path, help="PDF файлы")
+    parser.add_argument("--repeat", type=int, default=3, help="Количество повторов (первый включает запуск пула)")
+    args = parser.parse_args()
+
+    print(
+        f"Режим: {PDF_EXTRACTION_MODE}, процессов: {PDF_EXTRACTION_WORKERS}, "
+        f"параллельно от {PDF_PARALLEL_MIN_PAGES} стр."
+    )
+    for file_path in args.files:
+        pages_count = _count_pages(file_path)
+        print(f"{file_path.name}: {pages_count} стр., способ извлечения: {_choose_extractor(file_path, pages_count)}")
+        sequential = measure("pdfplumber подряд", extract_sequential, file_path, args.repeat)
+        parallel = measure("iter_pdf_pages", extract_parallel, file_path, args.repeat)
+        if len(sequential) != len(parallel):
+            print(f"  Внимание: разное количество страниц с текстом ({len(sequential)} и {len(parallel)})")
+
+
+if __name__ == "__main__":
+    main()
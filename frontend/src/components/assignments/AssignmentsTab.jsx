@@ -389,8 +389,6 @@ function TeacherAssignmentsTab({ courseId, lectures }) {
   const [testList, setTestList] = useState([])
   const [loading, setLoading] = useState(false)
   const [selectedTest, setSelectedTest] = useState(null)
-  const [testDetails, setTestDetails] = useState(null)
-  const [loadingDetails, setLoadingDetails] = useState(false)
 
   useEffect(() => {
     loadTeacherTests()
@@ -407,7 +405,8 @@ function TeacherAssignmentsTab({ courseId, lectures }) {
       
       for (const lecture of publishedLectures) {
         try {
-          const details = await api.getAllTestAttempts(lecture.id)
+          // Для списка достаточно итогов ведомости - записи студентов не запрашиваем
+          const details = await api.getTestGradebook(lecture.id, { limit: 1 })
           allTests.push({
             lectureId: lecture.id,
             lectureName: lecture.name,
@@ -438,23 +437,12 @@ function TeacherAssignmentsTab({ courseId, lectures }) {
     }
   }
 
-  const handleTestClick = async (test) => {
+  const handleTestClick = (test) => {
     setSelectedTest(test)
-    setLoadingDetails(true)
-    try {
-      const details = await api.getAllTestAttempts(test.lectureId)
-      setTestDetails(details)
-    } catch (err) {
-      console.error('Ошибка загрузки деталей теста:', err)
-      setTestDetails(null)
-    } finally {
-      setLoadingDetails(false)
-    }
   }
 
   const closeModal = () => {
     setSelectedTest(null)
-    setTestDetails(null)
   }
 
   // Используем parseDeadline из утилит
@@ -493,8 +481,6 @@ function TeacherAssignmentsTab({ courseId, lectures }) {
       {selectedTest && (
         <TeacherTestModal
           test={selectedTest}
-          details={testDetails}
-          loading={loadingDetails}
           onClose={closeModal}
         />
       )}
@@ -556,159 +542,191 @@ function TeacherTestListItem({ test, onClick }) {
   )
 }
 
-function TeacherTestModal({ test, details, loading, onClose }) {
-  const [selectedGroupIds, setSelectedGroupIds] = useState([])
-  const [selectedStudentIds, setSelectedStudentIds] = useState([])
-  const [filteredAttempts, setFilteredAttempts] = useState([])
+// Сколько студентов ведомости загружать за один запрос
+const GRADEBOOK_PAGE_SIZE = 50
 
+function TeacherTestModal({ test, onClose }) {
+  const [groupId, setGroupId] = useState('')
+  const [search, setSearch] = useState('')
+  const [gradebook, setGradebook] = useState(null)
+  const [loading, setLoading] = useState(true)
+  const [loadingMore, setLoadingMore] = useState(false)
+  const requestRef = useRef(0)
+
+  // Итоги студентов из ведомости; фильтры применяются на сервере, поиск - после паузы в наборе
   useEffect(() => {
-    if (details && details.attempts) {
-      let filtered = details.attempts
-
-      // Фильтр по группам
-      if (selectedGroupIds.length > 0) {
-        filtered = filtered.filter(attempt => 
-          attempt.group_id && selectedGroupIds.includes(attempt.group_id)
-        )
+    const requestId = ++requestRef.current
+    const timer = setTimeout(async () => {
+      setLoading(true)
+      try {
+        const data = await api.getTestGradebook(test.lectureId, {
+          group_id: groupId,
+          search: search.trim(),
+          limit: GRADEBOOK_PAGE_SIZE
+        })
+        if (requestRef.current === requestId) {
+          setGradebook(data)
+        }
+      } catch (err) {
+        console.error('Ошибка загрузки ведомости теста:', err)
+        if (requestRef.current === requestId) {
+          setGradebook(null)
+        }
+      } finally {
+        if (requestRef.current === requestId) {
+          setLoading(false)
+        }
       }
+    }, search ? 300 : 0)
+    return () => clearTimeout(timer)
+  }, [test.lectureId, groupId, search])
 
-      // Фильтр по студентам
-      if (selectedStudentIds.length > 0) {
-        filtered = filtered.filter(attempt => 
-          selectedStudentIds.includes(attempt.user_id)
-        )
+  const loadMore = async () => {
+    const requestId = requestRef.current
+    setLoadingMore(true)
+    try {
+      const data = await api.getTestGradebook(test.lectureId, {
+        group_id: groupId,
+        search: search.trim(),
+        skip: gradebook.entries.length,
+        limit: GRADEBOOK_PAGE_SIZE
+      })
+      if (requestRef.current === requestId) {
+        setGradebook(prev => ({ ...data, entries: [...prev.entries, ...data.entries] }))
       }
-
-      setFilteredAttempts(filtered)
+    } catch (err) {
+      console.error('Ошибка загрузки ведомости теста:', err)
+    } finally {
+      setLoadingMore(false)
     }
-  }, [details, selectedGroupIds, selectedStudentIds])
-
-  // Получаем список студентов для выбранных групп
-  const availableStudents = details?.students?.filter(student => {
-    if (selectedGroupIds.length === 0) return true
-    return selectedGroupIds.includes(student.group_id)
-  }) || []
-
-  if (loading) {
-    return (
-      <div className="teacher-test-modal-overlay" onClick={onClose}>
-        <div className="teacher-test-modal-content" onClick={(e) => e.stopPropagation()}>
-          <button className="teacher-test-modal-close" onClick={onClose}>×</button>
-          <div className="teacher-test-modal-loading">Загрузка данных...</div>
-        </div>
-      </div>
-    )
   }
 
-  if (!details) {
+  if (!gradebook) {
     return (
       <div className="teacher-test-modal-overlay" onClick={onClose}>
         <div className="teacher-test-modal-content" onClick={(e) => e.stopPropagation()}>
           <button className="teacher-test-modal-close" onClick={onClose}>×</button>
-          <div className="teacher-test-modal-empty">
-            <p>Нет данных о попытках</p>
-          </div>
+          {loading ? (
+            <div className="teacher-test-modal-loading">Загрузка данных...</div>
+          ) : (
+            <div className="teacher-test-modal-empty">
+              <p>Нет данных о попытках</p>
+            </div>
+          )}
         </div>
       </div>
     )
   }
 
+  const entries = gradebook.entries || []
+
   return (
     <div className="teacher-test-modal-overlay" onClick={onClose}>
       <div className="teacher-test-modal-content" onClick={(e) => e.stopPropagation()}>
         <button className="teacher-test-modal-close" onClick={onClose}>×</button>
-        
+
         <div className="teacher-test-modal-header">
           <h2 className="teacher-test-modal-title">Результаты теста: {test.lectureName}</h2>
           <div className="teacher-test-modal-stats">
             <div className="teacher-test-stat">
               <span className="teacher-test-stat-label">Средняя оценка:</span>
-              <span className="teacher-test-stat-value">{details.average_score?.toFixed(1) || 0}%</span>
+              <span className="teacher-test-stat-value">{gradebook.average_score?.toFixed(1) || 0}%</span>
+            </div>
+            <div className="teacher-test-stat">
+              <span className="teacher-test-stat-label">Студентов:</span>
+              <span className="teacher-test-stat-value">{gradebook.total_students || 0}</span>
             </div>
             <div className="teacher-test-stat">
               <span className="teacher-test-stat-label">Всего попыток:</span>
-              <span className="teacher-test-stat-value">{details.total_attempts || 0}</span>
+              <span className="teacher-test-stat-value">{gradebook.total_attempts || 0}</span>
             </div>
           </div>
         </div>
 
         <div className="teacher-test-modal-filters">
           <div className="teacher-test-filter-group">
-            <label className="teacher-test-filter-label">Группы:</label>
-            <MultiSelect
-              options={details.groups || []}
-              selectedIds={selectedGroupIds}
-              onChange={setSelectedGroupIds}
-              placeholder="Выберите группы..."
-              searchPlaceholder="Поиск по группам..."
-            />
+            <label className="teacher-test-filter-label">Группа:</label>
+            <select
+              className="lecture-filter-select"
+              size="1"
+              value={groupId}
+              onChange={(e) => setGroupId(e.target.value)}
+            >
+              <option value="">Все группы</option>
+              {(gradebook.groups || []).map(group => (
+                <option key={group.id} value={group.id}>{group.name}</option>
+              ))}
+            </select>
           </div>
           <div className="teacher-test-filter-group">
-            <label className="teacher-test-filter-label">Студенты:</label>
-            <MultiSelect
-              options={availableStudents.map(s => ({ id: s.id, name: `${s.name} (${s.group_name || ''})` }))}
-              selectedIds={selectedStudentIds}
-              onChange={setSelectedStudentIds}
-              placeholder="Выберите студентов..."
-              searchPlaceholder="Поиск по студентам..."
+            <label className="teacher-test-filter-label">Студент:</label>
+            <input
+              type="text"
+              className="teacher-test-filter-input"
+              value={search}
+              onChange={(e) => setSearch(e.target.value)}
+              placeholder="ФИО или логин..."
             />
           </div>
         </div>
 
         <div className="teacher-test-modal-attempts">
-          {filteredAttempts.length === 0 ? (
+          {loading ? (
+            <div className="teacher-test-modal-loading">Загрузка данных...</div>
+          ) : entries.length === 0 ? (
             <div className="teacher-test-modal-empty">
               <p>Нет попыток, соответствующих выбранным фильтрам</p>
             </div>
           ) : (
-            filteredAttempts.map((attempt, index) => (
-              <div key={attempt.id} className="teacher-test-attempt-item">
+            entries.map(entry => (
+              <div key={`${entry.test_id}-${entry.user_id}`} className="teacher-test-attempt-item">
                 <div className="teacher-test-attempt-header">
                   <div className="teacher-test-attempt-student">
-                    <h3>{attempt.user_name}</h3>
-                    {attempt.group_name && (
-                      <span className="teacher-test-attempt-group">{attempt.group_name}</span>
+                    <h3>{entry.user_name}</h3>
+                    {entry.group_name && (
+                      <span className="teacher-test-attempt-group">{entry.group_name}</span>
                     )}
                   </div>
                   <div className="teacher-test-attempt-score">
-                    Оценка: <strong>{attempt.score.toFixed(1)}</strong> / {attempt.total_questions} 
-                    ({((attempt.score / attempt.total_questions) * 100).toFixed(1)}%)
+                    Лучшая оценка: <strong>{entry.best_score}</strong> / {entry.best_total} ({entry.best_percent.toFixed(1)}%)
+                  </div>
+                  <div className="teacher-test-attempt-score">
+                    Попыток: <strong>{entry.attempts_count}</strong>
                   </div>
                   <div className="teacher-test-attempt-date">
-                    {new Date(attempt.completed_at).toLocaleString('ru-RU')}
+                    {entry.last_completed_at ? new Date(entry.last_completed_at).toLocaleString('ru-RU') : '—'}
                   </div>
                 </div>
 
-                {attempt.results && attempt.results.length > 0 && (
-                  <div className="teacher-test-attempt-questions">
-                    {attempt.results.map((result, qIndex) => (
-                      <div key={result.question_id} className="teacher-test-attempt-question">
-                        <div className="teacher-test-attempt-question-header">
-                          Вопрос {qIndex + 1}
-                        </div>
-                        <p className="teacher-test-attempt-question-text">{result.question_text}</p>
-                        <div className="teacher-test-attempt-answer">
-                          <div className={`teacher-test-answer ${result.is_correct ? 'correct' : 'incorrect'}`}>
-                            <strong>Ответ студента:</strong> {result.student_answer || 'Не отвечено'}
-                            {result.is_correct ? (
-                              <span className="teacher-test-answer-badge correct">✓ Правильно</span>
-                            ) : (
-                              <span className="teacher-test-answer-badge incorrect">✗ Неправильно</span>
-                            )}
-                          </div>
-                          {attempt.show_answers && result.correct_answer && (
-                            <div className="teacher-test-correct-answer">
-                              <strong>Правильный ответ:</strong> {result.correct_answer}
-                            </div>
-                          )}
-                        </div>
-                      </div>
+                {entry.last_results && entry.last_results.length > 0 && (
+                  <div className="teacher-test-attempt-results">
+                    <span className="teacher-test-attempt-results-label">
+                      Последняя попытка: {entry.last_score} / {entry.total_questions}
+                    </span>
+                    {entry.last_results.map((isCorrect, qIndex) => (
+                      <span
+                        key={qIndex}
+                        className={`teacher-test-answer-badge ${isCorrect ? 'correct' : 'incorrect'}`}
+                        title={`Вопрос ${qIndex + 1}: ${isCorrect ? 'правильно' : 'неправильно'}`}
+                      >
+                        {qIndex + 1}
+                      </span>
                     ))}
                   </div>
                 )}
               </div>
             ))
           )}
+
+          {!loading && entries.length < (gradebook.total_students || 0) && (
+            <button
+              className="teacher-test-load-more"
+              onClick={loadMore}
+              disabled={loadingMore}
+            >
+              {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+            </button>
+          )}
         </div>
       </div>
     </div>
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import { useNavigate } from 'react-router-dom'
 import api from '../../services/api'
 import LecturePreview from './LecturePreview'
@@ -19,8 +19,56 @@ function LectureBuilder({ lecture, courseId, onClose, onUpdate, onDelete }) {
   const [lectureId, setLectureId] = useState(lecture?.id)
   const [publishing, setPublishing] = useState(false)
   const [publishProgress, setPublishProgress] = useState(0)
+  const [publishStage, setPublishStage] = useState('')
+  const publishStreamRef = useRef(null)
   const isNew = !lectureId
 
+  // Закрываем поток прогресса публикации при закрытии конструктора
+  useEffect(() => () => publishStreamRef.current?.abort(), [])
+
+  // Прогресс публикации по событиям сервера: материалы - до 90%, генерация теста - 95%
+  const followPublishProgress = async (currentLectureId, materialsTotal) => {
+    const controller = new AbortController()
+    publishStreamRef.current = controller
+    const materialProgress = {}
+    let total = materialsTotal || 1
+    let result = null
+    await api.streamLectureEvents(currentLectureId, (event) => {
+      if (event.materials_total) total = event.materials_total
+      if (event.material_id) {
+        const done = event.stage === 'material_done' || event.stage === 'material_failed'
+        materialProgress[event.material_id] = done ? 1 : (event.progress || 0)
+      }
+      if (event.stage === 'transcribing') {
+        setPublishStage(`Транскрибация: ${event.file_name}`)
+      } else if (event.stage === 'extracting') {
+        setPublishStage(`Извлечение текста: ${event.file_name}`)
+      } else if (event.stage === 'embedding') {
+        setPublishStage(`Индексация: ${event.file_name}`)
+      } else if (event.stage === 'generating_test') {
+        setPublishStage('Генерация теста')
+      }
+
+      if (event.stage === 'generating_test') {
+        setPublishProgress(95)
+      } else if (event.stage === 'published') {
+        setPublishProgress(100)
+        result = event
+      } else if (event.stage === 'failed') {
+        result = event
+      } else {
+        // Снимок состояния из БД содержит только количество обработанных материалов
+        const completed = Math.max(
+          Object.values(materialProgress).reduce((sum, value) => sum + value, 0),
+          event.material_id ? 0 : (event.materials_done || 0)
+        )
+        setPublishProgress(Math.min(90, (completed / total) * 90))
+      }
+    }, controller.signal)
+    publishStreamRef.current = null
+    return result
+  }
+
   const handlePreview = () => {
     if (!lecture.id) {
       alert('Сначала сохраните лекцию, чтобы посмотреть предпросмотр')
@@ -52,6 +100,22 @@ function LectureBuilder({ lecture, courseId, onClose, onUpdate, onDelete }) {
           setTestDeadline(updatedLecture.test_deadline || '')
           setLectureId(updatedLecture.id)
           console.log('Загружена лекция:', { id: updatedLecture.id, published: updatedLecture.published })
+          
+          // Обработка запущена ранее и еще идет: продолжаем показывать её прогресс
+          if (['queued', 'running'].includes(updatedLecture.processing_status) && !publishStreamRef.current) {
+            setPublishing(true)
+            followPublishProgress(updatedLecture.id, updatedLecture.materials?.length)
+              .then((result) => {
+                if (result?.stage === 'published') {
+                  setPublished(true)
+                  if (onUpdate) onUpdate()
+                }
+              })
+              .catch(err => {
+                if (err.name !== 'AbortError') console.error('Ошибка получения прогресса обработки:', err)
+              })
+              .finally(() => setPublishing(false))
+          }
         } catch (err) {
           console.error('Ошибка загрузки лекции:', err)
         }
@@ -107,7 +171,10 @@ function LectureBuilder({ lecture, courseId, onClose, onUpdate, onDelete }) {
       const lectureId = await ensureLectureCreated()
       
       const material = await api.uploadMaterial(lectureId, file)
-      setMaterials([...materials, material])
+      // Файл с тем же именем заменяет существующий материал
+      setMaterials(materials.some(m => m.id === material.id)
+        ? materials.map(m => (m.id === material.id ? { ...m, ...material } : m))
+        : [...materials, material])
       onUpdate()
     } catch (err) {
       alert('Ошибка: ' + err.message)
@@ -649,26 +716,27 @@ function LectureBuilder({ lecture, courseId, onClose, onUpdate, onDelete }) {
                 button.disabled = true
                 setPublishing(true)
                 setPublishProgress(0)
-                
-                // Симуляция прогресса (будет заменено на реальный прогресс с SSE)
-                const progressInterval = setInterval(() => {
-                  setPublishProgress(prev => {
-                    if (prev >= 90) return prev
-                    return prev + Math.random() * 10
-                  })
-                }, 500)
+                setPublishStage('')
                 
                 try {
                   const currentLectureId = lectureId || lecture?.id
                   console.log('Публикация лекции:', { lectureId: currentLectureId, materialsCount: materials.length })
                   const response = await api.publishLecture(currentLectureId)
-                  
-                  clearInterval(progressInterval)
-                  setPublishProgress(100)
-                  
                   console.log('Ответ от сервера:', response)
-                  alert(response.message || 'Лекция успешно опубликована')
-                  setPublished(true)
+                  
+                  if (response.processing) {
+                    const result = await followPublishProgress(currentLectureId, response.materials_count)
+                    if (result?.stage === 'failed') {
+                      throw new Error(result.error || 'Не удалось обработать материалы')
+                    }
+                    if (!result) {
+                      // Поток прервался до завершения: обработка продолжается на сервере
+                      alert('Обработка материалов продолжается. Лекция будет опубликована после её завершения.')
+                    }
+                  } else {
+                    setPublishProgress(100)
+                    alert(response.message || 'Лекция успешно опубликована')
+                  }
                   
                   // Перезагружаем данные лекции, чтобы получить актуальное состояние
                   try {
@@ -685,7 +753,9 @@ function LectureBuilder({ lecture, courseId, onClose, onUpdate, onDelete }) {
                     onUpdate()
                   }
                 } catch (err) {
-                  clearInterval(progressInterval)
+                  if (err.name === 'AbortError') {
+                    return
+                  }
                   setPublishProgress(0)
                   console.error('Ошибка публикации лекции:', err)
                   const errorMessage = err.response?.data?.detail || err.message || 'Не удалось опубликовать лекцию'
@@ -710,7 +780,7 @@ function LectureBuilder({ lecture, courseId, onClose, onUpdate, onDelete }) {
                 ></div>
               </div>
               <div className="publish-progress-text">
-                Обработка... {Math.round(publishProgress)}%
+                {publishStage || 'Обработка...'} {Math.round(publishProgress)}%
               </div>
             </div>
           )}
@@ -1,5 +1,6 @@
 import { useState, useEffect, useRef } from 'react'
 import api from '../../services/api'
+import { mediaSourceType, supportsNativeHls } from '../../utils/mediaUtils'
 import { useAuth } from '../../hooks/useAuth'
 import '../../styles/lecture-preview.css'
 
@@ -106,7 +107,7 @@ function LecturePreview({ courseId, lectureId, onClose }) {
 // Компонент для отображения материала (упрощенная версия из LectureView)
 function MaterialViewer({ material, index }) {
   const [fileText, setFileText] = useState(null)
-  const [fileBlobUrl, setFileBlobUrl] = useState(null)
+  const [mediaUrl, setMediaUrl] = useState(null)
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState(null)
   const [transcript, setTranscript] = useState(null)
@@ -119,14 +120,11 @@ function MaterialViewer({ material, index }) {
     }
     
     if (material.file_type === 'video' || material.file_type === 'audio') {
-      loadFileAsBlob()
+      loadMediaUrl()
     }
     
     return () => {
-      if (fileBlobUrl) {
-        URL.revokeObjectURL(fileBlobUrl)
-        setFileBlobUrl(null)
-      }
+      setMediaUrl(null)
     }
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [material.id])
@@ -151,26 +149,12 @@ function MaterialViewer({ material, index }) {
     }
   }
 
-  const loadFileAsBlob = async () => {
+  const loadMediaUrl = async () => {
     try {
       setLoading(true)
-      const token = getToken()
-      const API_BASE = import.meta.env.DEV ? '/api' : ''
-      const url = `${API_BASE}/materials/${material.id}/file`
-      
-      const response = await fetch(url, {
-        headers: {
-          'Authorization': `Bearer ${token}`
-        }
-      })
-      
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`)
-      }
-      
-      const blob = await response.blob()
-      const blobUrl = URL.createObjectURL(blob)
-      setFileBlobUrl(blobUrl)
+      // Подписанная ссылка: браузер загружает видео и аудио частями (Range), а не целиком
+      const { url, hls_url: hlsUrl } = await api.getMaterialUrl(material.id)
+      setMediaUrl(hlsUrl && supportsNativeHls() ? hlsUrl : url)
     } catch (err) {
       console.error('Ошибка загрузки файла:', err)
       setError('Не удалось загрузить файл.')
@@ -225,7 +209,7 @@ function MaterialViewer({ material, index }) {
           return <div className="loading-file">Загрузка видео...</div>
         }
         
-        if (error || !fileBlobUrl) {
+        if (error || !mediaUrl) {
           return (
             <div className="error-file">
               <p>{error || 'Не удалось загрузить видео'}</p>
@@ -242,7 +226,7 @@ function MaterialViewer({ material, index }) {
                 preload="metadata"
                 loading="lazy"
               >
-                <source src={fileBlobUrl} type={videoType} />
+                <source src={mediaUrl} type={mediaSourceType(mediaUrl, videoType)} />
                 Ваш браузер не поддерживает воспроизведение видео.
               </video>
             </div>
@@ -325,7 +309,7 @@ function MaterialViewer({ material, index }) {
           return <div className="loading-file">Загрузка аудио...</div>
         }
         
-        if (error || !fileBlobUrl) {
+        if (error || !mediaUrl) {
           return (
             <div className="error-file">
               <p>{error || 'Не удалось загрузить аудио'}</p>
@@ -336,9 +320,9 @@ function MaterialViewer({ material, index }) {
         return (
           <div className="audio-player-wrapper">
             <audio controls className="audio-player">
-              <source src={fileBlobUrl} type="audio/mpeg" />
-              <source src={fileBlobUrl} type="audio/wav" />
-              <source src={fileBlobUrl} type="audio/ogg" />
+              <source src={mediaUrl} type="audio/mpeg" />
+              <source src={mediaUrl} type="audio/wav" />
+              <source src={mediaUrl} type="audio/ogg" />
               Ваш браузер не поддерживает воспроизведение аудио.
             </audio>
           </div>
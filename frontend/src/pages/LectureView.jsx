@@ -4,6 +4,7 @@ import api from '../services/api'
 import { useAuth } from '../hooks/useAuth'
 import { useNavigation } from '../hooks/useNavigation'
 import { parseDeadline } from '../utils/dateUtils'
+import { mediaSourceType, supportsNativeHls } from '../utils/mediaUtils'
 import Breadcrumbs from '../components/common/Breadcrumbs'
 import TestCard from '../components/assignments/TestCard'
 import '../styles/lecture-view.css'
@@ -509,9 +510,8 @@ function TestResultsViewer({ attempts, lecture, onClose }) {
 }
 
 function MaterialViewer({ material, index, lecture }) {
-  const { getToken } = useAuth()
   const [fileText, setFileText] = useState(null)
-  const [fileBlobUrl, setFileBlobUrl] = useState(null)
+  const [mediaUrl, setMediaUrl] = useState(null)
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState(null)
   const [transcript, setTranscript] = useState(null)
@@ -524,20 +524,14 @@ function MaterialViewer({ material, index, lecture }) {
       loadFileText()
     }
     
-    // Загружаем файлы (видео, аудио) через blob URL для поддержки авторизации
+    // Для видео и аудио получаем подписанную ссылку (плеер не передает заголовок авторизации)
     if (material.file_type === 'video' || material.file_type === 'audio') {
-      loadFileAsBlob()
+      loadMediaUrl()
     }
     
-    // Cleanup blob URL при размонтировании или изменении material
+    // Сбрасываем ссылку при размонтировании или изменении material
     return () => {
-      // Используем текущее значение fileBlobUrl через замыкание
-      setFileBlobUrl(prevUrl => {
-        if (prevUrl) {
-          URL.revokeObjectURL(prevUrl)
-        }
-        return null
-      })
+      setMediaUrl(null)
     }
   }, [material.id, material.file_type])
 
@@ -561,26 +555,12 @@ function MaterialViewer({ material, index, lecture }) {
     }
   }
 
-  const loadFileAsBlob = async () => {
+  const loadMediaUrl = async () => {
     try {
       setLoading(true)
-      const token = getToken()
-      const API_BASE = import.meta.env.DEV ? '/api' : ''
-      const url = `${API_BASE}/materials/${material.id}/file`
-      
-      const response = await fetch(url, {
-        headers: {
-          'Authorization': `Bearer ${token}`
-        }
-      })
-      
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`)
-      }
-      
-      const blob = await response.blob()
-      const blobUrl = URL.createObjectURL(blob)
-      setFileBlobUrl(blobUrl)
+      // Подписанная ссылка: браузер загружает видео и аудио частями (Range), а не целиком
+      const { url, hls_url: hlsUrl } = await api.getMaterialUrl(material.id)
+      setMediaUrl(hlsUrl && supportsNativeHls() ? hlsUrl : url)
     } catch (err) {
       console.error('Ошибка загрузки файла:', err)
       setError('Не удалось загрузить файл.')
@@ -636,7 +616,7 @@ function MaterialViewer({ material, index, lecture }) {
           return <div className="loading-file">Загрузка видео...</div>
         }
         
-        if (error || !fileBlobUrl) {
+        if (error || !mediaUrl) {
           return (
             <div className="error-file">
               <p>{error || 'Не удалось загрузить видео'}</p>
@@ -669,7 +649,7 @@ function MaterialViewer({ material, index, lecture }) {
                   })
                 }}
               >
-                <source src={fileBlobUrl} type={videoType} />
+                <source src={mediaUrl} type={mediaSourceType(mediaUrl, videoType)} />
                 Ваш браузер не поддерживает воспроизведение видео.
               </video>
             </div>
@@ -771,7 +751,7 @@ function MaterialViewer({ material, index, lecture }) {
           return <div className="loading-file">Загрузка аудио...</div>
         }
         
-        if (error || !fileBlobUrl) {
+        if (error || !mediaUrl) {
           return (
             <div className="error-file">
               <p>{error || 'Не удалось загрузить аудио'}</p>
@@ -782,9 +762,9 @@ function MaterialViewer({ material, index, lecture }) {
         return (
           <div className="audio-player-wrapper">
             <audio controls className="audio-player">
-              <source src={fileBlobUrl} type="audio/mpeg" />
-              <source src={fileBlobUrl} type="audio/wav" />
-              <source src={fileBlobUrl} type="audio/ogg" />
+              <source src={mediaUrl} type="audio/mpeg" />
+              <source src={mediaUrl} type="audio/wav" />
+              <source src={mediaUrl} type="audio/ogg" />
               Ваш браузер не поддерживает воспроизведение аудио.
             </audio>
           </div>
@@ -1,5 +1,10 @@
 import storage from './storage'
 
+// Файлы больше этого размера загружаются частями (возобновляемая загрузка)
+const RESUMABLE_UPLOAD_THRESHOLD = 8 * 1024 * 1024
+// Количество повторов отправки части при ошибке сети
+const UPLOAD_CHUNK_RETRIES = 5
+
 class ApiClient {
   constructor() {
     this.baseURL = '/api'
@@ -320,7 +325,56 @@ class ApiClient {
     })
   }
 
-  async uploadMaterial(lectureId, file) {
+  // Прогресс обработки лекции (Server-Sent Events). EventSource не передает заголовок Authorization,
+  // поэтому поток читается через fetch. Завершается после события published или failed либо по signal.
+  async streamLectureEvents(lectureId, onEvent, signal) {
+    const token = storage.getToken()
+    const response = await fetch(`${this.baseURL}/lectures/${lectureId}/events`, {
+      headers: {
+        'Authorization': `Bearer ${token}`,
+        'Accept': 'text/event-stream'
+      },
+      signal
+    })
+
+    if (response.status === 401) {
+      this.handleUnauthorized() // Бросает исключение, выполнение прерывается
+    }
+
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    for (;;) {
+      const { value, done } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+      // События разделены пустой строкой; комментарии (пульс) начинаются с ':'
+      let boundary
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const message = buffer.slice(0, boundary)
+        buffer = buffer.slice(boundary + 2)
+        const data = message
+          .split('\n')
+          .filter(line => line.startsWith('data:'))
+          .map(line => line.slice(5).trim())
+          .join('\n')
+        if (data) {
+          onEvent(JSON.parse(data))
+        }
+      }
+    }
+  }
+
+  async uploadMaterial(lectureId, file, onProgress) {
+    // Большие файлы загружаем частями, чтобы после обрыва соединения продолжить с места остановки
+    if (file.size > RESUMABLE_UPLOAD_THRESHOLD) {
+      return this.uploadMaterialResumable(lectureId, file, onProgress)
+    }
+
     const token = storage.getToken()
     const formData = new FormData()
     formData.append('file', file)
@@ -348,6 +402,44 @@ class ApiClient {
     return data
   }
 
+  async uploadMaterialResumable(lectureId, file, onProgress) {
+    const session = await this.request(`/lectures/${lectureId}/uploads`, {
+      method: 'POST',
+      body: JSON.stringify({ file_name: file.name, file_size: file.size })
+    })
+
+    let offset = session.offset
+    let retries = 0
+    while (offset < file.size) {
+      const chunk = file.slice(offset, offset + session.chunk_size)
+      try {
+        const result = await this.request(`/uploads/${session.upload_id}?offset=${offset}`, {
+          method: 'PUT',
+          headers: { 'Content-Type': 'application/octet-stream' },
+          body: chunk
+        })
+        offset = result.offset
+        retries = 0
+        if (onProgress) {
+          onProgress(offset / file.size)
+        }
+      } catch (err) {
+        if (err.message.startsWith('Unauthorized') || retries >= UPLOAD_CHUNK_RETRIES) {
+          throw err
+        }
+        retries += 1
+        // Узнаем, сколько байт сервер успел сохранить, и продолжаем с этого места
+        await new Promise(resolve => setTimeout(resolve, 1000 * retries))
+        const state = await this.request(`/uploads/${session.upload_id}`)
+        offset = state.offset
+      }
+    }
+
+    return this.request(`/uploads/${session.upload_id}/complete`, {
+      method: 'POST'
+    })
+  }
+
   async deleteMaterial(lectureId, materialId) {
     return this.request(`/lectures/${lectureId}/materials/${materialId}`, {
       method: 'DELETE'
@@ -361,6 +453,16 @@ class ApiClient {
     })
   }
 
+  async getMaterialUrl(materialId) {
+    // Подписанная ссылка на файл: плеер запрашивает по ней файл частями без заголовка авторизации
+    const data = await this.request(`/materials/${materialId}/url`)
+    return {
+      ...data,
+      url: `${this.baseURL}${data.url}`,
+      hls_url: data.hls_url ? `${this.baseURL}${data.hls_url}` : null
+    }
+  }
+
   async getMaterialContent(materialId) {
     const token = storage.getToken()
     const response = await fetch(`${this.baseURL}/materials/${materialId}/content`, {
@@ -421,12 +523,34 @@ class ApiClient {
     })
   }
 
+  async regenerateLectureTest(lectureId) {
+    return this.request(`/tests/lectures/${lectureId}/test/regenerate`, {
+      method: 'POST'
+    })
+  }
+
   async getTestAttempts(lectureId) {
     return this.request(`/tests/lectures/${lectureId}/test/attempts`)
   }
 
-  async getAllTestAttempts(lectureId) {
-    return this.request(`/tests/lectures/${lectureId}/test/all-attempts`)
+  async getTestGradebook(lectureId, params = {}) {
+    const query = new URLSearchParams()
+    Object.entries(params).forEach(([key, value]) => {
+      if (value !== undefined && value !== null && value !== '') {
+        query.append(key, value)
+      }
+    })
+    const queryString = query.toString()
+    return this.request(`/tests/lectures/${lectureId}/test/gradebook${queryString ? `?${queryString}` : ''}`)
+  }
+
+  // Поиск по материалам курса; signal позволяет отменить устаревший запрос при наборе текста
+  async searchCourse(courseId, q, { limit, signal } = {}) {
+    const query = new URLSearchParams({ q })
+    if (limit) {
+      query.append('limit', limit)
+    }
+    return this.request(`/courses/${courseId}/search?${query.toString()}`, { signal })
   }
 }
 
@@ -0,0 +1,28 @@
+/**
+ * Утилиты для воспроизведения видео и аудио материалов
+ */
+
+const HLS_MIME_TYPE = 'application/vnd.apple.mpegurl'
+
+/**
+ * Проверяет, умеет ли браузер воспроизводить HLS без дополнительных библиотек (Safari, iOS, Android)
+ * @returns {boolean}
+ */
+export function supportsNativeHls() {
+  if (typeof document === 'undefined') return false
+  const video = document.createElement('video')
+  return video.canPlayType(HLS_MIME_TYPE) !== ''
+}
+
+/**
+ * Тип источника для тега <source>: для HLS плейлиста - тип HLS, иначе переданный тип
+ * @param {string|null} url - Ссылка на файл
+ * @param {string} fallbackType - Тип по расширению исходного файла
+ * @returns {string}
+ */
+export function mediaSourceType(url, fallbackType) {
+  if (url && url.split('?')[0].endsWith('.m3u8')) {
+    return HLS_MIME_TYPE
+  }
+  return fallbackType
+}
@@ -62,10 +62,10 @@ static_dir = Path("static")
 if static_dir.exists():
     app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Подключение статических файлов для загруженных материалов
+# Загруженные материалы не раздаются как статика: доступ только через
+# /materials/{id}/file (с проверкой прав) или по подписанным ссылкам /media/...
 uploads_dir = Path("uploads")
 uploads_dir.mkdir(exist_ok=True)  # Создаем директорию, если её нет
-app.mount("/uploads", StaticFiles(directory=str(uploads_dir.absolute())), name="uploads")
 
 # Подключение роутеров
 app.include_router(api_router)
@@ -168,6 +168,14 @@ async def startup_event():
     # Запускаем предзагрузку в отдельном потоке, чтобы не блокировать старт приложения
     threading.Thread(target=preload_whisper_model, daemon=True).start()
     logger.info("Запущена предзагрузка модели Whisper в фоновом режиме")
+    
+    # Продолжаем прерванную перевекторизацию или запускаем её после смены модели эмбеддингов
+    from app.utils.reembedding import resume_reembedding
+    threading.Thread(target=resume_reembedding, daemon=True).start()
+    
+    # События обработки лекций из других процессов приложения (PostgreSQL LISTEN)
+    from app.utils.lecture_events import start_event_listener
+    start_event_listener()
 
 
 if __name__ == "__main__":
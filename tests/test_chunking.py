@@ -0,0 +1,122 @@
+"""
+Свойства разбиения текста на чанки (app/utils/chunking.py) на случайных текстах:
+лимит токенов, покрытие текста по порядку, источник чанка и границы страниц и слайдов.
+"""
+import random
+
+import pytest
+
+from app.utils.chunking import STRUCTURAL_MIN_FILL, chunk_blocks, chunk_text, estimate_tokens
+from app.utils.documents import BLOCK_SEPARATOR, TextBlock
+
+WORDS = [
+    "лекция", "материал", "студент", "преподаватель", "вычислительная", "сложность", "алгоритма",
+    "граф", "вершина", "ребро", "matrix", "vector", "gradient", "O(n)", "2024", "т.е.", "—",
+    "электроэнцефалография", "сверхвысокочастотный",
+]
+ENDINGS = [". ", "! ", "? ", "… ", ".\n", "\n\n", ", ", "; "]
+
+SEEDS = range(20)
+LIMITS = [(20, 5), (50, 10), (120, 30), (400, 60)]
+
+
+def random_text(rng: random.Random, words: int) -> str:
+    """Текст из предложений разной длины, в том числе без знаков препинания (как в транскриптах)"""
+    parts = []
+    for _ in range(words):
+        parts.append(rng.choice(WORDS))
+        parts.append(rng.choice(ENDINGS) if rng.random() < 0.08 else " ")
+    return "".join(parts).strip()
+
+
+def random_blocks(rng: random.Random, kind: str, count: int, words: int) -> tuple[str, list]:
+    """Блоки документа со смещениями в тексте, склеенном через BLOCK_SEPARATOR (как в iter_document_blocks)"""
+    blocks = []
+    offset = 0
+    for index in range(1, count + 1):
+        text = random_text(rng, rng.randint(1, words))
+        if blocks:
+            offset += len(BLOCK_SEPARATOR)
+        blocks.append(TextBlock(text, kind, index, offset))
+        offset += len(text)
+    return BLOCK_SEPARATOR.join(block.text for block in blocks), blocks
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("max_tokens,overlap_tokens", LIMITS)
+def test_chunks_fit_token_limit(seed, max_tokens, overlap_tokens):
+    text = random_text(random.Random(seed), 2000)
+    chunks = chunk_text(text, max_tokens, overlap_tokens)
+
+    assert chunks
+    for chunk in chunks:
+        assert chunk.token_count <= max_tokens
+        assert estimate_tokens(chunk.text) == chunk.token_count
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("max_tokens,overlap_tokens", LIMITS)
+def test_chunks_cover_text_in_order(seed, max_tokens, overlap_tokens):
+    text = random_text(random.Random(seed), 2000)
+    chunks = chunk_text(text, max_tokens, overlap_tokens)
+
+    assert [chunk.chunk_index for chunk in chunks] == list(range(len(chunks)))
+    assert not text[:chunks[0].start_offset].strip()
+    assert not text[chunks[-1].end_offset:].strip()
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # Чанки идут по тексту, между ними нет пропущенного текста (только пробелы)
+        assert previous.start_offset < chunk.start_offset
+        assert previous.end_offset < chunk.end_offset
+        assert not text[previous.end_offset:chunk.start_offset].strip()
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("max_tokens,overlap_tokens", LIMITS)
+def test_chunk_offsets_slice_back_to_text(seed, max_tokens, overlap_tokens):
+    text, blocks = random_blocks(random.Random(seed), "paragraph", 30, 200)
+    chunks = list(chunk_blocks(blocks, max_tokens, overlap_tokens))
+
+    assert chunks
+    for chunk in chunks:
+        # Текст чанка отличается от исходного только пробелами между предложениями и блоками
+        assert chunk.text.split() == text[chunk.start_offset:chunk.end_offset].split()
+        assert blocks[chunk.first_block - 1].offset <= chunk.start_offset
+        last_block = blocks[chunk.last_block - 1]
+        assert chunk.end_offset <= last_block.offset + len(last_block.text)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("kind", ["page", "slide"])
+@pytest.mark.parametrize("max_tokens,overlap_tokens", LIMITS)
+def test_chunks_respect_structural_boundaries(seed, kind, max_tokens, overlap_tokens):
+    _, blocks = random_blocks(random.Random(seed), kind, 30, 300)
+    chunks = list(chunk_blocks(blocks, max_tokens, overlap_tokens))
+    min_fill = max_tokens * STRUCTURAL_MIN_FILL
+
+    for chunk in chunks:
+        assert chunk.block_kind == kind
+        # Чанк продолжается на следующую страницу, только если к её началу был заполнен меньше чем наполовину
+        parts = chunk.text.split(BLOCK_SEPARATOR)
+        assert len(parts) == chunk.last_block - chunk.first_block + 1
+        for end in range(1, len(parts)):
+            assert estimate_tokens(BLOCK_SEPARATOR.join(parts[:end])) < min_fill
+
+    for previous, chunk in zip(chunks, chunks[1:]):
+        last_block = blocks[previous.last_block - 1]
+        closed_at_boundary = previous.end_offset == last_block.offset + len(last_block.text)
+        if closed_at_boundary and previous.token_count >= min_fill:
+            # Перекрытие не переносит предложения через закрытую границу страницы
+            assert chunk.first_block > previous.last_block
+
+
+def test_paragraph_boundaries_do_not_close_chunks():
+    _, blocks = random_blocks(random.Random(0), "paragraph", 50, 5)
+    chunks = list(chunk_blocks(blocks, 400, 60))
+
+    assert len(chunks) < len(blocks)
+    assert any(chunk.first_block != chunk.last_block for chunk in chunks)
+
+
+def test_empty_text_has_no_chunks():
+    assert chunk_text("") == []
+    assert chunk_text(" \n\n ") == []